@@ -0,0 +1,237 @@
+import os
+import logging
+import json
+import time
+import shutil
+import hashlib
+import tempfile
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+def content_digest(content):
+    return hashlib.sha256(content if isinstance(content, bytes) else content.encode('utf-8')).hexdigest()
+
+
+def cache_key(content_hash, extension, model_name, prompt_version):
+    # Anything that changes the LLM output must be part of the key
+    h = hashlib.sha256()
+    for part in (content_hash, model_name, str(prompt_version), extension.lower()):
+        h.update(part.encode('utf-8'))
+        h.update(b'\0')
+    return h.hexdigest()
+
+
+class AnalysisCache:
+    """On-disk store of analyze_code results keyed by content hash.
+
+    Each entry is a directory holding meta.json and, when a flowchart was
+    rendered, its SVG master and derived PNGs as flowchart.<suffix>. Entries
+    expire after max_age seconds and the least recently used ones are dropped
+    once the cache exceeds max_bytes.
+    """
+
+    META_FILE = 'meta.json'
+    FLOWCHART_PREFIX = 'flowchart.'
+
+    def __init__(self, root, max_bytes=200 * 1024 * 1024, max_age=7 * 24 * 3600):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        os.makedirs(self.root, exist_ok=True)
+
+    def _entry_dir(self, key):
+        return os.path.join(self.root, key[:2], key)
+
+    def get(self, key):
+        entry_dir = self._entry_dir(key)
+        meta_path = os.path.join(entry_dir, self.META_FILE)
+        try:
+            if time.time() - os.path.getmtime(meta_path) > self.max_age:
+                self._remove(entry_dir)
+                raise FileNotFoundError(meta_path)
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            flowchart = {
+                suffix: os.path.join(entry_dir, self.FLOWCHART_PREFIX + suffix)
+                for suffix in data.get('flowchart_files', [])
+            }
+            # Entries written before flowcharts had several files are misses
+            if data.get('has_flowchart') and not flowchart:
+                raise FileNotFoundError(entry_dir)
+            for path in flowchart.values():
+                if not os.path.exists(path):
+                    raise FileNotFoundError(path)
+            # Touch so LRU eviction sees the entry as recently used
+            os.utime(meta_path, None)
+        except (OSError, ValueError):
+            with self._lock:
+                self.misses += 1
+            return None
+
+        with self._lock:
+            self.hits += 1
+        data['cached_flowchart'] = flowchart if data.get('has_flowchart') else None
+        return data
+
+    def put(self, key, summary, description, mermaid, flowchart_files=None):
+        # flowchart_files maps a suffix such as 'svg' or 'web.png' to a path
+        entry_dir = self._entry_dir(key)
+        tmp_dir = None
+        try:
+            os.makedirs(os.path.dirname(entry_dir), exist_ok=True)
+            tmp_dir = tempfile.mkdtemp(prefix=f"{key}.", suffix='.tmp', dir=os.path.dirname(entry_dir))
+            flowchart_files = flowchart_files or {}
+            for suffix, path in flowchart_files.items():
+                shutil.copyfile(path, os.path.join(tmp_dir, self.FLOWCHART_PREFIX + suffix))
+            with open(os.path.join(tmp_dir, self.META_FILE), 'w', encoding='utf-8') as f:
+                json.dump({
+                    'summary': summary,
+                    'description': description,
+                    'mermaid': mermaid,
+                    'has_flowchart': bool(flowchart_files),
+                    'flowchart_files': sorted(flowchart_files),
+                    'created': time.time()
+                }, f)
+            # Swap the finished entry in so readers never see a partial one
+            self._remove(entry_dir)
+            os.replace(tmp_dir, entry_dir)
+        except OSError as e:
+            logger.error("Error writing analysis cache entry %s: %s", key, e)
+            if tmp_dir:
+                self._remove(tmp_dir)
+            return
+        self.evict()
+
+    def evict(self):
+        now = time.time()
+        entries = []
+        total = 0
+        with self._lock:
+            for bucket in os.listdir(self.root):
+                bucket_dir = os.path.join(self.root, bucket)
+                if not os.path.isdir(bucket_dir):
+                    continue
+                for key in os.listdir(bucket_dir):
+                    entry_dir = os.path.join(bucket_dir, key)
+                    try:
+                        last_used = os.path.getmtime(os.path.join(entry_dir, self.META_FILE))
+                        size = sum(e.stat().st_size for e in os.scandir(entry_dir) if e.is_file())
+                    except OSError:
+                        continue
+                    if now - last_used > self.max_age:
+                        self._remove(entry_dir)
+                        self.evictions += 1
+                        continue
+                    entries.append((last_used, size, entry_dir))
+                    total += size
+
+            entries.sort()
+            while total > self.max_bytes and entries:
+                _, size, entry_dir = entries.pop(0)
+                self._remove(entry_dir)
+                self.evictions += 1
+                total -= size
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_ratio': round(self.hits / lookups, 3) if lookups else 0.0
+            }
+
+    @staticmethod
+    def _remove(path):
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def section_key(section, inputs, model_name, prompt_version):
+    # inputs holds everything the section's prompt is built from
+    h = hashlib.sha256()
+    for part in (section, model_name, str(prompt_version), json.dumps(inputs, sort_keys=True)):
+        h.update(part.encode('utf-8'))
+        h.update(b'\0')
+    return h.hexdigest()
+
+
+class SectionCache:
+    """On-disk store of generated report sections keyed by their inputs.
+
+    Entries are small JSON files, root/key[:2]/key.json, dropped once they
+    have not been used for max_age seconds.
+    """
+
+    def __init__(self, root, max_age=7 * 24 * 3600):
+        self.root = root
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(self.root, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.root, key[:2], f"{key}.json")
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            if time.time() - os.path.getmtime(path) > self.max_age:
+                os.remove(path)
+                raise FileNotFoundError(path)
+            with open(path, 'r', encoding='utf-8') as f:
+                text = json.load(f)['text']
+            os.utime(path, None)
+        except (OSError, ValueError, KeyError):
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return text
+
+    def put(self, key, text):
+        path = self._path(key)
+        tmp_path = None
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(prefix=f"{key}.", suffix='.tmp', dir=os.path.dirname(path))
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump({'text': text, 'created': time.time()}, f)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.error("Error writing section cache entry %s: %s", key, e)
+            if tmp_path:
+                try:
+                    os.remove(tmp_path)
+                except OSError:
+                    pass
+            return
+        self.evict()
+
+    def evict(self):
+        now = time.time()
+        for dirpath, _, filenames in os.walk(self.root):
+            for name in filenames:
+                path = os.path.join(dirpath, name)
+                try:
+                    if now - os.path.getmtime(path) > self.max_age:
+                        os.remove(path)
+                except OSError:
+                    pass
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': round(self.hits / lookups, 3) if lookups else 0.0
+            }
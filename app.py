@@ -1,166 +1,1019 @@
-from flask import Flask, request, render_template, flash, redirect, url_for, session, send_from_directory, send_file
+import time
+
+# Start of a cold boot, for the startup time reported by create_app
+IMPORT_STARTED = time.perf_counter()
+
+from flask import (Flask, Blueprint, request, render_template, flash, redirect, url_for, session, send_file, jsonify, g,
+                   abort, current_app, stream_with_context)
 import os
+import hashlib
 import shutil
 import json
 import subprocess
-import traceback
+import tempfile
 import io
-from docx import Document
-from docx.shared import Pt, Inches, RGBColor
-from docx.oxml.ns import qn
-from docx.oxml import OxmlElement
+import copy
+import logging
+import functools
+import threading
+from xml.sax.saxutils import escape
 import datetime
-from reportlab.lib.pagesizes import letter
-from reportlab.pdfgen import canvas
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.platypus import Paragraph
-from reportlab.lib.units import inch
-from PIL import Image
 from dotenv import load_dotenv
-import google.generativeai as genai
 import re
-import docx
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from analysis_cache import AnalysisCache, SectionCache, cache_key, section_key, content_digest
+from jobs import JobManager
+from renderer import MermaidRenderer, RendererUnavailable
+from llm import GeminiBackend, AnthropicBackend, LocalBackend, HedgedBackend
+from flowcharts import (
+    variant_path, flowchart_files, is_rendered, svg_width, write_raster_variants, svg_drawing, SingleFlight
+)
+from uploads import StreamingUploadRequest
+from workspaces import WorkspaceManager
+from sessions import ServerSideSessionInterface, SQLiteSessionStore
+from pyflow import python_flowchart
+from mermaid_graph import MermaidError, canonical_flowchart
+from archives import ArchiveError, ArchiveLimits, extract_archive, member_path
+from priority import prioritize
+from chunking import split_source, merge_flowcharts
+from ratelimit import RateLimiter
+from metrics import Metrics
+from werkzeug.exceptions import RequestEntityTooLarge
+from werkzeug.security import safe_join
+from werkzeug.local import LocalProxy
+
+# python-docx, reportlab and PIL are imported inside the functions that build
+# documents, and the LLM SDKs by the first call, so workers boot without them
+
+logger = logging.getLogger(__name__)
+
+# Width flowcharts are shown at in the exports
+PDF_FLOWCHART_WIDTH = 400  # points
+DOCX_FLOWCHART_WIDTH = 5  # inches
+
+bp = Blueprint('main', __name__)
+
+class Services:
+    """What create_app builds for one app, kept in app.extensions['eleventh_hour'].
+
+    They hold thread pools, a browser pool and open files. The module-level
+    names below are proxies to the current app's services, so code running
+    on another thread needs the app context; bind() carries it over.
+    """
+
+    def __init__(self, llm, analysis_cache, section_cache, flowchart_cache, job_manager, workspaces,
+                 mermaid_config, mermaid_renderer, metrics):
+        self.llm = llm
+        self.analysis_cache = analysis_cache
+        self.section_cache = section_cache
+        self.flowchart_cache = flowchart_cache
+        self.job_manager = job_manager
+        self.workspaces = workspaces
+        self.mermaid_config = mermaid_config
+        self.mermaid_renderer = mermaid_renderer
+        self.metrics = metrics
+        # Flowcharts are rendered on first use; concurrent requests for one
+        # chart share a render. A chart that failed is not retried for
+        # RENDER_RETRY_SECONDS unless its source changes; render_failures maps
+        # svg_path to (source mtime, time of failure), oldest first, and keeps
+        # the latest RENDER_FAILURES_MAX
+        self.render_flights = SingleFlight()
+        self.render_failures = {}
+        self.render_failures_lock = threading.Lock()
+        # Concurrent requests for one PDF or Word download share a build
+        self.document_flights = SingleFlight()
+        # Seconds spent importing this module and in create_app
+        self.startup_seconds = {}
+
+def services():
+    return current_app.extensions['eleventh_hour']
+
+def service(name):
+    return LocalProxy(lambda: getattr(services(), name))
+
+llm = service('llm')
+analysis_cache = service('analysis_cache')
+section_cache = service('section_cache')
+flowchart_cache = service('flowchart_cache')
+job_manager = service('job_manager')
+workspaces = service('workspaces')
+mermaid_renderer = service('mermaid_renderer')
+metrics = service('metrics')
+render_flights = service('render_flights')
+render_failures = service('render_failures')
+render_failures_lock = service('render_failures_lock')
+document_flights = service('document_flights')
+
+def build_metrics(trace_log):
+    metrics = Metrics(trace_log=trace_log)
+    metrics.describe('stage_duration_seconds', 'histogram', 'Time spent in each pipeline stage')
+    metrics.describe('stage_errors_total', 'counter', 'Pipeline stages that raised')
+    metrics.describe('http_request_duration_seconds', 'histogram', 'Time to produce a response, by endpoint')
+    metrics.describe('llm_tokens_total', 'counter', 'LLM tokens used, from response usage metadata')
+    metrics.describe('analysis_fallbacks_total', 'counter', 'Files that fell back to the placeholder analysis')
+    metrics.describe('renderer_fallbacks_total', 'counter', 'Renders that fell back from the browser pool to mmdc')
+    metrics.describe('flowchart_render_failures_total', 'counter', 'Flowcharts that could not be rendered on first use')
+    metrics.describe('mermaid_invalid_total', 'counter', 'LLM flowcharts rejected by the Mermaid validator')
+    metrics.describe('mermaid_repairs_total', 'counter', 'Lines dropped or fixed while parsing LLM flowcharts')
+    metrics.describe('cache_hits_total', 'counter', 'Analysis, report section and flowchart cache hits')
+    metrics.describe('cache_misses_total', 'counter', 'Analysis, report section and flowchart cache misses')
+    metrics.describe('llm_queued_requests', 'gauge', 'LLM calls waiting for the rate limiter')
+    metrics.describe('llm_throttled_total', 'counter', 'Rate-limit backoffs')
+    metrics.describe('llm_retries_total', 'counter', 'Retried LLM calls')
+    metrics.describe('llm_hedged_total', 'counter', 'LLM calls also sent to the hedge backend')
+    metrics.describe('llm_hedge_wins_total', 'counter', 'Hedged LLM calls answered first by the hedge backend')
+    metrics.describe('llm_hedge_deadline_seconds', 'gauge', 'Wait before a call is hedged, from recent primary latency')
+    metrics.describe('document_cache_hits_total', 'counter', 'PDF and Word downloads served from an earlier build')
+    metrics.describe('app_startup_seconds', 'gauge', 'Time this worker took to import app.py and run create_app, by phase')
+    metrics.describe('process_info', 'gauge', 'Process id of the worker that served this scrape')
+    return metrics
+
+def load_config(app):
+    # Each session gets its own workspace directory under UPLOAD_FOLDER
+    app.config['UPLOAD_FOLDER'] = os.getenv('UPLOAD_FOLDER', './uploads')
+    app.config['WORKSPACE_TTL'] = int(os.getenv('WORKSPACE_TTL_MINUTES', 120)) * 60
+    app.config['WORKSPACE_MAX_BYTES'] = int(os.getenv('WORKSPACE_MAX_MB', 500)) * 1024 * 1024
+    app.config['WORKSPACE_SWEEP_INTERVAL'] = int(os.getenv('WORKSPACE_SWEEP_SECONDS', 300))
+    # Parts are streamed here while a form is parsed; keep it on the same
+    # filesystem as UPLOAD_FOLDER so files can be moved into place
+    app.config['UPLOAD_STAGING_FOLDER'] = os.getenv('UPLOAD_STAGING_FOLDER', './.upload_staging')
+    app.config['UPLOAD_MAX_BYTES'] = int(os.getenv('UPLOAD_MAX_MB', 10)) * 1024 * 1024  # across all loose files
+    app.config['UPLOAD_MAX_FILES'] = int(os.getenv('UPLOAD_MAX_FILES', 20))
+    # Zip and tar archives of a whole repository are counted apart from loose
+    # files and extracted as they are read; ARCHIVE_* cap what they expand to
+    app.config['UPLOAD_ARCHIVE_MAX_BYTES'] = int(os.getenv('UPLOAD_ARCHIVE_MAX_MB', 50)) * 1024 * 1024
+    app.config['ARCHIVE_MAX_EXTRACTED_BYTES'] = int(os.getenv('ARCHIVE_MAX_EXTRACTED_MB', 200)) * 1024 * 1024
+    app.config['ARCHIVE_MAX_FILES'] = int(os.getenv('ARCHIVE_MAX_FILES', 200))
+    app.config['ARCHIVE_MAX_FILE_BYTES'] = int(os.getenv('ARCHIVE_MAX_FILE_KB', 512)) * 1024
+    # Reject oversized requests from the Content-Length header before reading the
+    # body; the slack covers multipart boundaries and headers
+    app.config['MAX_CONTENT_LENGTH'] = app.config['UPLOAD_MAX_BYTES'] + app.config['UPLOAD_ARCHIVE_MAX_BYTES'] + 256 * 1024
+    app.config['ALLOWED_EXTENSIONS'] = {'.py', '.js', '.jsx', '.ts', '.tsx', '.css', '.java', '.c', '.cpp', '.h', '.cs', '.go', '.rb', '.php', '.html'}
+    app.config['ANALYSIS_CONCURRENCY'] = int(os.getenv('ANALYSIS_CONCURRENCY', 4))
+    # LLM provider for analysis and report text: gemini, anthropic or local
+    # (deterministic answers, no network). With LLM_HEDGE_BACKEND set, calls the
+    # primary has not answered within its p95 latency also go to that backend.
+    app.config['LLM_BACKEND'] = os.getenv('LLM_BACKEND', 'gemini')
+    app.config['LLM_HEDGE_BACKEND'] = os.getenv('LLM_HEDGE_BACKEND', '')
+    app.config['LLM_HEDGE_PERCENTILE'] = float(os.getenv('LLM_HEDGE_PERCENTILE', 95))
+    app.config['LLM_HEDGE_INITIAL_DELAY'] = float(os.getenv('LLM_HEDGE_INITIAL_DELAY', 10))
+    app.config['GEMINI_MODEL'] = os.getenv('GEMINI_MODEL', 'gemini-1.5-pro')
+    app.config['ANTHROPIC_MODEL'] = os.getenv('ANTHROPIC_MODEL', 'claude-3-5-sonnet-latest')
+    app.config['LOCAL_LLM_LATENCY'] = float(os.getenv('LOCAL_LLM_LATENCY', 0))
+    # Client-side quota for the whole deployment. Each worker process keeps
+    # its own limiter, so build_backend gives each an equal share; gunicorn
+    # also reads WEB_CONCURRENCY as its worker count.
+    app.config['WORKER_PROCESSES'] = max(1, int(os.getenv('WEB_CONCURRENCY', 1)))
+    app.config['GEMINI_RPM'] = int(os.getenv('GEMINI_RPM', 60))
+    app.config['GEMINI_TPM'] = int(os.getenv('GEMINI_TPM', 1000000))
+    app.config['GEMINI_MAX_RETRIES'] = int(os.getenv('GEMINI_MAX_RETRIES', 5))
+    app.config['ANTHROPIC_RPM'] = int(os.getenv('ANTHROPIC_RPM', 50))
+    app.config['ANTHROPIC_TPM'] = int(os.getenv('ANTHROPIC_TPM', 400000))
+    app.config['ANTHROPIC_MAX_RETRIES'] = int(os.getenv('ANTHROPIC_MAX_RETRIES', 5))
+    # Stream LLM output so partial summaries reach the analysis page early
+    app.config['LLM_STREAMING'] = os.getenv('LLM_STREAMING', '1') == '1'
+    app.config['STREAM_UPDATE_INTERVAL'] = float(os.getenv('STREAM_UPDATE_INTERVAL', 0.3))
+    # An open progress stream holds a server thread, so it is closed after
+    # this long and the page opens a new one
+    app.config['STREAM_MAX_SECONDS'] = float(os.getenv('STREAM_MAX_SECONDS', 30))
+    # Bump whenever the analyze_code prompt or post-processing changes so cached
+    # results from the old prompt are not reused
+    app.config['ANALYSIS_PROMPT_VERSION'] = 5
+    # Files longer than this are split along function/class/block boundaries and
+    # analyzed chunk by chunk
+    app.config['CHUNK_MAX_CHARS'] = int(os.getenv('CHUNK_MAX_CHARS', 12000))
+    # Files up to BATCH_MAX_FILE_BYTES are packed together into one prompt
+    app.config['BATCH_MAX_FILE_BYTES'] = int(os.getenv('BATCH_MAX_FILE_BYTES', 2000))
+    app.config['BATCH_TOKEN_BUDGET'] = int(os.getenv('BATCH_TOKEN_BUDGET', 6000))
+    app.config['BATCH_MAX_FILES'] = int(os.getenv('BATCH_MAX_FILES', 10))
+    app.config['ANALYSIS_CACHE_DIR'] = os.getenv('ANALYSIS_CACHE_DIR', './.analysis_cache')
+    app.config['ANALYSIS_CACHE_MAX_BYTES'] = int(os.getenv('ANALYSIS_CACHE_MAX_MB', 200)) * 1024 * 1024
+    app.config['ANALYSIS_CACHE_MAX_AGE'] = int(os.getenv('ANALYSIS_CACHE_MAX_AGE_DAYS', 7)) * 24 * 3600
+    # Rendered flowcharts, keyed by the hash of their canonical Mermaid source
+    app.config['FLOWCHART_CACHE_DIR'] = os.getenv('FLOWCHART_CACHE_DIR', './.flowchart_cache')
+    # Generated report sections, keyed by a hash of the inputs each one uses
+    app.config['REPORT_PROMPT_VERSION'] = 2
+    app.config['REPORT_CACHE_DIR'] = os.getenv('REPORT_CACHE_DIR', './.report_cache')
+    # Sections are separate LLM calls; unparseable responses are retried
+    app.config['REPORT_CONCURRENCY'] = int(os.getenv('REPORT_CONCURRENCY', 8))
+    app.config['REPORT_SECTION_RETRIES'] = int(os.getenv('REPORT_SECTION_RETRIES', 2))
+    app.config['JOBS_FOLDER'] = os.getenv('JOBS_FOLDER', './.jobs')
+    app.config['JOB_WORKERS'] = int(os.getenv('JOB_WORKERS', 2))
+    # 'browser' renders through a pool of warm Chromium pages and falls back to
+    # mmdc when the pool is unavailable; 'mmdc' always spawns the CLI
+    app.config['MERMAID_RENDERER'] = os.getenv('MERMAID_RENDERER', 'browser')
+    # Shared by the browser pool and mmdc; keeps labels as SVG text so the
+    # master SVG can be embedded in the PDF export
+    app.config['MERMAID_CONFIG'] = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'mermaid-config.json')
+    app.config['MERMAID_JS'] = os.getenv('MERMAID_JS', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'node_modules', 'mermaid', 'dist', 'mermaid.min.js'))
+    app.config['RENDER_POOL_SIZE'] = int(os.getenv('RENDER_POOL_SIZE', 2))
+    app.config['RENDER_PAGE_MAX_RENDERS'] = int(os.getenv('RENDER_PAGE_MAX_RENDERS', 50))
+    # A chart whose render failed is served as missing for this long, then retried
+    app.config['RENDER_RETRY_SECONDS'] = int(os.getenv('RENDER_RETRY_SECONDS', 60))
+    # Flowcharts are rendered once as SVG; the page, DOCX and PDF exports each
+    # get a PNG derived at the width and resolution they display it at
+    app.config['PDF_IMAGE_DPI'] = int(os.getenv('PDF_IMAGE_DPI', 150))
+    app.config['DOCX_IMAGE_DPI'] = int(os.getenv('DOCX_IMAGE_DPI', 200))
+    app.config['FLOWCHART_VARIANTS'] = {
+        'web': int(os.getenv('FLOWCHART_WEB_WIDTH', 1000)),
+        'docx': round(DOCX_FLOWCHART_WIDTH * app.config['DOCX_IMAGE_DPI']),
+        'pdf': round(PDF_FLOWCHART_WIDTH / 72 * app.config['PDF_IMAGE_DPI'])
+    }
+    # Optional JSON-lines log of per-request and per-job stage timings
+    app.config['TRACE_LOG'] = os.getenv('TRACE_LOG')
+    # Session data lives server-side; the cookie only carries a signed session id
+    app.config['SESSION_DB'] = os.getenv('SESSION_DB', './.sessions/sessions.sqlite3')
+    app.secret_key = os.getenv('SECRET_KEY', 'super_secret_key')
+
+def worker_share(quota):
+    return max(1, quota // current_app.config['WORKER_PROCESSES'])
+
+def build_backend(name):
+    # One backend, and so one client and one limiter, per provider
+    if name == 'gemini':
+        limiter = RateLimiter(
+            requests_per_minute=worker_share(current_app.config['GEMINI_RPM']),
+            tokens_per_minute=worker_share(current_app.config['GEMINI_TPM']),
+            max_retries=current_app.config['GEMINI_MAX_RETRIES'],
+            name='Gemini'
+        )
+        return GeminiBackend(current_app.config['GEMINI_MODEL'], os.getenv('GEMINI_API_KEY'), limiter)
+    if name == 'anthropic':
+        limiter = RateLimiter(
+            requests_per_minute=worker_share(current_app.config['ANTHROPIC_RPM']),
+            tokens_per_minute=worker_share(current_app.config['ANTHROPIC_TPM']),
+            max_retries=current_app.config['ANTHROPIC_MAX_RETRIES'],
+            name='Anthropic'
+        )
+        return AnthropicBackend(current_app.config['ANTHROPIC_MODEL'], os.getenv('ANTHROPIC_API_KEY'), limiter)
+    if name == 'local':
+        return LocalBackend(latency=current_app.config['LOCAL_LLM_LATENCY'])
+    raise ValueError(f"Unknown LLM backend: {name}")
+
+def start_services(app):
+    # Runs inside the new app's context, for build_backend
+    os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+
+    llm = build_backend(app.config['LLM_BACKEND'])
+    if app.config['LLM_HEDGE_BACKEND']:
+        llm = HedgedBackend(
+            llm,
+            build_backend(app.config['LLM_HEDGE_BACKEND']),
+            percentile=app.config['LLM_HEDGE_PERCENTILE'],
+            initial_delay=app.config['LLM_HEDGE_INITIAL_DELAY']
+        )
 
-# Load environment variables
-load_dotenv()
+    analysis_cache = AnalysisCache(
+        app.config['ANALYSIS_CACHE_DIR'],
+        max_bytes=app.config['ANALYSIS_CACHE_MAX_BYTES'],
+        max_age=app.config['ANALYSIS_CACHE_MAX_AGE']
+    )
 
-app = Flask(__name__)
-app.config['UPLOAD_FOLDER'] = './uploads'
-app.config['ALLOWED_EXTENSIONS'] = {'.py', '.js', '.jsx', '.ts', '.tsx', '.css', '.java', '.c', '.cpp', '.h', '.cs', '.go', '.rb', '.php', '.html'}
-app.secret_key = 'super_secret_key'
+    section_cache = SectionCache(app.config['REPORT_CACHE_DIR'], max_age=app.config['ANALYSIS_CACHE_MAX_AGE'])
 
-os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+    # Same entry layout as the analysis cache; only the mermaid field and the
+    # flowchart files are used
+    flowchart_cache = AnalysisCache(
+        app.config['FLOWCHART_CACHE_DIR'],
+        max_bytes=app.config['ANALYSIS_CACHE_MAX_BYTES'],
+        max_age=app.config['ANALYSIS_CACHE_MAX_AGE']
+    )
 
-# Configure Gemini API
-genai.configure(api_key=os.getenv('GEMINI_API_KEY'))
+    app.session_interface = ServerSideSessionInterface(SQLiteSessionStore(app.config['SESSION_DB']))
+
+    job_manager = JobManager(app.config['JOBS_FOLDER'], workers=app.config['JOB_WORKERS'])
+
+    workspaces = WorkspaceManager(
+        app.config['UPLOAD_FOLDER'],
+        ttl=app.config['WORKSPACE_TTL'],
+        max_bytes=app.config['WORKSPACE_MAX_BYTES'],
+        sweep_interval=app.config['WORKSPACE_SWEEP_INTERVAL']
+    )
+    workspaces.start_sweeper()
+
+    with open(app.config['MERMAID_CONFIG'], 'r', encoding='utf-8') as f:
+        mermaid_config = json.load(f)
+
+    mermaid_renderer = MermaidRenderer(
+        app.config['MERMAID_JS'],
+        config=mermaid_config,
+        size=app.config['RENDER_POOL_SIZE'],
+        max_renders=app.config['RENDER_PAGE_MAX_RENDERS']
+    )
+    return Services(llm, analysis_cache, section_cache, flowchart_cache, job_manager, workspaces,
+                    mermaid_config, mermaid_renderer, build_metrics(app.config['TRACE_LOG']))
+
+RENDER_FAILURES_MAX = 1000
+
+# Finished PDF and Word downloads, kept in each session's workspace
+EXPORTS_FOLDER = '.exports'
+
+def in_app_context(fn):
+    # The services are looked up on the current app, so code run on another
+    # thread needs this app's context
+    app = current_app._get_current_object()
+
+    @functools.wraps(fn)
+    def run(*args, **kwargs):
+        with app.app_context():
+            return fn(*args, **kwargs)
+    return run
+
+def bind(fn):
+    # Worker threads run in the app's context and under the caller's trace
+    return in_app_context(metrics.bind(fn))
+
+def generate_content(prompt, on_partial=None, validate=None):
+    # With on_partial the response is streamed and the text so far is
+    # reported after each chunk. validate(text) decides which answer wins
+    # when the call is hedged.
+    if not current_app.config['LLM_STREAMING']:
+        on_partial = None
+    with metrics.timed('llm_call', backend=llm.name):
+        response = llm.generate(prompt, on_partial, validate)
+    count_tokens(response)
+    return response
+
+def count_tokens(response):
+    for kind, tokens in (('prompt', response.prompt_tokens), ('completion', response.completion_tokens)):
+        if tokens is not None:
+            metrics.inc('llm_tokens_total', tokens, kind=kind, backend=response.backend)
 
 def allowed_file(filename):
-    return os.path.splitext(filename)[1].lower() in app.config['ALLOWED_EXTENSIONS']
+    return os.path.splitext(filename)[1].lower() in current_app.config['ALLOWED_EXTENSIONS']
+
+def fallback_analysis(filename):
+    metrics.inc('analysis_fallbacks_total')
+    return {
+        'summary': f"Could not analyze {filename}",
+        'mermaid': None,
+        'description': f"Fallback: Workflow for {filename}",
+        'failed': True
+    }
+
+def run_mmdc(mmd_path, output_path, *args):
+    if shutil.which("mmdc") is None:
+        raise EnvironmentError("Mermaid CLI (mmdc) is not installed or not in PATH")
+
+    result = subprocess.run([
+        "mmdc", "-i", mmd_path, "-o", output_path, "-t", "default", "-c", current_app.config['MERMAID_CONFIG'], *args
+    ], capture_output=True, text=True)
+
+    if result.returncode != 0:
+        raise RuntimeError(f"Mermaid CLI error: {result.stderr}")
+
+def render_flowchart(mermaid_code, mmd_path, svg_path):
+    # Writes the SVG master, then one raster wide enough for every variant
+    # from which the per-target PNGs are derived
+    variants = current_app.config['FLOWCHART_VARIANTS']
+    raster_width = max(variants.values())
+    rendered = None
+    if current_app.config['MERMAID_RENDERER'] == 'browser':
+        try:
+            with metrics.timed('render', renderer='browser'):
+                rendered = mermaid_renderer.render(mermaid_code, raster_width)
+            with open(svg_path, 'wb') as f:
+                f.write(rendered['svg'])
+        except RendererUnavailable as e:
+            metrics.inc('renderer_fallbacks_total')
+            logger.warning("Browser renderer unavailable, falling back to mmdc: %s", e)
+
+    if rendered is None:
+        with metrics.timed('render', renderer='mmdc'):
+            run_mmdc(mmd_path, svg_path)
+            with open(svg_path, 'rb') as f:
+                width = svg_width(f.read())
+            scale = min(4, max(1, raster_width / width)) if width else 1
+            master_path = f"{os.path.splitext(svg_path)[0]}.master.png"
+            try:
+                run_mmdc(mmd_path, master_path, "-s", f"{scale:.2f}")
+                with open(master_path, 'rb') as f:
+                    rendered = {'svg': None, 'png': f.read()}
+            finally:
+                if os.path.exists(master_path):
+                    os.remove(master_path)
+
+    with metrics.timed('flowchart_variants'):
+        write_raster_variants(rendered['png'], svg_path, variants)
+    return svg_path
+
+def flowchart_source(svg_path):
+    # `<stem>_flowchart.svg` is rendered from `<stem>.mmd`
+    return f"{svg_path[:-len('_flowchart.svg')]}.mmd"
+
+def flowchart_master(path):
+    # The SVG master behind a flowchart file in a workspace, or None
+    if path.endswith('_flowchart.svg'):
+        return path
+    for variant in current_app.config['FLOWCHART_VARIANTS']:
+        suffix = f"_flowchart.{variant}.png"
+        if path.endswith(suffix):
+            return f"{path[:-len(suffix)]}_flowchart.svg"
+    return None
+
+def ensure_flowchart(svg_path):
+    # Analysis only writes the Mermaid source; the SVG and PNGs are rendered
+    # the first time the page, the PDF or the Word document needs them.
+    # Returns svg_path, or None if the chart can't be rendered.
+    source_path = flowchart_source(svg_path)
+    variants = current_app.config['FLOWCHART_VARIANTS']
+    if is_rendered(svg_path, variants, source_path):
+        return svg_path
+    try:
+        source_mtime = os.path.getmtime(source_path)
+    except OSError:
+        return None
+    failure = render_failures.get(svg_path)
+    if failure and failure[0] == source_mtime and time.monotonic() - failure[1] < current_app.config['RENDER_RETRY_SECONDS']:
+        return None
+
+    def render():
+        # A render that finished while this caller waited for the lock counts
+        if is_rendered(svg_path, variants, source_path):
+            return svg_path
+        with open(source_path, 'r') as f:
+            mermaid_code = f.read()
+        key = render_key(mermaid_code)
+        cached = flowchart_cache.get(key)
+        if cached and cached['cached_flowchart']:
+            stem = os.path.splitext(svg_path)[0]
+            for suffix, path in cached['cached_flowchart'].items():
+                shutil.copyfile(path, f"{stem}.{suffix}")
+            return svg_path
+        render_flowchart(mermaid_code, source_path, svg_path)
+        flowchart_cache.put(key, '', '', mermaid_code, flowchart_files(svg_path, variants))
+        return svg_path
 
-def analyze_code(code, filename):
     try:
-        model = genai.GenerativeModel('gemini-1.5-pro')
-        prompt = f"""You are a code analysis assistant. Analyze the following code from the file `{filename}`:
+        result = render_flights.run(svg_path, render)
+    except Exception as e:
+        with render_failures_lock:
+            render_failures.pop(svg_path, None)
+            render_failures[svg_path] = (source_mtime, time.monotonic())
+            while len(render_failures) > RENDER_FAILURES_MAX:
+                del render_failures[next(iter(render_failures))]
+        metrics.inc('flowchart_render_failures_total')
+        logger.error("Flowchart rendering failed for %s: %s", svg_path, e)
+        return None
+    if failure:
+        with render_failures_lock:
+            render_failures.pop(svg_path, None)
+    return result
+
+def render_key(mermaid_code):
+    # The source is canonical (see finish_analysis), so equal diagrams share a
+    # key; sizes and theme change the output too
+    inputs = [mermaid_code, current_app.config['FLOWCHART_VARIANTS'], services().mermaid_config]
+    return content_digest(json.dumps(inputs, sort_keys=True))
+
+def ensure_flowcharts(analysis):
+    # Render every chart an export needs up front, in parallel
+    paths = [data['flowchart_path'] for data in analysis.values() if data.get('flowchart_path')]
+    if not paths:
+        return
+    workers = max(1, min(current_app.config['ANALYSIS_CONCURRENCY'], len(paths)))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(bind(ensure_flowchart), paths))
+
+def output_stem(filename):
+    # Keep the extension in generated names so app.py and app.js don't share outputs
+    stem, extension = os.path.splitext(filename)
+    return f"{stem}_{extension[1:]}" if extension else stem
+
+MERMAID_FORMAT_NOTES = """
+Mermaid Format Notes:
+- Use simple, alphanumeric node ids (e.g., A, B, C or Step1, Step2).
+- Put every label in double quotes and keep it short: A["Read input"].
+- Use square brackets for steps and curly braces for decisions: B{"Is input valid?"}.
+- Label decision branches like B -->|"Yes"| C.
+- Use TD direction (top-down).
+- One connection per line.
+"""
+
+# Languages whose flowcharts are built from the source itself; the LLM is
+# only asked for their summary and description
+LOCAL_FLOWCHARTS = {'.py': python_flowchart}
+
+def local_flowchart(code, filename):
+    build = LOCAL_FLOWCHARTS.get(os.path.splitext(filename)[1].lower())
+    if build is None:
+        return None
+    with metrics.timed('flowchart_build'):
+        return build(code)
+
+def analysis_fields(prose_only):
+    # The JSON object an analysis prompt asks for
+    if prose_only:
+        return '{ "summary": "...", "description": "..." }'
+    return '{ "summary": "...", "mermaid": "graph TD\\nA[Start]\\nB[Process]\\nC[End]\\nA-->B\\nB-->C", "description": "..." }'
+
+def parse_json_response(raw_response):
+    clean_response = raw_response.strip()
+    if clean_response.startswith('```json'):
+        clean_response = clean_response[7:]
+    if clean_response.endswith('```'):
+        clean_response = clean_response[:-3]
+    return json.loads(clean_response.strip())
+
+def partial_json_field(text, field):
+    # Best-effort read of a string field from a JSON response still streaming in
+    match = re.search(r'"%s"\s*:\s*"((?:[^"\\]|\\.)*)' % re.escape(field), text)
+    if not match:
+        return None
+    value = match.group(1)
+    # Drop a dangling escape character cut off mid-stream
+    if (len(value) - len(value.rstrip('\\'))) % 2:
+        value = value[:-1]
+    try:
+        return json.loads(f'"{value}"')
+    except ValueError:
+        return value
+
+def request_analysis(code, filename, part_note='', on_partial=None, prose_only=False):
+    with metrics.timed('prompt_build'):
+        prompt = f"""You are a code analysis assistant. Analyze the following code from the file `{filename}`{part_note}:
 
 ```{os.path.splitext(filename)[1][1:]}
 {code}
 ```
 
 Respond with a raw JSON object only, no markdown or commentary.
+{'' if prose_only else MERMAID_FORMAT_NOTES}
+JSON Format:
+{analysis_fields(prose_only)}"""
+
+    response = generate_content(prompt, on_partial, validate=parse_json_response)
+    raw_response = response.text
+    logger.debug("Raw LLM response for %s%s:\n%s", filename, part_note, raw_response)
+
+    with metrics.timed('json_parse'):
+        data = parse_json_response(raw_response)
+    logger.debug("Parsed JSON for %s: %s", filename, data)
+    return data
+
+def request_chunked_analysis(code, filename, on_partial=None, prose_only=False):
+    # Map: analyze structural chunks in parallel. Reduce: merge the partial
+    # flowcharts locally and ask for one short overall summary.
+    chunks = split_source(code, os.path.splitext(filename)[1].lower(), current_app.config['CHUNK_MAX_CHARS'])
+    if len(chunks) == 1:
+        return request_analysis(code, filename, on_partial=on_partial, prose_only=prose_only)
+
+    def analyze_chunk(index, chunk):
+        part_note = f" (part {index} of {len(chunks)}: {chunk['name']})"
+        try:
+            return request_analysis(chunk['code'], filename, part_note, on_partial, prose_only)
+        except Exception as e:
+            logger.error("Error analyzing %s%s: %s", filename, part_note, e)
+            return None
+
+    workers = max(1, min(current_app.config['ANALYSIS_CONCURRENCY'], len(chunks)))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        partials = list(executor.map(bind(analyze_chunk), range(1, len(chunks) + 1), chunks))
+
+    succeeded = [(chunk, part) for chunk, part in zip(chunks, partials) if part]
+    if not succeeded:
+        raise RuntimeError(f"Every chunk of {filename} failed to analyze")
+
+    mermaid = None if prose_only else merge_flowcharts([
+        (chunk['name'], part.get('mermaid', '').replace('\\n', '\n'))
+        for chunk, part in succeeded
+        if part.get('mermaid') and '-->' in part['mermaid']
+    ])
+    partial_summaries = '\n'.join(f"- {chunk['name']}: {part.get('summary', '')}" for chunk, part in succeeded)
 
-Mermaid Format Notes:
-- Use simple, alphanumeric node labels only (e.g., A, B, C or Step1, Step2).
-- Avoid special characters like "=", ".", "()", etc. inside node labels.
-- Use square brackets for all nodes.
-- Use TD direction (top-down).
-- One connection per line.
+    try:
+        prompt = f"""The file `{filename}` was analyzed in {len(chunks)} parts. Partial summaries:
+{partial_summaries}
+
+Combine them into one overview of the whole file. Respond with a raw JSON object only, no markdown or commentary.
 
 JSON Format:
-{{ "summary": "...", "mermaid": "graph TD\\nA[Start]\\nB[Process]\\nC[End]\\nA-->B\\nB-->C", "description": "..." }}"""
+{{ "summary": "...", "description": "..." }}"""
+        data = parse_json_response(generate_content(prompt, validate=parse_json_response).text)
+    except Exception as e:
+        logger.error("Error merging chunk summaries for %s: %s", filename, e)
+        data = {
+            'summary': ' '.join(part.get('summary', '') for _, part in succeeded),
+            'description': ' '.join(part.get('description', '') for _, part in succeeded)
+        }
+    data['mermaid'] = mermaid
+    return data
+
+def analysis_target(filename, content_hash, workspace=None):
+    # Cache key plus the workspace paths a file's Mermaid source and SVG go to
+    extension = os.path.splitext(filename)[1].lower()
+    key = cache_key(content_hash, extension, llm.identity, current_app.config['ANALYSIS_PROMPT_VERSION'])
+    workspace = workspace or current_app.config['UPLOAD_FOLDER']
+    mmd_path = os.path.join(workspace, f"{output_stem(filename)}.mmd")
+    svg_path = os.path.join(workspace, f"{output_stem(filename)}_flowchart.svg")
+    return key, mmd_path, svg_path
+
+def restore_cached_analysis(key, filename, mmd_path, svg_path, cancelled=None):
+    cached = analysis_cache.get(key)
+    if not cached:
+        return None
+    data = {
+        'summary': cached['summary'],
+        'description': cached['description'],
+        'mermaid': cached['mermaid']
+    }
+    if cancelled and cancelled():
+        return data
+    try:
+        if cached['mermaid']:
+            with open(mmd_path, 'w') as f:
+                f.write(cached['mermaid'])
+            data['flowchart_path'] = svg_path
+        if cached['cached_flowchart']:
+            # Entries from before lazy rendering also carry the rendered files
+            stem = os.path.splitext(svg_path)[0]
+            for suffix, path in cached['cached_flowchart'].items():
+                shutil.copyfile(path, f"{stem}.{suffix}")
+            data['flowchart_path'] = svg_path
+        return data
+    except OSError as e:
+        logger.warning("Could not restore cached analysis for %s: %s", filename, e)
+        return None
+
+def finish_analysis(data, filename, key, mmd_path, svg_path, cancelled=None):
+    # Parse, repair and validate the flowchart, write its canonical source
+    # for ensure_flowchart to render, then cache the result. Diagrams that
+    # can't be repaired are dropped here rather than in a failed render.
+    # Results without a usable flowchart or that hit a file error are not
+    # cached, so the next upload asks again. Once cancelled() says a newer
+    # upload owns the workspace, the result is only cached.
+    cacheable = True
+    try:
+        with metrics.timed('mermaid_clean'):
+            graph = canonical_flowchart(data.get('mermaid') or '')
+    except MermaidError as e:
+        if data.get('mermaid'):
+            metrics.inc('mermaid_invalid_total')
+            logger.warning("Invalid flowchart for %s: %s", filename, e)
+        graph = None
+
+    if graph is None:
+        data['mermaid'] = None
+        data['description'] = f"Fallback: Workflow for {filename}"
+        cacheable = False
+    else:
+        data['description'] = data.get('description', f"Flowchart for {filename}")
+        if graph.repairs:
+            metrics.inc('mermaid_repairs_total', len(graph.repairs))
+            logger.debug("Repaired flowchart for %s: %s", filename, '; '.join(graph.repairs))
+        data['mermaid'] = graph.serialize()
+        logger.debug("Canonical Mermaid code for %s:\n%s", filename, data['mermaid'])
+        if cancelled and cancelled():
+            analysis_cache.put(key, data.get('summary', ''), data['description'], data['mermaid'])
+            return data
+        try:
+            with open(mmd_path, 'w') as f:
+                f.write(data['mermaid'])
+            # Rendered on first request by ensure_flowchart
+            data['flowchart_path'] = svg_path
+        except OSError as e:
+            logger.exception("Flowchart generation failed for %s: %s", filename, e)
+            data['mermaid'] = None
+            data['description'] = f"Failed to generate flowchart for {filename}"
+            cacheable = False
 
-        response = model.generate_content(prompt)
-        raw_response = response.text
+    if cacheable:
+        analysis_cache.put(key, data.get('summary', ''), data['description'], data['mermaid'])
+    return data
 
-        # Debug raw LLM response
-        print("\n=== RAW LLM RESPONSE START ===")
-        print(raw_response)
-        print("=== RAW LLM RESPONSE END ===\n")
+def analyze_code(code, filename, content_hash=None, workspace=None, on_partial=None, cancelled=None):
+    if content_hash is None:
+        content_hash = content_digest(code)
+    key, mmd_path, svg_path = analysis_target(filename, content_hash, workspace)
 
-        clean_response = raw_response.strip()
-        if clean_response.startswith('```json'):
-            clean_response = clean_response[7:]
-        if clean_response.endswith('```'):
-            clean_response = clean_response[:-3]
-        clean_response = clean_response.strip()
+    cached = restore_cached_analysis(key, filename, mmd_path, svg_path, cancelled)
+    if cached:
+        return cached
 
-        data = json.loads(clean_response)
-        print(f"Parsed JSON for {filename}: {data}")
+    try:
+        flowchart = local_flowchart(code, filename)
+        data = request_chunked_analysis(code, filename, on_partial, prose_only=flowchart is not None)
+        if flowchart:
+            data['mermaid'] = flowchart
+        return finish_analysis(data, filename, key, mmd_path, svg_path, cancelled)
 
-        if not data.get('mermaid') or 'graph' not in data['mermaid'] or '-->' not in data['mermaid']:
-            data['mermaid'] = None
-            data['description'] = f"Fallback: Workflow for {filename}"
-        else:
-            data['description'] = data.get('description', f"Flowchart for {filename}")
-            try:
-                # Convert Mermaid code to PNG using mermaid-cli
-                mermaid_code = data['mermaid'].replace('\\n', '\n')
-                
-                # Clean up node labels to ensure proper syntax
-                def clean_mermaid_code(code):
-                    # Split into lines and clean each line
-                    lines = code.split('\n')
-                    cleaned_lines = []
-                    
-                    for line in lines:
-                        # Skip empty lines
-                        if not line.strip():
-                            continue
-                        
-                        # Keep graph TD line as is
-                        if line.startswith('graph TD'):
-                            cleaned_lines.append(line)
-                            continue
-                            
-                        # Clean node definitions and connections
-                        line = line.strip()
-                        # Remove semicolons
-                        line = line.replace(';', '')
-                        # Replace curly braces with square brackets
-                        line = re.sub(r'\{([^}]*)\}', r'[\1]', line)
-                        
-                        # Clean up node labels
-                        def clean_label(match):
-                            label = match.group(1)
-                            # Remove characters that confuse Mermaid
-                            label = re.sub(r'[=\[\]{}"\'`<>;]+', '', label)
-                            label = label.strip()
-                            label = label.replace(' ', '_')  # Optional: Replace spaces with underscores
-                            return f'[{label}]'
-                        
-                        line = re.sub(r'\[(.*?)\]', clean_label, line)
-                        cleaned_lines.append(line)
-                    
-                    return '\n'.join(cleaned_lines)
-                
-                mermaid_code = clean_mermaid_code(mermaid_code)
-                print(f"\nCleaned Mermaid code for {filename}:\n{mermaid_code}\n")
-                
-                mmd_path = os.path.join(app.config['UPLOAD_FOLDER'], f"{os.path.splitext(filename)[0]}.mmd")
-                with open(mmd_path, 'w') as f:
-                    f.write(mermaid_code)
-
-                png_path = os.path.join(app.config['UPLOAD_FOLDER'], f"{os.path.splitext(filename)[0]}_flowchart.png")
-                if shutil.which("mmdc") is None:
-                    raise EnvironmentError("Mermaid CLI (mmdc) is not installed or not in PATH")
-
-                result = subprocess.run([
-                    "mmdc", "-i", mmd_path, "-o", png_path, "-t", "default"
-                ], capture_output=True, text=True)
-
-                if result.returncode != 0:
-                    raise RuntimeError(f"Mermaid CLI error: {result.stderr}")
-
-                data['flowchart_path'] = png_path
-            except Exception as e:
-                print(f"Flowchart generation failed for {filename}: {e}")
-                print(traceback.format_exc())
-                data['mermaid'] = None
-                data['description'] = f"Failed to generate flowchart for {filename}"
+    except Exception as e:
+        logger.error("Error analyzing %s: %s", filename, e)
+        return fallback_analysis(filename)
+
+def request_batch_analysis(files, prose_only=False):
+    # files maps filename -> code; the response maps filename -> analysis
+    with metrics.timed('prompt_build'):
+        sections = '\n\n'.join(
+            f"File `{filename}`:\n```{os.path.splitext(filename)[1][1:]}\n{code}\n```"
+            for filename, code in files.items()
+        )
+        # The full path, as archive uploads batch nested files
+        example = json.dumps(next(iter(files)))
+        prompt = f"""You are a code analysis assistant. Analyze each of the following {len(files)} files independently:
 
-        return data
+{sections}
 
-    except Exception as e:
-        print(f"Error analyzing {filename}: {e}")
-        return {
-            'summary': f"Could not analyze {filename}",
-            'mermaid': None,
-            'description': f"Fallback: Workflow for {filename}"
+Respond with a raw JSON object only, no markdown or commentary. Use each file name exactly as given above as a key.
+{'' if prose_only else MERMAID_FORMAT_NOTES}
+JSON Format:
+{{ {example}: {analysis_fields(prose_only)}, ... }}"""
+
+    response = generate_content(prompt, validate=parse_json_response)
+    logger.debug("Raw batch LLM response (%d files):\n%s", len(files), response.text)
+    with metrics.timed('json_parse'):
+        data = parse_json_response(response.text)
+    if not isinstance(data, dict):
+        raise ValueError("Batch response is not a JSON object")
+    return data
+
+def analyze_batch(filenames, contents, file_hashes=None, workspace=None, cancelled=None):
+    results = {}
+    pending = {}
+    for filename in filenames:
+        content_hash = (file_hashes or {}).get(filename) or content_digest(contents[filename])
+        key, mmd_path, svg_path = analysis_target(filename, content_hash, workspace)
+        cached = restore_cached_analysis(key, filename, mmd_path, svg_path, cancelled)
+        if cached:
+            results[filename] = cached
+        else:
+            pending[filename] = (key, mmd_path, svg_path)
+
+    if len(pending) > 1:
+        flowcharts = {filename: local_flowchart(contents[filename], filename) for filename in pending}
+        try:
+            batch = request_batch_analysis(
+                {filename: contents[filename] for filename in pending},
+                prose_only=all(flowcharts.values())
+            )
+        except Exception as e:
+            logger.error("Batch analysis failed for %s: %s", ', '.join(pending), e)
+            batch = {}
+        answered = {
+            filename: entry for filename, entry in batch.items()
+            if filename in pending and isinstance(entry, dict) and entry.get('summary')
         }
-
-def generate_pdf(analysis):
+        for filename, entry in answered.items():
+            if flowcharts[filename]:
+                entry['mermaid'] = flowcharts[filename]
+        # Flowcharts are only parsed and written here; rendering happens on first view
+        for filename, entry in answered.items():
+            try:
+                results[filename] = finish_analysis(entry, filename, *pending[filename], cancelled)
+                del pending[filename]
+            except Exception as e:
+                logger.error("Error finishing batched analysis for %s: %s", filename, e)
+
+    # Anything the batch could not answer is retried on its own
+    for filename in pending:
+        results[filename] = analyze_code(contents[filename], filename, (file_hashes or {}).get(filename), workspace,
+                                         cancelled=cancelled)
+    return results
+
+def plan_batches(file_paths, workspace=None):
+    # Small files share prompts up to the token budget (~4 chars per token);
+    # larger files, and batches that end up with one file, go on their own.
+    # Files with local flowcharts get prose-only prompts, so they are batched
+    # apart from the rest.
+    singles, batches, open_batches = [], [], {}
+    for filename in file_paths:
+        size = os.path.getsize(os.path.join(workspace or current_app.config['UPLOAD_FOLDER'], filename))
+        if size > current_app.config['BATCH_MAX_FILE_BYTES']:
+            singles.append(filename)
+            continue
+        tokens = size // 4 + 50
+        kind = os.path.splitext(filename)[1].lower() in LOCAL_FLOWCHARTS
+        current, used = open_batches.get(kind, ([], 0))
+        if current and (used + tokens > current_app.config['BATCH_TOKEN_BUDGET'] or len(current) >= current_app.config['BATCH_MAX_FILES']):
+            batches.append(current)
+            current, used = [], 0
+        current.append(filename)
+        open_batches[kind] = (current, used + tokens)
+    batches.extend(current for current, _ in open_batches.values() if current)
+    singles.extend(batch[0] for batch in batches if len(batch) == 1)
+    return singles, [batch for batch in batches if len(batch) > 1]
+
+def analyze_files(file_paths, file_hashes=None, workspace=None, on_start=None, on_result=None, on_partial=None,
+                  cancelled=None):
+    # Each worker runs the full LLM call + Mermaid render for one file (or one
+    # batch of small files), so network round-trips and renders overlap.
+    # Groups not yet started when cancelled() turns true are skipped and left
+    # out of the result.
+    def read(filename):
+        filepath = os.path.join(workspace or current_app.config['UPLOAD_FOLDER'], filename)
+        with open(filepath, 'r', encoding='utf-8', errors='ignore') as f:
+            return f.read()
+
+    def analyze_group(filenames):
+        if cancelled and cancelled():
+            return None
+        if on_start:
+            for filename in filenames:
+                on_start(filename)
+        if len(filenames) == 1:
+            filename = filenames[0]
+            partial = (lambda text: on_partial(filename, text)) if on_partial else None
+            return {filename: analyze_code(read(filename), filename, (file_hashes or {}).get(filename), workspace, partial,
+                                           cancelled)}
+        return analyze_batch(filenames, {filename: read(filename) for filename in filenames}, file_hashes, workspace,
+                             cancelled)
+
+    if not file_paths:
+        return {}
+
+    singles, batches = plan_batches(file_paths, workspace)
+    # file_paths arrives in priority order; start groups in that order too
+    order = {filename: index for index, filename in enumerate(file_paths)}
+    groups = sorted([[filename] for filename in singles] + batches,
+                    key=lambda group: min(order[filename] for filename in group))
+
+    workers = max(1, min(current_app.config['ANALYSIS_CONCURRENCY'], len(groups)))
+    results = {}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(bind(analyze_group), group): group for group in groups}
+        for future in as_completed(futures):
+            group = futures[future]
+            try:
+                group_results = future.result()
+            except Exception as e:
+                logger.error("Error analyzing %s: %s", ', '.join(group), e)
+                group_results = {}
+            if group_results is None:
+                continue
+            for filename in group:
+                results[filename] = group_results.get(filename) or fallback_analysis(filename)
+                if on_result:
+                    on_result(filename, results[filename])
+
+    # Rebuild in upload order so the analysis dict stays stable
+    return {filename: results[filename] for filename in file_paths if filename in results}
+
+def session_entry(data):
+    # Only the fields the pages and exports need are kept in the session
+    return {
+        'summary': data['summary'],
+        'description': data['description'],
+        'flowchart_path': data.get('flowchart_path')
+    }
+
+def flowchart_variant(data, variant):
+    # Path of one of the flowchart's derived PNGs, rendering it if needed
+    if data.get('flowchart_path') and ensure_flowchart(data['flowchart_path']):
+        path = variant_path(data['flowchart_path'], variant)
+        if os.path.exists(path):
+            return path
+    return None
+
+def flowchart_url(data, workspace):
+    # The image is rendered when the URL is first fetched. Archive uploads
+    # keep their directories, so link relative to the workspace.
+    if not data.get('flowchart_path'):
+        return None
+    path = variant_path(data['flowchart_path'], 'web')
+    relative = os.path.relpath(path, workspace)
+    return f"/uploads/{relative.replace(os.sep, '/')}"
+
+def run_analysis_job(job_id, file_paths, file_hashes, workspace):
+    last_update = {}
+
+    def on_partial(filename, text):
+        # Throttle job writes; the page only needs a few updates per second
+        summary = partial_json_field(text, 'summary')
+        now = time.time()
+        if summary and now - last_update.get(filename, 0) >= current_app.config['STREAM_UPDATE_INTERVAL']:
+            last_update[filename] = now
+            job_manager.update_file(job_id, filename, 'running', partial=summary)
+
+    metrics.start_trace(f"job {job_id}")
+    try:
+        with metrics.timed('analysis_job'):
+            analyze_files(
+                file_paths,
+                file_hashes,
+                workspace,
+                on_start=lambda filename: job_manager.update_file(job_id, filename, 'running'),
+                on_result=lambda filename, data: job_manager.update_file(
+                    job_id, filename, 'error' if data.get('failed') else 'done', session_entry(data)
+                ),
+                on_partial=on_partial,
+                cancelled=lambda: job_manager.cancelled(job_id)
+            )
+    finally:
+        metrics.finish_trace(files=len(file_paths))
+
+def session_owner():
+    if 'owner_id' not in session:
+        session['owner_id'] = uuid.uuid4().hex
+    return session['owner_id']
+
+def session_workspace():
+    return workspaces.path_for(session_owner())
+
+def owned_job(job_id):
+    job = job_manager.get(job_id)
+    if not job or job['owner'] != session.get('owner_id'):
+        return None
+    return job
+
+def sync_job_results():
+    # Move a finished job's results into the session; returns the job while
+    # it is still running so callers can show progress instead
+    job = owned_job(session.get('job_id'))
+    if not job:
+        session.pop('job_id', None)
+        return None
+    if job['status'] != 'done':
+        return job
+    # Reused results are already stored; write the new ones in place
+    session.update_records('analysis', {
+        entry['name']: entry['result'] or session_entry(fallback_analysis(entry['name']))
+        for entry in job['files'] if not entry.get('reused')
+    }, order=[entry['name'] for entry in job['files']])
+    # Failed files stay out of the manifest so the next upload retries them
+    failed = {entry['name'] for entry in job['files'] if entry['status'] != 'done' or not entry['result']}
+    if failed and session.get('manifest'):
+        session['manifest'] = {name: digest for name, digest in session['manifest'].items() if name not in failed}
+    session.pop('job_id', None)
+    return None
+
+def diff_manifest(manifest, file_hashes, analyzed):
+    # Splits an upload against the previous one's {path: sha256}; a file is
+    # unchanged only if its hash matches and its result is still stored, along
+    # with the Mermaid source its flowchart is rendered from (the sweeper may
+    # have deleted the workspace since)
+    def kept(name):
+        record = analyzed.get(name)
+        if record is None:
+            return False
+        return not record.get('flowchart_path') or os.path.exists(flowchart_source(record['flowchart_path']))
+
+    unchanged = [name for name, digest in file_hashes.items() if manifest.get(name) == digest and kept(name)]
+    changed = [name for name in file_hashes if name not in unchanged]
+    removed = [name for name in list(manifest) + list(analyzed) if name not in file_hashes]
+    return unchanged, changed, list(dict.fromkeys(removed))
+
+def remove_outputs(workspace, filename, source=False):
+    # A file's Mermaid source and rendered flowcharts, and optionally the file
+    _, mmd_path, svg_path = analysis_target(filename, '', workspace)
+    paths = [mmd_path, *flowchart_files(svg_path, current_app.config['FLOWCHART_VARIANTS']).values()]
+    if source:
+        paths.append(os.path.join(workspace, filename))
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.warning("Could not remove %s: %s", path, e)
+
+# The PDF embeds each flowchart's SVG master as vector graphics, or the PNG
+# derived for it when the SVG can't be converted. Either is parsed once and
+# kept in memory; mtime is only part of the cache key so a re-rendered chart
+# is picked up.
+@functools.lru_cache(maxsize=128)
+def pdf_figure_source(svg_path, mtime, max_width, max_height):
+    from PIL import Image
+    drawing = svg_drawing(svg_path, max_width, max_height)
+    if drawing is not None:
+        return drawing, None
+    png_path = variant_path(svg_path, 'pdf')
+    with open(png_path, 'rb') as f:
+        image_bytes = f.read()
+    with Image.open(io.BytesIO(image_bytes)) as img:
+        width, height = img.size
+    scale = min(max_width / width, max_height / height)
+    return None, (image_bytes, width * scale, height * scale)
+
+def pdf_flowchart(svg_path, mtime, max_width, max_height):
+    # Flowables keep layout state while a document is built, so concurrent
+    # builds each get their own copy of the cached figure
+    from reportlab.platypus import Image as RLImage
+    drawing, image = pdf_figure_source(svg_path, mtime, max_width, max_height)
+    if drawing is not None:
+        figure = copy.deepcopy(drawing)
+        figure.hAlign = 'CENTER'
+        return figure
+    image_bytes, width, height = image
+    return RLImage(io.BytesIO(image_bytes), width=width, height=height)
+
+def draw_page_number(p, doc):
+    from reportlab.lib.pagesizes import letter
+    from reportlab.lib.units import inch
+    p.saveState()
+    p.setFont("Helvetica", 10)
+    p.drawRightString(letter[0] - inch, 30, f"Page {doc.page}")
+    p.restoreState()
+
+def generate_pdf(analysis, output):
+    # Returns False if a flowchart could not be rendered or added
+    from reportlab.lib.pagesizes import letter
+    from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+    from reportlab.lib.units import inch
+    from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, PageBreak, KeepTogether
     try:
-        buffer = io.BytesIO()
-        p = canvas.Canvas(buffer, pagesize=letter)
+        doc = SimpleDocTemplate(output, pagesize=letter, leftMargin=inch, rightMargin=inch,
+                                topMargin=inch, bottomMargin=inch, title="Code Documentation")
         styles = getSampleStyleSheet()
         style = ParagraphStyle(
             'Custom',
@@ -177,206 +1030,239 @@ def generate_pdf(analysis):
             spaceAfter=30,
             alignment=1
         )
+        heading_style = ParagraphStyle('Heading', parent=style, fontName='Helvetica-Bold', fontSize=14)
+        header_style = ParagraphStyle('Header', parent=style, fontSize=16, leading=20)
+        caption_style = ParagraphStyle('Caption', parent=style, alignment=1)
 
         # Title page
-        title = Paragraph("Code Documentation", title_style)
-        title.wrapOn(p, 400, 100)
-        title.drawOn(p, 100, 700)
-        
-        y_position = 650
+        story = [Paragraph("Code Documentation", title_style)]
 
         # Add author details if available
         author_details = session.get('author_details', {})
         if author_details:
-            author_name = author_details.get('name', 'Unknown Author')
-            author_text = f"<b>Author:</b> {author_name}"
-            author_para = Paragraph(author_text, style)
-            author_para.wrapOn(p, 400, 100)
-            author_para.drawOn(p, 100, y_position)
-            y_position -= 30
-
-            # Remove caption prefix section
-            y_position -= 50
+            author_name = escape(author_details.get('name', 'Unknown Author'))
+            story.append(Paragraph(f"<b>Author:</b> {author_name}", style))
         else:
-            fallback_text = "Author details not provided."
-            fallback_para = Paragraph(fallback_text, style)
-            fallback_para.wrapOn(p, 400, 100)
-            fallback_para.drawOn(p, 100, y_position)
-            y_position -= 30
+            story.append(Paragraph("Author details not provided.", style))
 
         # Add project details if available
         project_details = session.get('project_details', {})
         if project_details:
-            p.setFont("Helvetica-Bold", 14)
-            p.drawString(100, y_position, "Project Details")
-            y_position -= 30
-            
-            goal_text = f"<b>Project Goal:</b><br/>{project_details.get('goal', 'N/A')}"
-            goal_para = Paragraph(goal_text, style)
-            w, h = goal_para.wrapOn(p, 400, 200)
-            goal_para.drawOn(p, 100, y_position - h)
-            y_position -= (h + 30)
-            
-            audience_text = f"<b>Target Audience:</b><br/>{project_details.get('audience', 'N/A')}"
-            audience_para = Paragraph(audience_text, style)
-            w, h = audience_para.wrapOn(p, 400, 200)
-            audience_para.drawOn(p, 100, y_position - h)
+            story.append(Paragraph("Project Details", heading_style))
+            story.append(Paragraph(f"<b>Project Goal:</b><br/>{escape(project_details.get('goal', 'N/A'))}", style))
+            story.append(Paragraph(f"<b>Target Audience:</b><br/>{escape(project_details.get('audience', 'N/A'))}", style))
         else:
-            fallback_text = "Project details not provided."
-            fallback_para = Paragraph(fallback_text, style)
-            fallback_para.wrapOn(p, 400, 100)
-            fallback_para.drawOn(p, 100, y_position - 30)
-
-        p.showPage()
+            story.append(Paragraph("Project details not provided.", style))
 
         # Analysis pages
-        for filename, data in analysis.items():
-            y_position = 750
-            header_text = f"Analysis for {filename}"
-            header_para = Paragraph(header_text, ParagraphStyle('Header', parent=style, fontSize=16, spaceAfter=20))
-            w, h = header_para.wrapOn(p, 400, 100)
-            header_para.drawOn(p, 100, y_position - h)
-            y_position -= (h + 20)
-            
-            summary_text = f"<b>Summary:</b><br/>{data['summary']}"
-            summary_para = Paragraph(summary_text, style)
-            w, h = summary_para.wrapOn(p, 400, 200)
-            summary_para.drawOn(p, 100, y_position - h)
-            y_position -= (h + 20)
-            
-            desc_text = f"<b>Description:</b><br/>{data['description']}"
-            desc_para = Paragraph(desc_text, style)
-            w, h = desc_para.wrapOn(p, 400, 200)
-            desc_para.drawOn(p, 100, y_position - h)
-            y_position -= (h + 20)
-
-            if data.get('flowchart_path') and os.path.exists(data['flowchart_path']):
+        caption_prefix = escape(author_details.get('caption_prefix', 'Fig.'))
+        max_width = min(PDF_FLOWCHART_WIDTH, doc.width)
+        max_height = doc.height * 0.6
+        complete = True
+        for figure_num, (filename, data) in enumerate(analysis.items(), 1):
+            story.append(PageBreak())
+            story.append(Paragraph(f"Analysis for {escape(filename)}", header_style))
+            story.append(Paragraph(f"<b>Summary:</b><br/>{escape(data['summary'])}", style))
+            story.append(Paragraph(f"<b>Description:</b><br/>{escape(data['description'])}", style))
+
+            if data.get('flowchart_path') and not ensure_flowchart(data['flowchart_path']):
+                complete = False
+            elif data.get('flowchart_path'):
                 try:
-                    img = Image.open(data['flowchart_path'])
-                    width, height = img.size
-                    page_width = 400
-                    scale_factor = page_width / width
-                    new_width = page_width
-                    new_height = int(height * scale_factor)
-                    max_height = y_position - 50
-                    if new_height > max_height:
-                        scale_factor = max_height / height
-                        new_width = int(width * scale_factor)
-                        new_height = max_height
-                    
-                    img = img.resize((new_width, new_height), Image.Resampling.LANCZOS)
-                    temp_path = os.path.join(app.config['UPLOAD_FOLDER'], f"temp_{os.path.basename(data['flowchart_path'])}")
-                    img.save(temp_path, quality=100, optimize=False)
-                    
-                    x_position = (letter[0] - new_width) / 2
-                    caption_prefix = session.get('author_details', {}).get('caption_prefix', 'Fig.')
-                    figure_num = list(analysis.keys()).index(filename) + 1
-                    caption_text = f"{caption_prefix} {figure_num}: Flowchart for {filename}"
-                    caption_para = Paragraph(caption_text, style)
-                    w, h = caption_para.wrapOn(p, 400, 100)
-                    caption_para.drawOn(p, x_position, y_position - new_height - h - 10)
-                    p.drawImage(temp_path, x_position, y_position - new_height, width=new_width, height=new_height, preserveAspectRatio=True)
-                    os.remove(temp_path)
+                    path = data['flowchart_path']
+                    figure = pdf_flowchart(path, os.path.getmtime(path), max_width, max_height)
+                    caption_text = f"{caption_prefix} {figure_num}: Flowchart for {escape(filename)}"
+                    # Keep each figure with its caption; platypus moves both
+                    # to the next page when they don't fit
+                    story.append(KeepTogether([
+                        figure,
+                        Spacer(1, 10),
+                        Paragraph(caption_text, caption_style)
+                    ]))
                 except Exception as e:
-                    print(f"Error adding flowchart to PDF: {e}")
-                    error_para = Paragraph("Error: Could not add flowchart to PDF", style)
-                    error_para.wrapOn(p, 400, 100)
-                    error_para.drawOn(p, 100, y_position - 50)
-
-
-            # Page number
-            p.setFont("Helvetica", 10)
-            page_num = len(analysis.keys()) + 1  # Account for title page
-            p.drawString(letter[0] - 100, 30, f"Page {page_num}")
-            p.showPage()
+                    logger.error("Error adding flowchart to PDF: %s", e)
+                    story.append(Paragraph("Error: Could not add flowchart to PDF", style))
+                    complete = False
 
-        p.save()
-        buffer.seek(0)
-        return buffer
+        doc.build(story, onLaterPages=draw_page_number)
+        return complete
     except Exception as e:
-        print(f"Error generating PDF: {e}")
-        print(traceback.format_exc())
+        logger.exception("Error generating PDF: %s", e)
         raise
 
 def generate_abstract(analysis):
     try:
-        model = genai.GenerativeModel('gemini-1.5-pro')
         summary_text = " ".join(data['summary'] for data in analysis.values())
         prompt = f"""Generate a concise academic abstract (100-150 words) summarizing the following code analysis:
         {summary_text}
         The abstract should include the purpose, methodology, key findings, and significance."""
-        response = model.generate_content(prompt)
+        response = generate_content(prompt)
         return response.text.strip()
     except Exception as e:
-        print(f"Error generating abstract: {e}")
+        logger.error("Error generating abstract: %s", e)
         return "Abstract not available. Please summarize the project manually."
 
 def add_table_of_contents(paragraph):
+    from docx.oxml import OxmlElement
+    from docx.oxml.ns import qn
     fldSimple = OxmlElement('w:fldSimple')
     fldSimple.set(qn('w:instr'), 'TOC \\o "1-4" \\h \\z \\u')  # field code
     paragraph._p.append(fldSimple)
 
-def generate_llm_section(model, prompt):
-    try:
-        response = model.generate_content(prompt)
-        text = response.text.strip()
-        print(f"\n=== RAW LLM RESPONSE ===\n{text}\n=== END RAW LLM RESPONSE ===")
-        
-        # Remove markdown code block markers if present
-        if text.startswith('```') and text.endswith('```'):
-            text = text[3:-3].strip()
-        
-        sections = {}
-        current_section = None
-        current_content = []
-        
-        for line in text.split('\n'):
-            line = line.strip()
-            # Check for section headers (both markdown and plain text formats)
-            if line.startswith('## ') or line.startswith('### '):
-                # If we have a current section, save its content
-                if current_section:
-                    sections[current_section] = '\n'.join(current_content).strip()
-                    current_content = []
-                # Extract section name and normalize it
-                current_section = line.replace('#', '').strip().lower()
-            elif current_section and line:  # Include non-empty lines, including bullets
-                current_content.append(line)
-        
-        # Save the last section's content
-        if current_section and current_content:
-            sections[current_section] = '\n'.join(current_content).strip()
-        
-        if not sections:
-            raise ValueError("No sections extracted from LLM response")
-            
-        # Ensure all required sections exist
-        required_sections = ['abstract', 'acknowledgement', 'introduction', 'objectives', 
-                           'methodology', 'tools and technologies used', 'conclusion', 'future scope']
-        for section in required_sections:
-            if section not in sections:
-                sections[section] = f'[Section "{section}" not generated]'
-                
-        
-        return sections
-    except Exception as e:
-        if "429" in str(e):
-            print(f"Quota exceeded: {e}. Waiting {e.retry_delay.seconds} seconds before fallback...")
-            import time
-            time.sleep(e.retry_delay.seconds)
-        print(f"Error generating LLM section: {e}")
-        return {
-            'abstract': '[Quota exceeded or error, please add manually]',
-            'acknowledgement': '[Quota exceeded or error, please add manually]',
-            'introduction': '[Quota exceeded or error, please add manually]',
-            'objectives': '[Quota exceeded or error, please add manually]',
-            'methodology': '[Quota exceeded or error, please add manually]',
-            'tools and technologies used': '[Quota exceeded or error, please add manually]',
-            'conclusion': '[Quota exceeded or error, please add manually]',
-            'future scope': '[Quota exceeded or error, please add manually]'
-        }
+# Report sections in document order, keyed by the lower-case header names
+# the LLM response is parsed into
+REPORT_SECTIONS = {
+    'abstract': 'Abstract',
+    'acknowledgement': 'Acknowledgement',
+    'introduction': 'Introduction',
+    'objectives': 'Objectives',
+    'methodology': 'Methodology',
+    'tools and technologies used': 'Tools and Technologies Used',
+    'conclusion': 'Conclusion',
+    'future scope': 'Future Scope'
+}
+
+def section_inputs(analysis, project_details, author_details):
+    # Everything each section's prompt is built from. A section is only
+    # regenerated when its inputs change, so details no prompt uses (city,
+    # guide, ...) never cost an LLM call.
+    first_file = next(iter(analysis))
+    common = {
+        'file': first_file,
+        'summary': analysis[first_file]['summary'],
+        'goal': project_details.get('goal', 'N/A'),
+        'audience': project_details.get('audience', 'N/A')
+    }
+    summaries = [data['summary'] for data in analysis.values()]
+    inputs = {name: dict(common) for name in REPORT_SECTIONS}
+    inputs['acknowledgement']['author'] = author_details.get('name', 'Unknown Author')
+    inputs['conclusion']['summaries'] = summaries
+    inputs['future scope']['summaries'] = summaries
+    return inputs
+
+def section_instruction(name, inputs):
+    instructions = {
+        'abstract': f"A concise academic abstract (100-150 words) summarizing the purpose, method (code review of {inputs['file']}'s language/features), and key findings.",
+        'acknowledgement': f"A formal acknowledgement (50-100 words) recognizing contributions from the author '{inputs.get('author')}' and a placeholder for others (e.g., guide, teammates) in an official manner.",
+        'introduction': "A concise introduction (100-150 words) outlining the purpose and context based on the project goal.",
+        'objectives': "Concise objectives (50-100 words) detailing the aims to be achieved for the audience.",
+        'methodology': f"A concise methodology (100-150 words) describing the code review process for '{inputs['file']}', focusing on its language (e.g., JavaScript/React) and features (e.g., components, data flow).",
+        'tools and technologies used': "A concise bulleted list of the primary tools, programming languages, frameworks, libraries, and environments used in the project (e.g., Python, Flask, Gemini API, Mermaid CLI, ReportLab). Each item should be a single line with no additional description.",
+        'conclusion': f"A concise conclusion (100-150 words) summarizing key findings from the analysis summaries: {', '.join(inputs.get('summaries', []))}.",
+        'future scope': "A concise future scope (100-150 words) proposing enhancements based on the analysis summaries."
+    }
+    return f"- ### {REPORT_SECTIONS[name]}: {instructions[name]}"
+
+def section_prompt(names, inputs):
+    common = inputs[names[0]]
+    return (
+        f"Generate the following sections for a formal project report based on the file '{common['file']}' with summary: '{common['summary']}'. "
+        f"The project goal is '{common['goal']}' aimed at the audience '{common['audience']}'. Use code analysis data where relevant. "
+        "Structure the response with ### SectionName headers and content below each. Adopt a strictly impersonal, declarative tone suitable for an official report—avoid phrases like 'The analysis reveals', 'Based on the analysis', or any first-person references. Present content as established facts or recommendations without implying a narrator. Generate:\n"
+        + "\n".join(section_instruction(name, inputs[name]) for name in names)
+    )
 
-def generate_word_document(analysis):
+def generate_llm_section(prompt):
+    # Returns the sections found in the response, keyed by lower-case name
+    response = generate_content(prompt)
+    text = response.text.strip()
+    logger.debug("Raw LLM response:\n%s", text)
+    
+    # Remove markdown code block markers if present
+    if text.startswith('```') and text.endswith('```'):
+        text = text[3:-3].strip()
+    
+    sections = {}
+    current_section = None
+    current_content = []
+    
+    for line in text.split('\n'):
+        line = line.strip()
+        # Check for section headers (both markdown and plain text formats)
+        if line.startswith('## ') or line.startswith('### '):
+            # If we have a current section, save its content
+            if current_section:
+                sections[current_section] = '\n'.join(current_content).strip()
+                current_content = []
+            # Extract section name and normalize it
+            current_section = line.replace('#', '').strip().lower()
+        elif current_section and line:  # Include non-empty lines, including bullets
+            current_content.append(line)
+    
+    # Save the last section's content
+    if current_section and current_content:
+        sections[current_section] = '\n'.join(current_content).strip()
+    
+    if not sections:
+        raise ValueError("No sections extracted from LLM response")
+    return sections
+
+def generate_section(name, inputs):
+    # One short prompt per section. A response the section can't be parsed
+    # from is asked for again, up to REPORT_SECTION_RETRIES times; API errors
+    # were already retried by the limiter and are raised.
+    prompt = section_prompt([name], inputs)
+    attempts = current_app.config['REPORT_SECTION_RETRIES'] + 1
+    for attempt in range(1, attempts + 1):
+        try:
+            sections = generate_llm_section(prompt)
+        except ValueError:
+            sections = {}
+        # Accept a lone section even if the model reworded its header
+        text = sections.get(name) or (next(iter(sections.values())) if len(sections) == 1 else None)
+        if text:
+            return text
+        logger.warning("Report section '%s' not found in response (attempt %d/%d)", name, attempt, attempts)
+    return None
+
+def generate_report_sections(analysis, project_details, author_details):
+    # Sections are cached under a hash of their inputs; the ones whose inputs
+    # changed are generated concurrently, one LLM call each, so a failure
+    # only costs that section and latency is set by the slowest one
+    inputs = section_inputs(analysis, project_details, author_details)
+    keys = {
+        name: section_key(name, inputs[name], llm.identity, current_app.config['REPORT_PROMPT_VERSION'])
+        for name in REPORT_SECTIONS
+    }
+    sections = {}
+    failed = []
+    for name, key in keys.items():
+        text = section_cache.get(key)
+        if text is not None:
+            sections[name] = text
+
+    missing = [name for name in REPORT_SECTIONS if name not in sections]
+    if missing:
+        logger.info("Generating report sections: %s", ', '.join(missing))
+        workers = max(1, min(current_app.config['REPORT_CONCURRENCY'], len(missing)))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(bind(generate_section), name, inputs): name for name in missing}
+            for future in as_completed(futures):
+                name = futures[future]
+                try:
+                    text = future.result()
+                except Exception as e:
+                    logger.error("Error generating report section '%s': %s", name, e)
+                    sections[name] = '[Quota exceeded or error, please add manually]'
+                    failed.append(name)
+                    continue
+                if text:
+                    sections[name] = text
+                    section_cache.put(keys[name], text)
+                else:
+                    sections[name] = f'[Section "{name}" not generated]'
+                    failed.append(name)
+
+    # Document order, whatever order the calls finished in, and the sections
+    # that only have a placeholder
+    return {name: sections[name] for name in REPORT_SECTIONS}, failed
+
+def generate_word_document(analysis, output):
+    # Returns False if a report section or a flowchart is missing
+    import docx
+    from docx import Document
+    from docx.oxml.ns import qn
+    from docx.shared import Inches, RGBColor
     doc = Document()
 
     doc.styles['Normal'].font.name = 'Calibri'
@@ -393,30 +1279,13 @@ def generate_word_document(analysis):
             style = doc.styles[f'Heading {i}']
             style.font.color.rgb = RGBColor(0, 0, 0)  # Black
 
-    # Initialize Gemini model
-    model = genai.GenerativeModel('gemini-1.5-pro')
-
     # Get project details and author info
     project_details = session.get('project_details', {})
     author_details = session.get('author_details', {})
-    goal = project_details.get('goal', 'N/A')
     project_title = project_details.get('title', 'Project Documentation')
 
-    # Single prompt for all sections
-    all_prompt = (
-    f"Generate the following sections for a formal project report based on the file '{list(analysis.keys())[0]}' with summary: '{analysis[list(analysis.keys())[0]]['summary']}'. "
-    f"The project goal is '{goal}' aimed at the audience '{project_details.get('audience', 'N/A')}'. Use code analysis data where relevant. "
-    "Structure the response with ### SectionName headers and content below each. Adopt a strictly impersonal, declarative tone suitable for an official report—avoid phrases like 'The analysis reveals', 'Based on the analysis', or any first-person references. Present content as established facts or recommendations without implying a narrator. Generate:\n"
-    "- ### Abstract: A concise academic abstract (100-150 words) summarizing the purpose, method (code review of {list(analysis.keys())[0]}'s language/features), and key findings.\n"
-    "- ### Acknowledgement: A formal acknowledgement (50-100 words) recognizing contributions from the author '{author_details.get('name', 'Unknown Author')}' and a placeholder for others (e.g., guide, teammates) in an official manner.\n"
-    "- ### Introduction: A concise introduction (100-150 words) outlining the purpose and context based on the project goal.\n"
-    "- ### Objectives: Concise objectives (50-100 words) detailing the aims to be achieved for the audience.\n"
-    "- ### Methodology: A concise methodology (100-150 words) describing the code review process for '{list(analysis.keys())[0]}', focusing on its language (e.g., JavaScript/React) and features (e.g., components, data flow).\n"
-    "- ### Tools and Technologies Used: A concise bulleted list of the primary tools, programming languages, frameworks, libraries, and environments used in the project (e.g., Python, Flask, Gemini API, Mermaid CLI, ReportLab). Each item should be a single line with no additional description.\n"
-    "- ### Conclusion: A concise conclusion (100-150 words) summarizing key findings from the analysis summaries: {', '.join([data['summary'] for data in analysis.values()])}.\n"
-    "- ### Future Scope: A concise future scope (100-150 words) proposing enhancements based on the analysis summaries."
-    )
-    all_sections = generate_llm_section(model, all_prompt)
+    with metrics.timed('report_sections'):
+        all_sections, failed_sections = generate_report_sections(analysis, project_details, author_details)
 
     # 1. Title Page
     section = doc.sections[0]
@@ -508,12 +1377,16 @@ def generate_word_document(analysis):
 
     # Results & Analysis
     doc.add_heading('Results & Analysis', level=2)
+    figures_missing = False
     for i, (filename, data) in enumerate(analysis.items(), 1):
         doc.add_paragraph(f"{i}. {filename}")
         doc.add_paragraph(f"Summary: {data['summary']}")
         doc.add_paragraph(f"Description: {data['description']}")
-        if data.get('flowchart_path') and os.path.exists(data['flowchart_path']):
-            doc.add_picture(data['flowchart_path'], width=docx.shared.Inches(5))
+        flowchart = flowchart_variant(data, 'docx')
+        if data.get('flowchart_path') and not flowchart:
+            figures_missing = True
+        if flowchart:
+            doc.add_picture(flowchart, width=docx.shared.Inches(DOCX_FLOWCHART_WIDTH))
             caption_prefix = session.get('author_details', {}).get('caption_prefix', 'Fig.')
             doc.add_paragraph(f"{caption_prefix} {i}: Flowchart for {filename}")
 
@@ -534,141 +1407,342 @@ def generate_word_document(analysis):
     doc.add_heading('Future Scope', level=2)
     doc.add_paragraph(all_sections.get('future scope', '[Section not generated]'))
 
-    # Save to buffer
-    buffer = io.BytesIO()
-    doc.save(buffer)
-    buffer.seek(0)
-    return buffer
+    doc.save(output)
+    return not failed_sections and not figures_missing
 
-@app.route('/')
+def document_key(kind, analysis, *inputs):
+    # Everything a download is built from: the analysis, each flowchart's
+    # Mermaid source and whatever else the document shows
+    sources = {}
+    for filename, data in analysis.items():
+        if data.get('flowchart_path'):
+            try:
+                stat = os.stat(flowchart_source(data['flowchart_path']))
+                sources[filename] = [stat.st_mtime_ns, stat.st_size]
+            except OSError:
+                sources[filename] = None
+    return content_digest(json.dumps([kind, analysis, sources, inputs], sort_keys=True))
+
+def cached_document(filename, key, build):
+    # (path, kept) for the finished document for this session and key.
+    # build(output) writes it straight to a temporary file in the workspace,
+    # so it is never held in memory, and returns False if the result
+    # shouldn't be reused; such a build is sent once and rebuilt on the next
+    # request.
+    folder = os.path.join(session_workspace(), EXPORTS_FOLDER)
+    stem, extension = os.path.splitext(filename)
+    path = os.path.join(folder, f"{stem}.{key[:16]}{extension}")
+
+    def write():
+        if os.path.exists(path):
+            metrics.inc('document_cache_hits_total', document=extension[1:])
+            return path, True
+        os.makedirs(folder, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(prefix=f"{stem}.", suffix='.tmp', dir=folder)
+        try:
+            with os.fdopen(fd, 'wb') as output:
+                keep = build(output)
+            target = path if keep else os.path.join(folder, f"{stem}.partial{extension}")
+            os.replace(tmp_path, target)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        # Earlier builds of this document; ones still being sent stay
+        # readable until closed
+        for name in os.listdir(folder):
+            if name.startswith(f"{stem}.") and name.endswith(extension) and name != os.path.basename(target):
+                os.remove(os.path.join(folder, name))
+        return target, keep
+
+    # One build per document, however many requests ask for it at once
+    return document_flights.run(path, write)
+
+def send_document(path, filename, mimetype, etag):
+    # Streamed from disk in blocks, with Content-Length, and Range requests
+    # answered so interrupted downloads can resume. A build that wasn't kept
+    # gets no ETag, so it can't be revalidated in place of the full document.
+    response = send_file(path, as_attachment=True, download_name=filename, mimetype=mimetype,
+                         etag=etag, max_age=0, conditional=True)
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+@bp.route('/')
 def home():
     return render_template('upload.html', current_step='upload')
 
-@app.route('/upload', methods=['GET', 'POST'])
+@bp.route('/upload', methods=['GET', 'POST'])
 def upload_files():
     try:
         if request.method == 'POST':
-            # Clean uploads
-            if os.path.exists(app.config['UPLOAD_FOLDER']):
-                try:
-                    # First, remove all files in the directory
-                    for filename in os.listdir(app.config['UPLOAD_FOLDER']):
-                        file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-                        try:
-                            if os.path.isfile(file_path):
-                                os.unlink(file_path)
-                            elif os.path.isdir(file_path):
-                                shutil.rmtree(file_path)
-                        except Exception as e:
-                            print(f"Error removing {file_path}: {e}")
-                    
-                    # Then remove the directory itself
-                    shutil.rmtree(app.config['UPLOAD_FOLDER'])
-                except Exception as e:
-                    print(f"Error clearing uploads folder: {e}")
-                    flash('Error clearing previous uploads', 'error')
-            
-            # Create fresh upload directory
-            os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
-
-            files = request.files.getlist('files')
+            try:
+                # Parts are streamed to staging files while the form is parsed
+                with metrics.timed('file_save'):
+                    files = request.files.getlist('files')
+            except RequestEntityTooLarge as e:
+                flash(upload_limit_message(e), 'error')
+                return redirect(url_for('.upload_files'))
             if not files or all(f.filename == '' for f in files):
                 flash('No files selected', 'error')
-                return redirect(url_for('upload_files'))
-
-            # Check total size of all files
-            total_size = sum(len(f.read()) for f in files)
-            for f in files:
-                f.seek(0)  # Reset file pointer after reading
-                
-            if total_size > 10 * 1024 * 1024:  # 10MB limit
-                flash('Total file size exceeds 10MB limit', 'error')
-                return redirect(url_for('upload_files'))
-
-            if len(files) > 20:  # Limit number of files
-                flash('Maximum 20 files allowed per upload', 'error')
-                return redirect(url_for('upload_files'))
-
-            file_paths = []
-            for file in files:
-                if file and allowed_file(file.filename):
-                    filepath = os.path.join(app.config['UPLOAD_FOLDER'], file.filename)
-                    file.save(filepath)
-                    file_paths.append(file.filename)
+                return redirect(url_for('.upload_files'))
+
+            # Size and count limits were enforced while the parts streamed in.
+            # Archives are unpacked, and loose files moved, into an incoming
+            # directory first, so a rejected upload leaves the workspace and
+            # any running job alone.
+            os.makedirs(current_app.config['UPLOAD_STAGING_FOLDER'], exist_ok=True)
+            incoming = tempfile.mkdtemp(prefix='incoming-', dir=current_app.config['UPLOAD_STAGING_FOLDER'])
+            try:
+                file_paths, file_hashes = stage_upload(files, incoming)
+                if file_paths is None:
+                    return redirect(url_for('.upload_files'))
+
+                # Files unchanged since the last upload keep their results, so
+                # the workspace is kept too. Without a manifest to diff against
+                # (or while the last upload is still being analyzed) start it
+                # fresh; a job still running is cancelled so it stops writing
+                # into the workspace.
+                running = sync_job_results()
+                manifest = {} if running else session.get('manifest', {})
+                if manifest:
+                    workspace = session_workspace()
                 else:
-                    allowed = ', '.join(sorted(app.config['ALLOWED_EXTENSIONS']))
-                    flash(f'Invalid file: {file.filename}. Allowed: {allowed}', 'error')
-                    return redirect(url_for('upload_files'))
-
+                    if running:
+                        job_manager.cancel(running['id'])
+                    try:
+                        workspace = workspaces.reset(session_owner())
+                    except Exception as e:
+                        logger.error("Error clearing workspace: %s", e)
+                        flash('Error clearing previous uploads', 'error')
+                        workspace = session_workspace()
+                    session.clear_records('analysis')
+                for filename in file_paths:
+                    filepath = os.path.join(workspace, filename)
+                    os.makedirs(os.path.dirname(filepath), exist_ok=True)
+                    os.replace(os.path.join(incoming, filename), filepath)
+            finally:
+                shutil.rmtree(incoming, ignore_errors=True)
+
+            # Entry points and widely imported files are analyzed first
+            file_paths = prioritize(workspace, file_paths)
+
+            analyzed = dict(session.records('analysis').items()) if manifest else {}
+            unchanged, changed, removed = diff_manifest(manifest, file_hashes, analyzed)
+            reused = {name: analyzed[name] for name in unchanged}
+            for name in removed:
+                remove_outputs(workspace, name, source=True)
+            for name in changed:
+                remove_outputs(workspace, name)
+            if manifest:
+                logger.info("Re-upload: %d unchanged, %d added or modified, %d removed",
+                            len(unchanged), len(changed), len(removed))
+            session.update_records('analysis', {}, removed=removed + changed, order=file_paths)
+            session['manifest'] = file_hashes
             session['file_paths'] = file_paths
 
-            # Analyze files
-            analysis = {}
-            for filename in file_paths:
-                filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-                with open(filepath, 'r', encoding='utf-8', errors='ignore') as f:
-                    content = f.read()
-                    result = analyze_code(content, filename)
-                    analysis[filename] = result
-
-            # Store only essential data in session
-            session['analysis'] = {
-                filename: {
-                    'summary': data['summary'],
-                    'description': data['description'],
-                    'flowchart_path': data.get('flowchart_path')
-                }
-                for filename, data in analysis.items()
-            }
-
-            return redirect(url_for('analysis'))
+            if not changed:
+                flash('No files changed since the last upload', 'success')
+                return redirect(url_for('.analysis'))
+
+            # Analyze new and modified files in the background; /analysis
+            # shows progress for the whole project
+            job = job_manager.create(session_owner(), file_paths, reused)
+            job_manager.submit(job['id'], in_app_context(run_analysis_job), changed, file_hashes, workspace)
+            session['job_id'] = job['id']
+
+            return redirect(url_for('.analysis'))
 
         return render_template('upload.html', 
                             current_step='upload',
                             uploaded_files=session.get('file_paths', []))
 
     except Exception as e:
-        print(f"Upload error: {e}")
+        logger.error("Upload error: %s", e)
         flash('Unexpected error during upload.', 'error')
-        return redirect(url_for('upload_files'))
+        return redirect(url_for('.upload_files'))
+
+def stage_upload(files, folder):
+    # Unpacks archives and moves loose files into folder. Returns the
+    # relative paths in upload order and their hashes, or (None, None) after
+    # flashing why the upload was refused.
+    file_paths = []
+    file_hashes = {}
+    rejected = []
+    for file in files:
+        if not file or not file.filename:
+            continue
+        if file.stream.archive:
+            try:
+                with metrics.timed('archive_extract'):
+                    file.stream.flush()
+                    extracted = extract_archive(
+                        file.stream.path, file.filename, folder,
+                        current_app.config['ALLOWED_EXTENSIONS'], archive_limits()
+                    )
+            except RequestEntityTooLarge as e:
+                flash(upload_limit_message(e), 'error')
+                return None, None
+            except ArchiveError as e:
+                flash(str(e), 'error')
+                return None, None
+            for path, digest in extracted['files'].items():
+                if path not in file_hashes:
+                    file_paths.append(path)
+                file_hashes[path] = digest
+            if extracted['truncated']:
+                flash(f"{file.filename} has more source files than the "
+                      f"{current_app.config['ARCHIVE_MAX_FILES']} analyzed per archive; the rest were skipped", 'error')
+        elif allowed_file(file.filename) and member_path(file.filename):
+            # Folder uploads send relative paths; they are kept, like an
+            # archive's, as long as they stay inside the workspace
+            filename = member_path(file.filename)
+            filepath = os.path.join(folder, filename)
+            os.makedirs(os.path.dirname(filepath), exist_ok=True)
+            file.stream.claim(filepath)
+            if filename not in file_hashes:
+                file_paths.append(filename)
+            file_hashes[filename] = file.stream.hexdigest()
+        else:
+            rejected.append(file.filename)
+
+    if rejected:
+        allowed = ', '.join(sorted(current_app.config['ALLOWED_EXTENSIONS']))
+        flash(f"Skipped {', '.join(rejected)}. Allowed: {allowed}, or a zip/tar archive", 'error')
+    if not file_paths:
+        flash('No supported source files found in the upload', 'error')
+        return None, None
+    return file_paths, file_hashes
+
+def archive_limits():
+    return ArchiveLimits(
+        max_bytes=current_app.config['ARCHIVE_MAX_EXTRACTED_BYTES'],
+        max_files=current_app.config['ARCHIVE_MAX_FILES'],
+        max_file_bytes=current_app.config['ARCHIVE_MAX_FILE_BYTES']
+    )
 
-@app.route('/export_pdf')
+def upload_limit_message(e):
+    # UploadBudget sets its own description; Werkzeug's Content-Length check does not
+    if e.description and e.description != RequestEntityTooLarge.description:
+        return e.description
+    return f"Total file size exceeds {current_app.config['UPLOAD_MAX_BYTES'] // (1024 * 1024)}MB limit"
+
+@bp.app_errorhandler(RequestEntityTooLarge)
+def request_too_large(e):
+    flash(upload_limit_message(e), 'error')
+    return redirect(url_for('.upload_files'))
+
+@bp.teardown_app_request
+def discard_staged_uploads(exc):
+    request.discard_staged_uploads()
+
+@bp.before_app_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    metrics.start_trace(f"{request.method} {request.path}")
+
+@bp.after_app_request
+def record_request_time(response):
+    started = g.get('request_started')
+    if started is not None:
+        duration = time.perf_counter() - started
+        metrics.observe('http_request_duration_seconds', duration,
+                        endpoint=request.endpoint or 'unknown', status=response.status_code)
+    metrics.finish_trace(status=response.status_code)
+    return response
+
+@bp.route('/export_pdf')
 def export_pdf():
     try:
-        analysis = session.get('analysis', {})
+        if sync_job_results():
+            flash('Analysis is still running. Please wait for it to finish.', 'error')
+            return redirect(url_for('.analysis'))
+        analysis = session.records('analysis')
         if not analysis:
             flash('No analysis data to export. Please upload and analyze files.', 'error')
-            return redirect(url_for('upload_files'))
+            return redirect(url_for('.upload_files'))
         
-        buffer = generate_pdf(analysis)
-        return send_file(
-            buffer,
-            as_attachment=True,
-            download_name='code_analysis.pdf',
-            mimetype='application/pdf'
-        )
+        analysis = dict(analysis.items())
+        key = document_key('pdf', analysis, session.get('author_details'), session.get('project_details'))
+
+        def build(output):
+            with metrics.timed('flowchart_render'):
+                ensure_flowcharts(analysis)
+            with metrics.timed('pdf_build'):
+                return generate_pdf(analysis, output)
+
+        path, kept = cached_document('code_analysis.pdf', key, build)
+        return send_document(path, 'code_analysis.pdf', 'application/pdf', kept and key)
     except Exception as e:
-        print(f"Error in export_pdf: {e}")
+        logger.error("Error in export_pdf: %s", e)
         flash('Error generating PDF. Please try again.', 'error')
-        return redirect(url_for('analysis'))
+        return redirect(url_for('.analysis'))
 
-@app.route('/analysis')
+@bp.route('/analysis')
 def analysis():
-    analysis = session.get('analysis', {})
+    job = sync_job_results()
+    if job:
+        # Show every file; finished ones are filled in now, the rest by the page script
+        analysis = {}
+        for entry in job['files']:
+            data = dict(entry['result'] or {'summary': 'Analyzing...', 'description': 'Pending'})
+            data['status'] = entry['status']
+            analysis[entry['name']] = data
+    else:
+        analysis = session.records('analysis')
     if not analysis:
         flash('No analysis data found. Please upload files.', 'error')
-        return redirect(url_for('upload_files'))
+        return redirect(url_for('.upload_files'))
     
     # Prepare flowcharts for rendering
+    workspace = session_workspace()
     for filename, data in analysis.items():
-        if data.get('flowchart_path') and os.path.exists(data['flowchart_path']):
-            data['flowchart_url'] = f'/uploads/{os.path.basename(data["flowchart_path"])}'
-        else:
-            data['flowchart_url'] = None
+        data['flowchart_url'] = flowchart_url(data, workspace)
     
-    return render_template('analysis.html', current_step='analysis', analysis=analysis)
-
-@app.route('/questions', methods=['GET', 'POST'])
+    return render_template('analysis.html', current_step='analysis', analysis=analysis, job=job)
+
+def job_progress(job, workspace):
+    progress = JobManager.progress(job)
+    for entry in progress['files']:
+        if entry['result']:
+            entry['result']['flowchart_url'] = flowchart_url(entry['result'], workspace)
+    return progress
+
+@bp.route('/jobs/<job_id>')
+def job_status(job_id):
+    job = owned_job(job_id)
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job_progress(job, session_workspace()))
+
+@bp.route('/jobs/<job_id>/events')
+def job_events(job_id):
+    job = owned_job(job_id)
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+    workspace = session_workspace()
+
+    def stream():
+        last_update = None
+        current = job
+        deadline = time.monotonic() + current_app.config['STREAM_MAX_SECONDS']
+        while current:
+            if current.get('updated') != last_update:
+                last_update = current.get('updated')
+                yield f"data: {json.dumps(job_progress(current, workspace))}\n\n"
+            if current['status'] == 'done':
+                break
+            if time.monotonic() >= deadline:
+                # Frees this thread; the page reconnects for the rest
+                yield "event: reopen\ndata: {}\n\n"
+                break
+            time.sleep(current_app.config['STREAM_UPDATE_INTERVAL'])
+            current = job_manager.get(job_id)
+
+    return current_app.response_class(stream_with_context(stream()), mimetype='text/event-stream',
+                              headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@bp.route('/questions', methods=['GET', 'POST'])
 def questions():
     if request.method == 'POST':
         # Validate and collect form data
@@ -696,11 +1770,11 @@ def questions():
         for field_name, field_value in required_fields.items():
             if not field_value:
                 flash(f'{field_name} is required.', 'error')
-                return redirect(url_for('questions'))
+                return redirect(url_for('.questions'))
 
         if not caption_prefix.replace('.', '').isalnum():
             flash('Caption Prefix must be alphanumeric or contain only dots.', 'error')
-            return redirect(url_for('questions'))
+            return redirect(url_for('.questions'))
 
         # Store in session
         session['author_details'] = {
@@ -718,65 +1792,147 @@ def questions():
             'audience': project_audience
         }
         flash('Questions and details saved successfully.', 'success')
-        return redirect(url_for('analysis'))
+        return redirect(url_for('.analysis'))
 
     return render_template('questions.html', current_step='questions')
 
-@app.route('/generate')
+@bp.route('/generate')
 def generate_document():
-    analysis = session.get('analysis', {})
+    if sync_job_results():
+        flash('Analysis is still running. Please wait for it to finish.', 'error')
+        return redirect(url_for('.analysis'))
+    analysis = session.records('analysis')
     if not analysis:
         flash('No analysis data to generate document. Please upload and analyze files.', 'error')
-        return redirect(url_for('upload_files'))
+        return redirect(url_for('.upload_files'))
     
     try:
-        buffer = generate_word_document(analysis)
-        return send_file(
-            buffer,
-            as_attachment=True,
-            download_name='final_document.docx',
-            mimetype='application/vnd.openxmlformats-officedocument.wordprocessingml.document'
-        )
+        analysis = dict(analysis.items())
+        # The document is dated, so it's rebuilt the next day
+        key = document_key('docx', analysis, session.get('author_details'), session.get('project_details'),
+                           datetime.date.today().isoformat(), llm.identity, current_app.config['REPORT_PROMPT_VERSION'])
+
+        def build(output):
+            with ThreadPoolExecutor(max_workers=1) as executor:
+                # Charts render while the report sections are being written
+                executor.submit(bind(ensure_flowcharts), analysis)
+                with metrics.timed('docx_build'):
+                    return generate_word_document(analysis, output)
+
+        path, kept = cached_document('final_document.docx', key, build)
+        return send_document(path, 'final_document.docx',
+                             'application/vnd.openxmlformats-officedocument.wordprocessingml.document', kept and key)
     except Exception as e:
-        print(f"Document generation failed: {e}")
+        logger.error("Document generation failed: %s", e)
         flash(f'An error occurred while generating the document: {str(e)}. Please try again.', 'error')
-        return redirect(url_for('analysis'))
-
-@app.route('/uploads/<path:filename>')
+        return redirect(url_for('.analysis'))
+
+# Strong validator for a workspace file, recomputed only when it changes
+@functools.lru_cache(maxsize=1024)
+def file_etag(path, mtime_ns, size):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(64 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+@bp.route('/uploads/<path:filename>')
 def serve_uploaded_file(filename):
-    return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
-
-@app.route('/remove_files', methods=['POST'])
+    path = safe_join(session_workspace(), filename)
+    if path is None:
+        abort(404)
+    svg_path = flowchart_master(path)
+    if svg_path and not ensure_flowchart(svg_path):
+        abort(404)
+    if not os.path.isfile(path):
+        abort(404)
+    stat = os.stat(path)
+    # Names are reused when a file is re-uploaded, so browsers revalidate
+    # every time and get a 304 while the content hash still matches
+    response = send_file(path, etag=file_etag(path, stat.st_mtime_ns, stat.st_size), max_age=0)
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+@bp.route('/cache_stats')
+def cache_stats():
+    return jsonify(dict(analysis_cache.stats(), sections=section_cache.stats(), flowcharts=flowchart_cache.stats()))
+
+@bp.route('/metrics')
+def metrics_endpoint():
+    analysis_stats = analysis_cache.stats()
+    section_stats = section_cache.stats()
+    flowchart_stats = flowchart_cache.stats()
+    llm_stats = llm.stats()
+    gauges = {
+        'cache_hits_total': {(('cache', 'analysis'),): analysis_stats['hits'], (('cache', 'sections'),): section_stats['hits'],
+                             (('cache', 'flowcharts'),): flowchart_stats['hits']},
+        'cache_misses_total': {(('cache', 'analysis'),): analysis_stats['misses'], (('cache', 'sections'),): section_stats['misses'],
+                               (('cache', 'flowcharts'),): flowchart_stats['misses']},
+        'llm_queued_requests': llm_stats.get('queued', 0),
+        'llm_throttled_total': llm_stats.get('throttled', 0),
+        'llm_retries_total': llm_stats.get('retries', 0),
+        'app_startup_seconds': {(('phase', phase),): seconds for phase, seconds in services().startup_seconds.items()},
+        # Each gunicorn worker keeps its own registry; this says which one answered
+        'process_info': {(('pid', os.getpid()),): 1}
+    }
+    if 'hedged' in llm_stats:
+        gauges['llm_hedged_total'] = llm_stats['hedged']
+        gauges['llm_hedge_wins_total'] = llm_stats['secondary_wins']
+        gauges['llm_hedge_deadline_seconds'] = llm_stats['deadline']
+    return current_app.response_class(metrics.render(gauges), mimetype='text/plain; version=0.0.4')
+
+@bp.route('/remove_files', methods=['POST'])
 def remove_files():
     try:
-        if os.path.exists(app.config['UPLOAD_FOLDER']):
-            # First, remove all files in the directory
-            for filename in os.listdir(app.config['UPLOAD_FOLDER']):
-                file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-                try:
-                    if os.path.isfile(file_path):
-                        os.unlink(file_path)
-                    elif os.path.isdir(file_path):
-                        shutil.rmtree(file_path)
-                except Exception as e:
-                    print(f"Error removing {file_path}: {e}")
-            
-            # Then remove the directory itself
-            shutil.rmtree(app.config['UPLOAD_FOLDER'])
-            
-            # Create fresh directory
-            os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
-            
+        if session.get('file_paths') or session.records('analysis'):
+            workspaces.remove(session_owner())
+
             # Clear session data
             session.pop('file_paths', None)
-            session.pop('analysis', None)
+            session.pop('manifest', None)
+            session.clear_records('analysis')
+            session.pop('job_id', None)
             flash('All uploaded files removed', 'success')
         else:
             flash('No files to remove', 'error')
     except Exception as e:
-        print(f"Error removing files: {e}")
+        logger.error("Error removing files: %s", e)
         flash('Error removing files', 'error')
-    return redirect(url_for('upload_files'))
+    return redirect(url_for('.upload_files'))
+
+def create_app(overrides=None):
+    """Builds an app from the environment and starts its services.
+
+    Each call returns an independent app with its own caches, pools and
+    metrics. Call it in each worker rather than before forking: the job and
+    render threads don't survive a fork. `overrides` is applied on top of
+    the environment, before any service reads it.
+    """
+    started = time.perf_counter()
+    load_dotenv()
+    # DEBUG also logs raw LLM responses and cleaned Mermaid code
+    logging.basicConfig(
+        level=os.getenv('LOG_LEVEL', 'INFO').upper(),
+        format='%(asctime)s %(levelname)s %(name)s: %(message)s'
+    )
+    app = Flask(__name__)
+    app.request_class = StreamingUploadRequest
+    load_config(app)
+    app.config.update(overrides or {})
+    with app.app_context():
+        app_services = start_services(app)
+    app.extensions['eleventh_hour'] = app_services
+    app.register_blueprint(bp)
+    startup = app_services.startup_seconds
+    startup['import'] = IMPORT_SECONDS
+    startup['create_app'] = time.perf_counter() - started
+    logger.info("App ready in %.2fs (imports %.2fs, create_app %.2fs)",
+                sum(startup.values()), startup['import'], startup['create_app'])
+    return app
+
+# Seconds spent importing this module, once per process
+IMPORT_SECONDS = time.perf_counter() - IMPORT_STARTED
 
 if __name__ == '__main__':
-    app.run(debug=True, use_reloader=False)
\ No newline at end of file
+    create_app().run(debug=os.getenv('FLASK_DEBUG') == '1', use_reloader=False)
\ No newline at end of file
@@ -0,0 +1,221 @@
+import os
+import stat
+import logging
+import hashlib
+import tarfile
+import zipfile
+import zlib
+from werkzeug.exceptions import RequestEntityTooLarge
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_EXTENSIONS = ('.zip', '.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tbz2', '.tar.xz', '.txz')
+
+# Dependencies, build output and tool state; hidden directories are skipped too
+SKIPPED_DIRS = {
+    'node_modules', 'bower_components', 'jspm_packages', 'vendor', 'third_party', 'third-party',
+    'site-packages', 'venv', '__pycache__', 'dist', 'build', 'out', 'target', 'obj',
+    'coverage', 'htmlcov', 'generated'
+}
+
+# Bundles, minified assets and generated code
+SKIPPED_SUFFIXES = (
+    '.min.js', '.min.css', '.bundle.js', '.chunk.js', '.chunk.css', '.map',
+    '_pb2.py', '_pb2_grpc.py', '.pb.go', '.pb.cc', '.pb.h', '.g.cs', '.designer.cs', '.d.ts'
+)
+
+# A line this long in the first few KB means minified or machine-written code
+GENERATED_LINE_CHARS = 1000
+GENERATED_MARKERS = (b'@generated', b'DO NOT EDIT', b'Code generated by')
+
+COPY_CHUNK = 64 * 1024
+
+
+class ArchiveError(ValueError):
+    pass
+
+
+class ArchiveLimits:
+    # max_bytes caps everything decompressed, including skipped tar members
+    # that have to be read past; max_ratio rejects zip members that claim to
+    # expand more than that many times
+    def __init__(self, max_bytes=200 * 1024 * 1024, max_files=200, max_file_bytes=512 * 1024,
+                 max_members=20000, max_ratio=100):
+        self.max_bytes = max_bytes
+        self.max_files = max_files
+        self.max_file_bytes = max_file_bytes
+        self.max_members = max_members
+        self.max_ratio = max_ratio
+
+
+def is_archive(filename):
+    return filename.lower().endswith(ARCHIVE_EXTENSIONS)
+
+
+def member_path(name):
+    # Normalized relative path for an archive member, or None if it could
+    # escape the destination
+    parts = [part for part in name.replace('\\', '/').split('/') if part not in ('', '.')]
+    if not parts or '..' in parts or ':' in parts[0]:
+        return None
+    return '/'.join(parts)
+
+
+def skip_reason(path, allowed_extensions):
+    for directory in path.split('/')[:-1]:
+        if directory.startswith('.') or directory.lower() in SKIPPED_DIRS:
+            return 'vendored'
+    name = path.rsplit('/', 1)[-1].lower()
+    if name.endswith(SKIPPED_SUFFIXES):
+        return 'generated'
+    if os.path.splitext(name)[1] not in allowed_extensions:
+        return 'unsupported'
+    return None
+
+
+def looks_generated(head):
+    if any(marker in head for marker in GENERATED_MARKERS):
+        return True
+    # The last line may be cut off by the head limit
+    lines = head.split(b'\n')[:-1] or [head]
+    return max(len(line) for line in lines) > GENERATED_LINE_CHARS
+
+
+class Extraction:
+    """Copies accepted members of one archive into a workspace.
+
+    Members are streamed to disk in chunks and hashed on the way, so neither
+    the archive nor any member is held in memory. Byte counts come from what
+    was actually decompressed, not from the archive's headers.
+    """
+
+    def __init__(self, destination, allowed_extensions, limits):
+        self.destination = os.path.abspath(destination)
+        self.allowed_extensions = allowed_extensions
+        self.limits = limits
+        self.files = {}
+        self.skipped = {}
+        self.truncated = False
+        self.bytes = 0
+        self.members = 0
+
+    def skip(self, reason):
+        self.skipped[reason] = self.skipped.get(reason, 0) + 1
+
+    def count_member(self):
+        self.members += 1
+        if self.members > self.limits.max_members:
+            raise RequestEntityTooLarge(f"Archive has more than {self.limits.max_members} entries")
+
+    def count_bytes(self, size):
+        self.bytes += size
+        if self.bytes > self.limits.max_bytes:
+            raise RequestEntityTooLarge(
+                f"Archive expands to more than {self.limits.max_bytes // (1024 * 1024)}MB"
+            )
+
+    def accept(self, name, declared_size):
+        # The member's relative path if it should be extracted
+        path = member_path(name)
+        if path is None:
+            raise ArchiveError(f"Archive contains an unsafe path: {name}")
+        reason = skip_reason(path, self.allowed_extensions)
+        if reason is None and declared_size > self.limits.max_file_bytes:
+            reason = 'too large'
+        if reason is None and path in self.files:
+            reason = 'duplicate'
+        if reason is None and len(self.files) >= self.limits.max_files:
+            self.truncated = True
+            reason = 'over file limit'
+        if reason:
+            self.skip(reason)
+            return None
+        return path
+
+    def write(self, path, source):
+        target = os.path.abspath(os.path.join(self.destination, path))
+        if not target.startswith(self.destination + os.sep):
+            raise ArchiveError(f"Archive contains an unsafe path: {path}")
+        digest = hashlib.sha256()
+        size = 0
+        head = b''
+        try:
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            with open(target, 'wb') as f:
+                while True:
+                    chunk = source.read(COPY_CHUNK)
+                    if not chunk:
+                        break
+                    self.count_bytes(len(chunk))
+                    size += len(chunk)
+                    if size > self.limits.max_file_bytes:
+                        # The header understated the size; drop the file
+                        break
+                    if len(head) < 4096:
+                        head += chunk[:4096 - len(head)]
+                    digest.update(chunk)
+                    f.write(chunk)
+        except OSError as e:
+            # e.g. a file and a directory with the same name
+            logger.warning("Could not extract %s: %s", path, e)
+            self.skip('unsupported')
+            return
+        except Exception:
+            if os.path.exists(target):
+                os.remove(target)
+            raise
+        if size > self.limits.max_file_bytes or looks_generated(head):
+            os.remove(target)
+            self.skip('too large' if size > self.limits.max_file_bytes else 'generated')
+            return
+        self.files[path] = digest.hexdigest()
+
+    def from_zip(self, archive_path):
+        with zipfile.ZipFile(archive_path) as archive:
+            for info in archive.infolist():
+                self.count_member()
+                if info.is_dir():
+                    continue
+                if stat.S_ISLNK(info.external_attr >> 16) or info.flag_bits & 0x1:
+                    # Symlinks and encrypted members
+                    self.skip('unsupported')
+                    continue
+                path = self.accept(info.filename, info.file_size)
+                if path:
+                    if info.compress_size and info.file_size / info.compress_size > self.limits.max_ratio:
+                        raise RequestEntityTooLarge(f"Archive member {info.filename} is compressed suspiciously well")
+                    with archive.open(info) as source:
+                        self.write(path, source)
+
+    def from_tar(self, archive_path):
+        # Stream mode reads the archive front to back without seeking
+        with tarfile.open(archive_path, mode='r|*') as archive:
+            for member in archive:
+                self.count_member()
+                if not member.isfile():
+                    if not member.isdir():
+                        self.skip('unsupported')
+                    continue
+                path = self.accept(member.name, member.size)
+                if path:
+                    self.write(path, archive.extractfile(member))
+                else:
+                    # Skipped members are still decompressed to read past them
+                    self.count_bytes(member.size)
+
+
+def extract_archive(archive_path, filename, destination, allowed_extensions, limits=None):
+    # Returns {'files': {path: sha256}, 'skipped': {reason: count}, 'truncated': bool}
+    # with paths relative to destination, in archive order
+    extraction = Extraction(destination, allowed_extensions, limits or ArchiveLimits())
+    try:
+        if filename.lower().endswith('.zip'):
+            extraction.from_zip(archive_path)
+        else:
+            extraction.from_tar(archive_path)
+    except (zipfile.BadZipFile, tarfile.TarError, zlib.error, EOFError) as e:
+        raise ArchiveError(f"Could not read {filename}: {e}")
+    if extraction.skipped:
+        logger.info("Extracted %d files from %s; skipped %s", len(extraction.files), filename,
+                    ', '.join(f"{count} {reason}" for reason, count in sorted(extraction.skipped.items())))
+    return {'files': extraction.files, 'skipped': extraction.skipped, 'truncated': extraction.truncated}
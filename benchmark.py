@@ -0,0 +1,490 @@
+"""Offline benchmark for the upload -> analysis -> PDF/DOCX pipeline.
+
+Gemini and Mermaid CLI are replaced by deterministic local stand-ins with
+configurable latency, so runs cost no quota and need no browser. Each
+scenario runs in its own process against a scratch working directory and
+drives the real routes through the Flask test client.
+
+    python benchmark.py                          # run every scenario
+    python benchmark.py --save main              # keep the results as a baseline
+    python benchmark.py --compare main           # diff against it; exit 1 on regression
+"""
+import os
+import sys
+import json
+import time
+import random
+import hashlib
+import argparse
+import resource
+import tempfile
+import threading
+import subprocess
+from types import SimpleNamespace
+
+from llm import local_response
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+BASELINE_DIR = os.path.join(ROOT, '.benchmarks')
+
+# name -> (file count, approximate bytes per file). Small files are batched
+# into shared requests; large ones exceed CHUNK_MAX_CHARS and are chunked.
+SCENARIOS = {
+    'small': (5, 1000),
+    'medium': (20, 4000),
+    'large': (4, 40000),
+}
+
+STAGES = ('upload', 'analysis', 'analysis_page', 'export_pdf', 'generate')
+
+EXTENSIONS = ('.py', '.js', '.java', '.go')
+
+# Stand-in for the Mermaid CLI: writes an SVG sized by the number of edges in
+# the input and, for PNG output, a blank raster at the requested scale
+MMDC_STUB = '''#!{python}
+import os, re, sys, time
+args = sys.argv[1:]
+source = open(args[args.index('-i') + 1]).read()
+out = args[args.index('-o') + 1]
+scale = float(args[args.index('-s') + 1]) if '-s' in args else 1
+time.sleep(float(os.environ.get('BENCH_MMDC_LATENCY', '0')))
+width, height = 240, 80 + 60 * max(1, source.count('-->'))
+if out.endswith('.svg'):
+    labels = ''.join('<text x="20" y="%d">%s</text>' % (40 + 60 * i, label)
+                     for i, label in enumerate(re.findall(r'\\[([^\\]]*)\\]', source)))
+    with open(out, 'w') as f:
+        f.write('<svg xmlns="http://www.w3.org/2000/svg" width="100%%" viewBox="0 0 %d %d" '
+                'style="max-width: %dpx;"><rect width="%d" height="%d" fill="white" stroke="black"/>%s</svg>'
+                % (width, height, width, width, height, labels))
+else:
+    from PIL import Image
+    Image.new('RGB', (int(width * scale), int(height * scale)), 'white').save(out)
+'''
+
+
+# ---- synthetic projects ------------------------------------------------
+
+def synthetic_source(extension, size, rng):
+    # Plausible-looking source of roughly `size` bytes: a run of small functions
+    names = []
+    lines = []
+    while sum(len(line) + 1 for line in lines) < size:
+        name = f"step_{len(names)}_{rng.randrange(10 ** 6)}"
+        names.append(name)
+        body = [f"value = value * {rng.randrange(2, 9)} + {rng.randrange(100)}" for _ in range(rng.randrange(3, 8))]
+        if extension == '.py':
+            lines += [f"def {name}(value):"] + [f"    {line}" for line in body] + ["    return value", ""]
+        elif extension == '.go':
+            lines += [f"func {name}(value int) int {{"] + [f"    {line}" for line in body] + ["    return value", "}", ""]
+        elif extension == '.java':
+            lines += [f"static int {name}(int value) {{"] + [f"    {line};" for line in body] + ["    return value;", "}", ""]
+        else:
+            lines += [f"function {name}(value) {{"] + [f"    {line};" for line in body] + ["    return value;", "}", ""]
+    return '\n'.join(lines)
+
+
+def synthetic_project(file_count, file_size, seed):
+    # Seeded per iteration so every upload misses the analysis cache
+    rng = random.Random(seed)
+    return {
+        f"module_{index}{EXTENSIONS[index % len(EXTENSIONS)]}":
+            synthetic_source(EXTENSIONS[index % len(EXTENSIONS)], file_size, rng).encode('utf-8')
+        for index in range(file_count)
+    }
+
+
+# ---- stub LLM ------------------------------------------------------------
+
+class StubModel:
+    """Drop-in for genai.GenerativeModel with a fixed, seeded latency."""
+
+    latency = 0.0
+    jitter = 0.0
+
+    def __init__(self, model_name='stub', **kwargs):
+        self.model_name = model_name
+
+    def _delay(self, prompt):
+        # Jitter is derived from the prompt so reruns sleep identically
+        spread = int(hashlib.sha256(prompt.encode('utf-8')).hexdigest()[:8], 16) / 0xffffffff
+        return max(0.0, self.latency * (1 + self.jitter * (2 * spread - 1)))
+
+    def generate_content(self, prompt, stream=False, **kwargs):
+        text = local_response(prompt)
+        usage = SimpleNamespace(prompt_token_count=len(prompt) // 4, candidates_token_count=len(text) // 4)
+        delay = self._delay(prompt)
+        if not stream:
+            time.sleep(delay)
+            return SimpleNamespace(text=text, usage_metadata=usage)
+        return StubStream(text, usage, delay)
+
+
+class StubStream:
+    # Half the delay before the first chunk, the rest spread over the others
+    CHUNK = 64
+
+    def __init__(self, text, usage, delay):
+        self.text = text
+        self.usage_metadata = usage
+        self.delay = delay
+
+    def __iter__(self):
+        chunks = [self.text[i:i + self.CHUNK] for i in range(0, len(self.text), self.CHUNK)] or ['']
+        time.sleep(self.delay / 2)
+        for chunk in chunks:
+            yield SimpleNamespace(text=chunk)
+            time.sleep(self.delay / 2 / len(chunks))
+
+
+# ---- measurement ---------------------------------------------------------
+
+def peak_rss_mb():
+    # ru_maxrss is KiB on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def current_rss_mb():
+    # Resident set size right now; None where /proc isn't available
+    try:
+        with open('/proc/self/statm') as f:
+            pages = int(f.read().split()[1])
+    except (OSError, ValueError, IndexError):
+        return None
+    return pages * resource.getpagesize() / (1024 * 1024)
+
+
+class RssSampler:
+    """Highest resident set size seen while one stage runs.
+
+    ru_maxrss only ever grows over the process lifetime, so a background
+    thread polls the current RSS instead. Without /proc the lifetime peak is
+    the best available and is reported as is.
+    """
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.peak = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _sample(self):
+        rss = current_rss_mb()
+        if rss is not None:
+            self.peak = max(self.peak or 0.0, rss)
+        return rss
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def __enter__(self):
+        if self._sample() is not None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        if self._thread:
+            self._stop.set()
+            self._thread.join()
+            self._sample()
+        else:
+            self.peak = peak_rss_mb()
+        return False
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    if not ordered:
+        return None
+    rank = (len(ordered) - 1) * pct / 100
+    low = int(rank)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+def internal_stages(metrics):
+    # Totals of app-side stage timings, summed over labels
+    totals = {}
+    for labels, count, total in metrics.snapshot('stage_duration_seconds'):
+        stage = labels.get('stage', 'unknown')
+        previous = totals.get(stage, (0, 0.0))
+        totals[stage] = (previous[0] + count, previous[1] + total)
+    return totals
+
+
+def wait_for_job(client, timeout):
+    with client.session_transaction() as sess:
+        job_id = sess.get('job_id')
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        progress = client.get(f'/jobs/{job_id}').get_json()
+        if progress['status'] in ('done', 'error'):
+            return progress
+        time.sleep(0.01)
+    raise TimeoutError(f"Job {job_id} did not finish within {timeout}s")
+
+
+def run_scenario(name, iterations, warmup, timeout):
+    # Runs inside the child process with the stubs already installed
+    import io
+    import app as app_module
+
+    file_count, file_size = SCENARIOS[name]
+    flask_app = app_module.create_app({'TESTING': True})
+    services = flask_app.extensions['eleventh_hour']
+    samples = {stage: [] for stage in STAGES}
+    rss = {stage: 0.0 for stage in STAGES}
+    errors = {}
+    total_bytes = 0
+    internal_before = None
+
+    def step(stage, fn, record):
+        with RssSampler() as sampler:
+            start = time.perf_counter()
+            ok = fn()
+            duration = time.perf_counter() - start
+        if not ok:
+            errors[stage] = errors.get(stage, 0) + 1
+        if record:
+            samples[stage].append(duration)
+            rss[stage] = max(rss[stage], sampler.peak)
+
+    for iteration in range(warmup + iterations):
+        record = iteration >= warmup
+        if record and internal_before is None:
+            internal_before = internal_stages(services.metrics)
+        project = synthetic_project(file_count, file_size, seed=f"{name}:{iteration}")
+        if record:
+            total_bytes += sum(len(content) for content in project.values())
+        client = flask_app.test_client()
+
+        def upload():
+            files = [(io.BytesIO(content), filename) for filename, content in project.items()]
+            response = client.post('/upload', data={'files': files}, content_type='multipart/form-data')
+            return response.status_code == 302 and response.headers['Location'].endswith('/analysis')
+
+        def analysis():
+            progress = wait_for_job(client, timeout)
+            return all(entry['status'] == 'done' for entry in progress['files'])
+
+        def page():
+            return client.get('/analysis').status_code == 200
+
+        def pdf():
+            response = client.get('/export_pdf')
+            return response.status_code == 200 and response.mimetype == 'application/pdf'
+
+        def docx():
+            client.post('/questions', data={
+                'project_title': f"Benchmark {name}", 'author_name': 'Bench', 'author_reg_number': str(iteration),
+                'institution_department': 'Performance', 'city': 'Localhost',
+                'project_goal': 'Measure throughput', 'project_audience': 'Maintainers'
+            })
+            response = client.get('/generate')
+            return response.status_code == 200 and response.mimetype.endswith('document')
+
+        step('upload', upload, record)
+        step('analysis', analysis, record)
+        step('analysis_page', page, record)
+        step('export_pdf', pdf, record)
+        step('generate', docx, record)
+
+    internal_after = internal_stages(services.metrics)
+    internal = {}
+    for stage, (count, total) in sorted(internal_after.items()):
+        before_count, before_total = (internal_before or {}).get(stage, (0, 0.0))
+        if count > before_count:
+            internal[stage] = {'count': count - before_count, 'mean': (total - before_total) / (count - before_count)}
+
+    stages = {}
+    for stage in STAGES:
+        values = samples[stage]
+        mean = sum(values) / len(values) if values else 0
+        stages[stage] = {
+            'p50': percentile(values, 50),
+            'p95': percentile(values, 95),
+            'peak_rss_mb': round(rss[stage], 1),
+            'files_per_s': file_count / mean if mean else None,
+            'errors': errors.get(stage, 0)
+        }
+    return {
+        'files': file_count,
+        'bytes_per_iteration': total_bytes // max(1, iterations),
+        'iterations': iterations,
+        'stages': stages,
+        'internal': internal,
+        'startup': dict(services.startup_seconds),
+        'peak_rss_mb': round(peak_rss_mb(), 1)
+    }
+
+
+def child_main(args):
+    # Stubs must be in place before app.py is imported
+    stub_dir = os.path.join(args.workdir, 'bin')
+    os.makedirs(stub_dir, exist_ok=True)
+    mmdc = os.path.join(stub_dir, 'mmdc')
+    with open(mmdc, 'w') as f:
+        f.write(MMDC_STUB.format(python=sys.executable))
+    os.chmod(mmdc, 0o755)
+    os.environ['PATH'] = stub_dir + os.pathsep + os.environ.get('PATH', '')
+    os.environ['BENCH_MMDC_LATENCY'] = str(args.mmdc_latency)
+    os.environ['MERMAID_RENDERER'] = 'mmdc'
+    # Gemini is the backend that gets stubbed; never reach a real provider
+    os.environ['LLM_BACKEND'] = 'gemini'
+    os.environ['LLM_HEDGE_BACKEND'] = ''
+    os.environ.setdefault('GEMINI_API_KEY', 'benchmark')
+    # The client-side quota would otherwise dominate every run
+    os.environ.setdefault('GEMINI_RPM', '1000000')
+    os.environ.setdefault('GEMINI_TPM', '1000000000')
+    os.environ.setdefault('LOG_LEVEL', 'WARNING')
+    os.chdir(args.workdir)
+    sys.path.insert(0, ROOT)
+
+    import google.generativeai as genai
+    StubModel.latency = args.llm_latency
+    StubModel.jitter = args.llm_jitter
+    genai.GenerativeModel = StubModel
+
+    result = run_scenario(args.child, args.iterations, args.warmup, args.timeout)
+    json.dump(result, sys.stdout)
+
+
+# ---- reporting -----------------------------------------------------------
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def format_ms(seconds):
+    return '-' if seconds is None else f"{seconds * 1000:.1f}"
+
+
+def print_results(results):
+    for name, result in results['scenarios'].items():
+        print(f"\n{name}: {result['files']} files, ~{result['bytes_per_iteration'] // 1024} KiB, "
+              f"{result['iterations']} iterations, peak RSS {result['peak_rss_mb']} MiB")
+        print(f"  {'stage':<16}{'p50 ms':>10}{'p95 ms':>10}{'files/s':>10}{'RSS MiB':>10}{'errors':>8}")
+        for stage, values in result['stages'].items():
+            rate = '-' if values['files_per_s'] is None else f"{values['files_per_s']:.1f}"
+            print(f"  {stage:<16}{format_ms(values['p50']):>10}{format_ms(values['p95']):>10}"
+                  f"{rate:>10}{values['peak_rss_mb']:>10}{values['errors']:>8}")
+        if result.get('startup'):
+            print('  startup ms: ' + ', '.join(
+                f"{phase} {format_ms(seconds)}" for phase, seconds in result['startup'].items()))
+        if result['internal']:
+            print('  internal stages (mean ms x count): ' + ', '.join(
+                f"{stage} {format_ms(values['mean'])}x{values['count']}"
+                for stage, values in result['internal'].items()))
+
+
+def compare(results, baseline, threshold, min_delta):
+    # Prints per-stage changes; returns the regressions beyond threshold.
+    # Latency changes smaller than min_delta seconds are treated as noise.
+    regressions = []
+    print(f"\nCompared with baseline from {baseline.get('revision') or 'unknown revision'} "
+          f"(threshold {threshold:.0%}):")
+    for name, result in results['scenarios'].items():
+        base = baseline['scenarios'].get(name)
+        if not base:
+            print(f"  {name}: not in baseline")
+            continue
+        for stage, values in result['stages'].items():
+            base_values = base['stages'].get(stage)
+            if not base_values:
+                continue
+            changes = []
+            for metric in ('p50', 'p95', 'peak_rss_mb'):
+                old, new = base_values.get(metric), values.get(metric)
+                if not old or new is None:
+                    continue
+                change = (new - old) / old
+                changes.append(f"{metric} {change:+.0%}")
+                if change > threshold and (metric == 'peak_rss_mb' or new - old > min_delta):
+                    regressions.append(f"{name}/{stage} {metric}")
+            print(f"  {name}/{stage}: {', '.join(changes)}")
+        old, new = sum(base.get('startup', {}).values()), sum(result.get('startup', {}).values())
+        if old and new:
+            change = (new - old) / old
+            print(f"  {name}/startup: {change:+.0%}")
+            if change > threshold and new - old > min_delta:
+                regressions.append(f"{name}/startup")
+    return regressions
+
+
+def run_child(name, args):
+    with tempfile.TemporaryDirectory(prefix=f'bench-{name}-') as workdir:
+        command = [
+            sys.executable, os.path.abspath(__file__), '--child', name, '--workdir', workdir,
+            '--iterations', str(args.iterations), '--warmup', str(args.warmup), '--timeout', str(args.timeout),
+            '--llm-latency', str(args.llm_latency), '--llm-jitter', str(args.llm_jitter),
+            '--mmdc-latency', str(args.mmdc_latency)
+        ]
+        completed = subprocess.run(command, capture_output=True, text=True)
+    if completed.returncode != 0:
+        raise RuntimeError(f"Scenario {name} failed:\n{completed.stderr}")
+    return json.loads(completed.stdout)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--scenario', action='append', choices=sorted(SCENARIOS),
+                        help='scenario to run; repeat for several (default: all)')
+    parser.add_argument('--iterations', type=int, default=5)
+    parser.add_argument('--warmup', type=int, default=1, help='unrecorded iterations run first')
+    parser.add_argument('--llm-latency', type=float, default=0.2, help='seconds per stub LLM call')
+    parser.add_argument('--llm-jitter', type=float, default=0.25, help='+/- fraction of the LLM latency')
+    parser.add_argument('--mmdc-latency', type=float, default=0.3, help='seconds per stub mmdc run')
+    parser.add_argument('--timeout', type=float, default=300, help='seconds to wait for one analysis job')
+    parser.add_argument('--save', metavar='NAME', help=f'save results as {BASELINE_DIR}/NAME.json')
+    parser.add_argument('--compare', metavar='NAME', help='compare with a saved baseline')
+    parser.add_argument('--threshold', type=float, default=0.15, help='relative slowdown counted as a regression')
+    parser.add_argument('--min-delta-ms', type=float, default=5, help='ignore latency changes smaller than this')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    parser.add_argument('--workdir', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child_main(args)
+        return 0
+
+    results = {
+        'revision': git_revision(),
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'settings': {
+            'iterations': args.iterations, 'warmup': args.warmup, 'llm_latency': args.llm_latency,
+            'llm_jitter': args.llm_jitter, 'mmdc_latency': args.mmdc_latency
+        },
+        'scenarios': {}
+    }
+    for name in args.scenario or SCENARIOS:
+        print(f"Running {name}...", file=sys.stderr)
+        results['scenarios'][name] = run_child(name, args)
+    print_results(results)
+
+    status = 0
+    if args.compare:
+        with open(os.path.join(BASELINE_DIR, f"{args.compare}.json"), 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        if baseline.get('settings') != results['settings']:
+            print("Warning: baseline was recorded with different settings", file=sys.stderr)
+        regressions = compare(results, baseline, args.threshold, args.min_delta_ms / 1000)
+        if regressions:
+            print("Regressions: " + ', '.join(regressions))
+            status = 1
+    if args.save:
+        os.makedirs(BASELINE_DIR, exist_ok=True)
+        path = os.path.join(BASELINE_DIR, f"{args.save}.json")
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+        print(f"Saved baseline to {path}")
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
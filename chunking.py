@@ -0,0 +1,191 @@
+import ast
+import re
+
+BRACE_EXTENSIONS = {'.js', '.jsx', '.ts', '.tsx', '.java', '.c', '.cpp', '.h', '.cs', '.go', '.php', '.css'}
+
+# Column-0 lines that continue the previous block rather than start a new one
+CONTINUATION_PREFIXES = ('end', 'else', 'elsif', 'elif', 'except', 'finally', 'rescue', 'ensure', ')', ']', '}')
+
+
+def split_source(code, extension, max_chars):
+    # Returns [{'name': ..., 'code': ...}], one entry when no split is needed
+    if len(code) <= max_chars:
+        return [{'name': 'whole file', 'code': code}]
+
+    units = None
+    if extension == '.py':
+        units = python_units(code)
+    elif extension in BRACE_EXTENSIONS:
+        units = brace_units(code)
+    if not units:
+        units = indentation_units(code)
+    return pack_units(units, max_chars)
+
+
+def python_units(code):
+    try:
+        tree = ast.parse(code)
+    except SyntaxError:
+        return None
+
+    lines = code.splitlines(keepends=True)
+    units = []
+    cursor = 0
+
+    def node_start(node):
+        # Decorators belong to the function/class they wrap
+        decorators = getattr(node, 'decorator_list', [])
+        return min([node.lineno] + [d.lineno for d in decorators]) - 1
+
+    for node in tree.body:
+        if not isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            continue
+        start, end = node_start(node), node.end_lineno
+        if start > cursor:
+            units.append(('module code', ''.join(lines[cursor:start])))
+        kind = 'class' if isinstance(node, ast.ClassDef) else 'function'
+        units.append((f"{kind} {node.name}", ''.join(lines[start:end])))
+        cursor = end
+    if cursor < len(lines):
+        units.append(('module code', ''.join(lines[cursor:])))
+    return [unit for unit in units if unit[1].strip()]
+
+
+def brace_units(code):
+    # Top-level blocks end where brace depth returns to zero; strings and
+    # comments are skipped so braces inside them don't count
+    units = []
+    depth = 0
+    start = 0
+    i = 0
+    length = len(code)
+    while i < length:
+        ch = code[i]
+        if code.startswith('//', i):
+            end = code.find('\n', i)
+            i = length if end == -1 else end
+            continue
+        if code.startswith('/*', i):
+            end = code.find('*/', i + 2)
+            i = length if end == -1 else end + 2
+            continue
+        if ch in '"\'`':
+            i += 1
+            while i < length and code[i] != ch:
+                if code[i] == '\\':
+                    i += 1
+                elif code[i] == '\n' and ch != '`':
+                    break
+                i += 1
+        elif ch == '{':
+            depth += 1
+        elif ch == '}':
+            depth = max(0, depth - 1)
+            if depth == 0:
+                end = code.find('\n', i)
+                end = length if end == -1 else end + 1
+                units.append((block_name(code[start:end]), code[start:end]))
+                start = i = end
+                continue
+        i += 1
+    if start < length:
+        units.append(('module code', code[start:]))
+    return [unit for unit in units if unit[1].strip()]
+
+
+def block_name(block):
+    # Use the first line that opens the block, trimmed, as a readable name
+    for line in block.splitlines():
+        line = line.strip()
+        if line and not line.startswith(('//', '/*', '*', '@', '#')):
+            return line.rstrip('{ ').strip()[:60] or 'block'
+    return 'block'
+
+
+def indentation_units(code):
+    units = []
+    current = []
+    for line in code.splitlines(keepends=True):
+        starts_block = line.strip() and not line[0].isspace() and not line.lstrip().startswith(CONTINUATION_PREFIXES)
+        if starts_block and any(l.strip() for l in current):
+            units.append((block_name(''.join(current)), ''.join(current)))
+            current = []
+        current.append(line)
+    if current:
+        units.append((block_name(''.join(current)), ''.join(current)))
+    return [unit for unit in units if unit[1].strip()]
+
+
+def pack_units(units, max_chars):
+    # Greedily combine adjacent units into chunks of at most max_chars;
+    # a single oversized unit is split on line boundaries
+    chunks = []
+    names = []
+    buffer = ''
+
+    def flush():
+        nonlocal buffer, names
+        if buffer.strip():
+            name = names[0] if len(names) == 1 else f"{names[0]} to {names[-1]}"
+            chunks.append({'name': name, 'code': buffer})
+        buffer = ''
+        names = []
+
+    for name, text in units:
+        if len(text) > max_chars:
+            flush()
+            part = ''
+            for line in text.splitlines(keepends=True):
+                if part and len(part) + len(line) > max_chars:
+                    chunks.append({'name': f"{name} (part)", 'code': part})
+                    part = ''
+                part += line
+            if part.strip():
+                chunks.append({'name': f"{name} (part)", 'code': part})
+            continue
+        if buffer and len(buffer) + len(text) > max_chars:
+            flush()
+        buffer += text
+        if name not in names:
+            names.append(name)
+    flush()
+    return chunks
+
+
+ARROW = re.compile(r'(\s*(?:-->|---|==>|-\.->|-\.-)\s*(?:\|[^|]*\|)?\s*)')
+NODE_ID = re.compile(r'^(\s*)([A-Za-z0-9_]+)')
+
+
+def prefix_node_ids(line, prefix):
+    parts = ARROW.split(line)
+    # Even indexes are node expressions, odd ones are the arrows between them
+    for i in range(0, len(parts), 2):
+        parts[i] = NODE_ID.sub(lambda m: f"{m.group(1)}{prefix}{m.group(2)}", parts[i], count=1)
+    return ''.join(parts)
+
+
+def merge_flowcharts(parts):
+    # parts: [(title, mermaid_source)]. Each sub-flowchart becomes a subgraph
+    # with namespaced node ids, and subgraphs are chained in source order.
+    lines = ['graph TD']
+    subgraphs = []
+    for index, (title, source) in enumerate(parts, 1):
+        body = [line.strip() for line in (source or '').split('\n')
+                if line.strip() and not line.strip().startswith(('graph', 'flowchart'))]
+        if not body:
+            continue
+        subgraph_id = f"Part{index}"
+        label = re.sub(r'[^A-Za-z0-9 _]+', ' ', title).strip()[:40] or subgraph_id
+        lines.append(f"subgraph {subgraph_id}[{label}]")
+        for line in body:
+            if line == 'end':
+                lines.append(line)
+            elif line.startswith('subgraph '):
+                lines.append(f"subgraph P{index}_{line[len('subgraph '):].lstrip()}")
+            elif not line.startswith(('classDef', 'class ', 'style', 'linkStyle', 'click', '%%')):
+                lines.append(prefix_node_ids(line, f"P{index}_"))
+        lines.append('end')
+        subgraphs.append(subgraph_id)
+    for previous, following in zip(subgraphs, subgraphs[1:]):
+        lines.append(f"{previous}-->{following}")
+    return '\n'.join(lines) if subgraphs else None
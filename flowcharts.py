@@ -0,0 +1,128 @@
+import io
+import logging
+import os
+import re
+import tempfile
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Each flowchart is kept as an SVG master, `<stem>.svg`, plus one PNG per
+# consumer, `<stem>.<variant>.png`, sized for where it is displayed
+
+
+def variant_path(svg_path, variant):
+    return f"{os.path.splitext(svg_path)[0]}.{variant}.png"
+
+
+def flowchart_files(svg_path, variants):
+    # Suffix -> path for the master and every variant that exists on disk
+    files = {'svg': svg_path}
+    files.update({f"{variant}.png": variant_path(svg_path, variant) for variant in variants})
+    return {suffix: path for suffix, path in files.items() if os.path.exists(path)}
+
+
+def is_rendered(svg_path, variants, source_path):
+    # True once the master and every variant exist and are newer than the
+    # Mermaid source they were rendered from
+    files = flowchart_files(svg_path, variants)
+    if len(files) < len(variants) + 1:
+        return False
+    try:
+        source_mtime = os.path.getmtime(source_path)
+        return all(os.path.getmtime(path) >= source_mtime for path in files.values())
+    except OSError:
+        return False
+
+
+class SingleFlight:
+    """Runs at most one call per key at a time.
+
+    Callers that arrive while a call for their key is in flight wait for it
+    and get its result (or exception) instead of starting their own.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def run(self, key, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = {'done': threading.Event(), 'result': None, 'error': None}
+        if leader:
+            try:
+                call['result'] = fn()
+            except Exception as e:
+                call['error'] = e
+            finally:
+                with self._lock:
+                    del self._calls[key]
+                call['done'].set()
+        else:
+            call['done'].wait()
+        if call['error'] is not None:
+            raise call['error']
+        return call['result']
+
+
+def svg_width(svg):
+    # Intrinsic width of a Mermaid SVG, from its viewBox or width attribute
+    head = svg[:2000].decode('utf-8', 'replace') if isinstance(svg, bytes) else svg[:2000]
+    match = re.search(r'viewBox="[-\d.]+[ ,]+[-\d.]+[ ,]+([\d.]+)', head)
+    if not match:
+        match = re.search(r'<svg[^>]*\bwidth="([\d.]+)(?:px)?"', head)
+    return float(match.group(1)) if match else None
+
+
+def write_raster_variants(master_png, svg_path, widths):
+    # Downsample one large render into each variant's width. Variants are
+    # never upscaled; a small chart keeps its rendered size, and variants
+    # that come out the same size share one encode.
+    from PIL import Image
+    encoded = {}
+    with Image.open(io.BytesIO(master_png)) as master:
+        master.load()
+        for variant, width in widths.items():
+            size = master.size
+            if master.width > width:
+                size = (width, max(1, round(master.height * width / master.width)))
+            if size not in encoded:
+                img = master if size == master.size else master.resize(size, Image.Resampling.LANCZOS)
+                output = io.BytesIO()
+                img.save(output, format='PNG')
+                encoded[size] = output.getvalue()
+            target = variant_path(svg_path, variant)
+            fd, tmp_path = tempfile.mkstemp(prefix=f"{os.path.basename(target)}.", suffix='.tmp',
+                                            dir=os.path.dirname(target) or '.')
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(encoded[size])
+                os.replace(tmp_path, target)
+            except BaseException:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                raise
+
+
+def svg_drawing(svg_path, max_width, max_height):
+    # The SVG as a reportlab Drawing scaled to fit the box, or None when
+    # svglib is not installed or can't read the file
+    try:
+        from svglib.svglib import svg2rlg
+    except ImportError:
+        return None
+    try:
+        drawing = svg2rlg(svg_path)
+    except Exception as e:
+        logger.warning("Could not convert %s to a vector drawing: %s", svg_path, e)
+        return None
+    if drawing is None or not drawing.width or not drawing.height:
+        return None
+    scale = min(max_width / drawing.width, max_height / drawing.height)
+    drawing.scale(scale, scale)
+    drawing.width *= scale
+    drawing.height *= scale
+    return drawing
@@ -0,0 +1,131 @@
+import os
+import logging
+import json
+import time
+import uuid
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+
+class JobManager:
+    """Background analysis jobs with per-file progress.
+
+    Job records are written to JSON files in `folder` so any worker process
+    can report status, while the work itself runs on this process's pool.
+    """
+
+    def __init__(self, folder, workers=2, max_age=24 * 3600):
+        self.folder = folder
+        self.max_age = max_age
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='job')
+        self._lock = threading.Lock()
+        os.makedirs(self.folder, exist_ok=True)
+
+    def _path(self, job_id):
+        return os.path.join(self.folder, f"{job_id}.json")
+
+    def _write(self, job):
+        job['updated'] = time.time()
+        tmp_path = f"{self._path(job['id'])}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(job, f)
+        os.replace(tmp_path, self._path(job['id']))
+
+    def get(self, job_id):
+        # Job ids come from the session, but never trust them as paths
+        if not job_id or not all(c in '0123456789abcdef' for c in job_id):
+            return None
+        try:
+            with open(self._path(job_id), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def create(self, owner, filenames, reused=None):
+        # reused maps filenames to results kept from an earlier upload; they
+        # are listed as done so progress covers the whole project
+        self.cleanup()
+        reused = reused or {}
+        job = {
+            'id': uuid.uuid4().hex,
+            'owner': owner,
+            'status': 'queued',
+            'created': time.time(),
+            'files': [
+                {'name': name, 'status': 'done', 'result': reused[name], 'reused': True} if name in reused
+                else {'name': name, 'status': 'pending', 'result': None}
+                for name in filenames
+            ]
+        }
+        with self._lock:
+            self._write(job)
+        return job
+
+    def submit(self, job_id, fn, *args):
+        def run():
+            self._set_status(job_id, 'running')
+            try:
+                fn(job_id, *args)
+            except Exception as e:
+                logger.exception("Job %s failed: %s", job_id, e)
+            finally:
+                self._set_status(job_id, 'done')
+        self._executor.submit(run)
+
+    def cancel(self, job_id):
+        # Superseded jobs stop starting files and stop writing outputs; the
+        # flag lives in the job file so the worker running it sees it too
+        with self._lock:
+            job = self.get(job_id)
+            if job and job['status'] != 'done':
+                job['cancelled'] = True
+                self._write(job)
+
+    def cancelled(self, job_id):
+        job = self.get(job_id)
+        return bool(job and job.get('cancelled'))
+
+    def _set_status(self, job_id, status):
+        with self._lock:
+            job = self.get(job_id)
+            if job:
+                job['status'] = status
+                self._write(job)
+
+    def update_file(self, job_id, filename, status, result=None, partial=None):
+        with self._lock:
+            job = self.get(job_id)
+            if not job:
+                return
+            for entry in job['files']:
+                if entry['name'] == filename:
+                    entry['status'] = status
+                    if result is not None:
+                        entry['result'] = result
+                        entry.pop('partial', None)
+                    elif partial is not None:
+                        entry['partial'] = partial
+            self._write(job)
+
+    def cleanup(self):
+        now = time.time()
+        for name in os.listdir(self.folder):
+            path = os.path.join(self.folder, name)
+            try:
+                if now - os.path.getmtime(path) > self.max_age:
+                    os.remove(path)
+            except OSError:
+                pass
+
+    @staticmethod
+    def progress(job):
+        done = sum(1 for entry in job['files'] if entry['status'] in ('done', 'error'))
+        return {
+            'id': job['id'],
+            'status': job['status'],
+            'completed': done,
+            'total': len(job['files']),
+            'files': job['files']
+        }
@@ -0,0 +1,309 @@
+import re
+import json
+import time
+import hashlib
+import logging
+import threading
+import importlib.util
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from ratelimit import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+
+class LLMResponse:
+    """Text of one completion, its token usage and the backend that wrote it."""
+
+    def __init__(self, text, backend, prompt_tokens=None, completion_tokens=None):
+        self.text = text
+        self.backend = backend
+        self.prompt_tokens = prompt_tokens if isinstance(prompt_tokens, int) else None
+        self.completion_tokens = completion_tokens if isinstance(completion_tokens, int) else None
+
+
+class LLMBackend:
+    """Interface for text-completion providers.
+
+    `generate(prompt, on_partial)` returns an LLMResponse. With on_partial the
+    response is streamed and the text so far is reported after each chunk.
+    Each backend holds one client for its lifetime, shared by every caller.
+    The client and its SDK are only loaded by the first call, so building a
+    backend is cheap and worker processes boot without them.
+    """
+
+    name = 'base'
+
+    def __init__(self, model):
+        self.model = model
+        self._client = None
+        self._client_lock = threading.Lock()
+
+    @property
+    def client(self):
+        with self._client_lock:
+            if self._client is None:
+                self._client = self.create_client()
+            return self._client
+
+    def create_client(self):
+        raise NotImplementedError
+
+    @property
+    def identity(self):
+        # Goes into cache keys: results from another provider or model are not reused
+        return f"{self.name}:{self.model}"
+
+    def generate(self, prompt, on_partial=None, validate=None):
+        raise NotImplementedError
+
+    def stats(self):
+        return {}
+
+
+class GeminiBackend(LLMBackend):
+    name = 'gemini'
+
+    def __init__(self, model, api_key, limiter):
+        if importlib.util.find_spec('google.generativeai') is None:
+            raise RuntimeError("The google-generativeai package is not installed")
+        super().__init__(model)
+        self.api_key = api_key
+        self.limiter = limiter
+
+    def create_client(self):
+        import google.generativeai as genai
+        genai.configure(api_key=self.api_key)
+        return genai.GenerativeModel(self.model)
+
+    def generate(self, prompt, on_partial=None, validate=None):
+        # All traffic goes through the limiter, which queues callers and
+        # retries 429/5xx responses with backoff
+        def complete():
+            if on_partial is None:
+                response = self.client.generate_content(prompt)
+            else:
+                response = self.client.generate_content(prompt, stream=True)
+                text = ''
+                for chunk in response:
+                    try:
+                        text += chunk.text
+                    except ValueError:
+                        # Chunks without text parts (e.g. the final finish-reason chunk)
+                        continue
+                    on_partial(text)
+            usage = getattr(response, 'usage_metadata', None)
+            return LLMResponse(
+                response.text, self.identity,
+                getattr(usage, 'prompt_token_count', None), getattr(usage, 'candidates_token_count', None)
+            )
+
+        return self.limiter.call(complete, estimate_tokens(prompt))
+
+    def stats(self):
+        return self.limiter.stats()
+
+
+class AnthropicBackend(LLMBackend):
+    name = 'anthropic'
+
+    def __init__(self, model, api_key, limiter, max_tokens=4096):
+        if importlib.util.find_spec('anthropic') is None:
+            raise RuntimeError("The anthropic package is not installed")
+        super().__init__(model)
+        self.api_key = api_key
+        self.limiter = limiter
+        self.max_tokens = max_tokens
+
+    def create_client(self):
+        import anthropic
+        # Retries are left to the limiter so they share its backoff gate
+        return anthropic.Anthropic(api_key=self.api_key, max_retries=0)
+
+    def generate(self, prompt, on_partial=None, validate=None):
+        request = {
+            'model': self.model,
+            'max_tokens': self.max_tokens,
+            'messages': [{'role': 'user', 'content': prompt}]
+        }
+
+        def complete():
+            if on_partial is None:
+                message = self.client.messages.create(**request)
+            else:
+                with self.client.messages.stream(**request) as stream:
+                    text = ''
+                    for chunk in stream.text_stream:
+                        text += chunk
+                        on_partial(text)
+                    message = stream.get_final_message()
+            text = ''.join(block.text for block in message.content if block.type == 'text')
+            return LLMResponse(text, self.identity, message.usage.input_tokens, message.usage.output_tokens)
+
+        return self.limiter.call(complete, estimate_tokens(prompt))
+
+    def stats(self):
+        return self.limiter.stats()
+
+
+class LocalBackend(LLMBackend):
+    """Deterministic answers computed from the prompt alone, for tests and
+    offline runs. Understands the prompt shapes app.py sends."""
+
+    name = 'local'
+
+    def __init__(self, model='stub', latency=0.0):
+        super().__init__(model)
+        self.latency = latency
+
+    def generate(self, prompt, on_partial=None, validate=None):
+        text = local_response(prompt)
+        time.sleep(self.latency)
+        if on_partial is not None:
+            for end in range(64, len(text) + 64, 64):
+                on_partial(text[:end])
+        return LLMResponse(text, self.identity, len(prompt) // 4, len(text) // 4)
+
+
+class HedgedBackend(LLMBackend):
+    """Sends a slow prompt to a second backend as well.
+
+    When the primary has not answered within its recent p95 latency (or
+    initial_delay until min_samples calls have been seen), or fails, the
+    same prompt goes to the secondary. The first answer that passes the
+    caller's validate(text) wins; the other call runs to completion in the
+    background and is discarded.
+    """
+
+    def __init__(self, primary, secondary, percentile=95, initial_delay=10.0,
+                 min_samples=20, window=200, max_workers=32):
+        super().__init__(primary.model)
+        self.name = primary.name
+        self.primary = primary
+        self.secondary = secondary
+        self.percentile = percentile
+        self.initial_delay = initial_delay
+        self.min_samples = min_samples
+        self._latencies = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='llm-hedge')
+        self.hedged = 0
+        self.secondary_wins = 0
+
+    @property
+    def identity(self):
+        # Either backend answers the same prompt, so results are keyed by the primary
+        return self.primary.identity
+
+    def deadline(self):
+        with self._lock:
+            samples = sorted(self._latencies)
+        if len(samples) < self.min_samples:
+            return self.initial_delay
+        return samples[min(len(samples) - 1, int(len(samples) * self.percentile / 100))]
+
+    def _call_primary(self, prompt, on_partial):
+        start = time.monotonic()
+        response = self.primary.generate(prompt, on_partial)
+        with self._lock:
+            self._latencies.append(time.monotonic() - start)
+        return response
+
+    def generate(self, prompt, on_partial=None, validate=None):
+        settled = threading.Event()
+
+        def forward(text):
+            # A losing primary must not overwrite the winner's text
+            if not settled.is_set():
+                on_partial(text)
+
+        def valid(response):
+            if validate is None:
+                return bool(response.text.strip())
+            try:
+                return bool(validate(response.text))
+            except Exception:
+                return False
+
+        futures = {self._executor.submit(self._call_primary, prompt, forward if on_partial else None): self.primary}
+        pending = set(futures)
+        timeout = self.deadline()
+        fallback = None
+        error = None
+        while pending:
+            hedging = len(futures) > 1
+            done, pending = wait(pending, timeout=None if hedging else timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    response = future.result()
+                except Exception as e:
+                    logger.warning("%s backend failed: %s", futures[future].name, e)
+                    error = error or e
+                    continue
+                if valid(response):
+                    settled.set()
+                    if futures[future] is self.secondary:
+                        with self._lock:
+                            self.secondary_wins += 1
+                    return response
+                fallback = fallback or response
+            if not hedging:
+                with self._lock:
+                    self.hedged += 1
+                reason = 'gave no usable answer' if done else f'had not answered after {timeout:.1f}s'
+                logger.info("Hedging LLM call to %s: %s %s", self.secondary.name, self.primary.name, reason)
+                future = self._executor.submit(self.secondary.generate, prompt)
+                futures[future] = self.secondary
+                pending.add(future)
+
+        # Neither answer was valid: hand back what there is so the caller's
+        # own parsing reports the problem
+        settled.set()
+        if fallback is not None:
+            return fallback
+        raise error
+
+    def stats(self):
+        with self._lock:
+            hedge_stats = {'hedged': self.hedged, 'secondary_wins': self.secondary_wins}
+        hedge_stats['deadline'] = round(self.deadline(), 3)
+        return dict(self.primary.stats(), **hedge_stats)
+
+
+# ---- deterministic local answers ------------------------------------------
+
+def local_flowchart(code):
+    steps = re.findall(r'(?:def|func|function|static int)\s+(\w+)', code)[:6] or ['process']
+    nodes = ['A[Start]'] + [f"N{i}[{name}]" for i, name in enumerate(steps)] + ['Z[End]']
+    ids = [node.split('[')[0] for node in nodes]
+    return 'graph TD\n' + '\n'.join(nodes) + '\n' + '\n'.join(f"{a}-->{b}" for a, b in zip(ids, ids[1:]))
+
+
+def local_analysis(name, code):
+    digest = hashlib.sha256(code.encode('utf-8')).hexdigest()[:8]
+    return {
+        'summary': f"{name} defines {len(code.splitlines())} lines of code ({digest}).",
+        'mermaid': local_flowchart(code),
+        'description': f"Each step in {name} passes its result to the next."
+    }
+
+
+def local_response(prompt):
+    if 'Analyze each of the following' in prompt:
+        files = re.findall(r"File `(.+?)`:\n```\w*\n(.*?)\n```", prompt, re.S)
+        return json.dumps({name: local_analysis(name, code) for name, code in files})
+    match = re.search(r"Analyze the following code from the file `(.+?)`.*?:\n\n```\w*\n(.*?)\n```", prompt, re.S)
+    if match:
+        return json.dumps(local_analysis(*match.groups()))
+    match = re.search(r"The file `(.+?)` was analyzed in (\d+) parts", prompt)
+    if match:
+        digest = hashlib.sha256(prompt.encode('utf-8')).hexdigest()[:8]
+        return json.dumps({
+            'summary': f"{match.group(1)} is split across {match.group(2)} sections of related steps ({digest}).",
+            'description': "The sections run in sequence."
+        })
+    sections = re.findall(r"^- ### ([^:]+):", prompt, re.M)
+    if sections:
+        return '\n\n'.join(f"### {name}\n{name} content generated locally." for name in sections)
+    return "Locally generated text."
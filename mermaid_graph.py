@@ -0,0 +1,413 @@
+import re
+
+LABEL_CHARS = 40
+
+# Mermaid's own defaults (maxEdges, maxTextSize); anything past them fails
+# in the renderer, so it is rejected here instead
+MAX_EDGES = 500
+MAX_NODES = 500
+MAX_SOURCE_CHARS = 50000
+
+DIRECTIONS = {'TD', 'TB', 'BT', 'LR', 'RL'}
+
+# Shape name -> (opening, closing) as serialized
+SHAPES = {
+    'process': ('[', ']'),
+    'round': ('(', ')'),
+    'terminal': ('([', '])'),
+    'subroutine': ('[[', ']]'),
+    'database': ('[(', ')]'),
+    'circle': ('((', '))'),
+    'double-circle': ('(((', ')))'),
+    'decision': ('{', '}'),
+    'hexagon': ('{{', '}}'),
+    'parallelogram': ('[/', '/]'),
+    'parallelogram-alt': ('[\\', '\\]'),
+    'trapezoid': ('[/', '\\]'),
+    'trapezoid-alt': ('[\\', '/]'),
+    'flag': ('>', ']'),
+}
+
+# Opening -> [(closing, shape)], longest openings first
+OPENINGS = {}
+for _shape, (_opening, _closing) in SHAPES.items():
+    OPENINGS.setdefault(_opening, []).append((_closing, _shape))
+OPENINGS = dict(sorted(OPENINGS.items(), key=lambda item: -len(item[0])))
+
+# Style -> (shaft without head, shaft with head)
+ARROWS = {
+    'solid': ('---', '-->'),
+    'dotted': ('-.-', '-.->'),
+    'thick': ('===', '==>'),
+}
+
+NODE_ID = re.compile(r'[A-Za-z0-9_]+')
+CLASS_SUFFIX = re.compile(r':::[\w-]+')
+# -->, ---, -.->, ==>, <-->, --x ...; x/o heads only when not the start of a word
+ARROW = re.compile(r'(<?)(-{2,}|={2,}|-\.+-)(>|[ox](?!\w))?')
+EDGE_LABEL = re.compile(r'\s*\|([^|]*)\|')
+# A -- text --> B, A == text ==> B, A -. text .-> B
+TEXT_ARROW = re.compile(r'(<?)(--|==|-\.)\s+([^|\n]*?)\s+(-{2,}|={2,}|\.-+)(>|[ox](?!\w))?(?=\s|[\w"]|$)')
+SUBGRAPH = re.compile(r'^(\w+)\s*\[(.*)\]$')
+HEADER = re.compile(r'^(graph|flowchart)\b\s*(\w*)', re.I)
+ENTITY = re.compile(r'#(\d+|lt|gt|quot|amp|nbsp);')
+ENTITY_START = re.compile(r'#(\d+|lt|gt|quot|amp|nbsp)$')
+ENTITIES = {'lt': '<', 'gt': '>', 'quot': "'", 'amp': '&', 'nbsp': ' '}
+# Kept in labels as they are, or as entity codes
+# (no backslash: the parser reads a literal \n as a line break)
+LABEL_PUNCTUATION = set(" _.,:+-*/%=!?()[]{}&^~@$'<>|#;")
+LABEL_ENTITIES = {'<': '#lt;', '>': '#gt;', '|': '#124;', '#': '#35;', ';': '#59;'}
+LABEL_ESCAPES = re.compile('[<>|#;]')
+IGNORED = ('classDef ', 'class ', 'style ', 'linkStyle ', 'click ', 'direction ', '%%')
+
+
+class MermaidError(ValueError):
+    pass
+
+
+def clean_label(text):
+    # Labels are always quoted, so only what ends or marks up a quoted label
+    # is touched: double quotes become single ones and <, >, |, # and ; become
+    # entity codes. Letters and digits in any script are kept, as is common
+    # punctuation; control characters and other symbols become spaces.
+    text = ' '.join(str(text).replace('"', "'").replace('`', "'").split())
+    if len(text) > LABEL_CHARS:
+        text = text[:LABEL_CHARS - 3].rstrip() + '...'
+    text = ''.join(char if char.isalnum() or char in LABEL_PUNCTUATION else ' ' for char in text)
+    text = ' '.join(text.split())
+    text = LABEL_ESCAPES.sub(lambda match: LABEL_ENTITIES[match.group()], text)
+    return text or 'step'
+
+
+def decode_label(text):
+    # Undo entity codes, quoting and line breaks so clean_label sees plain text
+    text = text.strip()
+    if len(text) >= 2 and text[0] == text[-1] == '"':
+        text = text[1:-1]
+    text = text.strip('`')
+    text = re.sub(r'<br\s*/?>', ' ', text, flags=re.I)
+
+    def entity(match):
+        code = match.group(1)
+        if code.isdigit():
+            return chr(int(code)) if int(code) < 0x110000 else ''
+        return ENTITIES[code]
+
+    return ENTITY.sub(entity, text)
+
+
+class Node:
+    __slots__ = ('id', 'label', 'shape', 'subgraph')
+
+    def __init__(self, node_id, subgraph):
+        self.id = node_id
+        self.label = None
+        self.shape = 'process'
+        self.subgraph = subgraph
+
+
+class Edge:
+    __slots__ = ('source', 'target', 'label', 'style', 'head', 'tail')
+
+    def __init__(self, source, target, label, style, head, tail):
+        self.source = source
+        self.target = target
+        self.label = label
+        self.style = style
+        self.head = head
+        self.tail = tail
+
+
+class Subgraph:
+    __slots__ = ('id', 'title', 'parent')
+
+    def __init__(self, subgraph_id, title, parent):
+        self.id = subgraph_id
+        self.title = title
+        self.parent = parent
+
+
+class FlowchartGraph:
+    """Nodes, edges and subgraphs of one Mermaid flowchart.
+
+    parse_flowchart builds it leniently, noting in `repairs` every line it
+    had to drop or fix. validate() rejects graphs the renderer would fail
+    on, and serialize() writes canonical source: quoted, cleaned labels,
+    ids renumbered N1.. and S1.. in order of appearance, nodes grouped by
+    subgraph and edges last. Equivalent diagrams serialize identically, so
+    the serialized source can key a render cache.
+    """
+
+    def __init__(self, direction='TD'):
+        self.direction = direction
+        self.nodes = {}
+        self.edges = []
+        self.subgraphs = {}
+        self.repairs = []
+
+    def node(self, node_id, subgraph):
+        if node_id not in self.nodes:
+            self.nodes[node_id] = Node(node_id, subgraph)
+        return self.nodes[node_id]
+
+    def validate(self, max_nodes=MAX_NODES, max_edges=MAX_EDGES):
+        if not self.nodes:
+            raise MermaidError("Flowchart has no nodes")
+        if not self.edges:
+            raise MermaidError("Flowchart has no edges")
+        if len(self.nodes) > max_nodes:
+            raise MermaidError(f"Flowchart has {len(self.nodes)} nodes; the limit is {max_nodes}")
+        if len(self.edges) > max_edges:
+            raise MermaidError(f"Flowchart has {len(self.edges)} edges; the limit is {max_edges}")
+        for edge in self.edges:
+            for end in (edge.source, edge.target):
+                if end not in self.nodes and end not in self.subgraphs:
+                    raise MermaidError(f"Edge refers to unknown node {end}")
+        return self
+
+    def serialize(self):
+        ids = {}
+        for node_id in self.nodes:
+            ids[node_id] = f"N{len(ids) + 1}"
+        for count, subgraph_id in enumerate(self.subgraphs, 1):
+            ids[subgraph_id] = f"S{count}"
+
+        members = {}
+        for node in self.nodes.values():
+            members.setdefault(node.subgraph, []).append(node)
+        children = {}
+        for subgraph in self.subgraphs.values():
+            children.setdefault(subgraph.parent, []).append(subgraph)
+
+        lines = [f"graph {self.direction}"]
+
+        def write(subgraph_id):
+            for node in members.get(subgraph_id, []):
+                opening, closing = SHAPES[node.shape]
+                lines.append(f'{ids[node.id]}{opening}"{clean_label(node.label or node.id)}"{closing}')
+            for subgraph in children.get(subgraph_id, []):
+                lines.append(f'subgraph {ids[subgraph.id]}["{clean_label(subgraph.title)}"]')
+                write(subgraph.id)
+                lines.append('end')
+
+        write(None)
+        for edge in self.edges:
+            arrow = ARROWS[edge.style][1 if edge.head else 0]
+            if edge.tail:
+                arrow = '<' + arrow
+            if edge.label:
+                arrow += f'|"{clean_label(edge.label)}"|'
+            lines.append(f"{ids[edge.source]}{arrow}{ids[edge.target]}")
+        return '\n'.join(lines)
+
+
+class FlowchartParser:
+    """Reads one flowchart statement at a time into a FlowchartGraph."""
+
+    def __init__(self, graph):
+        self.graph = graph
+        self.stack = []
+        self.count = 0
+        self.defined = []
+
+    @property
+    def current(self):
+        return self.stack[-1] if self.stack else None
+
+    def line(self, line):
+        if line.startswith(IGNORED):
+            return
+        if line == 'end':
+            if self.stack:
+                self.stack.pop()
+            else:
+                self.graph.repairs.append("dropped an unmatched 'end'")
+            return
+        if line.startswith('subgraph ') or line == 'subgraph':
+            self.subgraph(line[len('subgraph'):].strip())
+            return
+        try:
+            self.statement(line)
+        except MermaidError as e:
+            self.graph.repairs.append(f"dropped {line!r}: {e}")
+
+    def subgraph(self, rest):
+        self.count += 1
+        match = SUBGRAPH.match(rest)
+        if match:
+            subgraph_id, title = match.group(1), decode_label(match.group(2))
+        elif NODE_ID.fullmatch(rest):
+            subgraph_id, title = rest, rest
+        else:
+            subgraph_id, title = f"subgraph{self.count}", decode_label(rest)
+        if subgraph_id in self.graph.subgraphs:
+            subgraph_id = f"{subgraph_id}_{self.count}"
+            self.graph.repairs.append(f"renamed a repeated subgraph to {subgraph_id}")
+        self.graph.subgraphs[subgraph_id] = Subgraph(subgraph_id, title or subgraph_id, self.current)
+        self.stack.append(subgraph_id)
+
+    def statement(self, text):
+        # Nothing from a statement is kept unless all of it parses
+        self.defined = []
+        edges = []
+        position, group = self.group(text, 0)
+        while True:
+            position = skip_spaces(text, position)
+            if position >= len(text):
+                break
+            position, link = self.link(text, position)
+            position, following = self.group(text, skip_spaces(text, position))
+            edges.extend(Edge(source, target, *link) for source in group for target in following)
+            group = following
+        for node_id, label, shape in self.defined:
+            node = self.graph.node(node_id, self.current)
+            if label is not None:
+                node.label, node.shape = label, shape
+        self.graph.edges.extend(edges)
+
+    def group(self, text, position):
+        # A & B & C
+        position, node_id = self.node(text, position)
+        ids = [node_id]
+        while True:
+            after = skip_spaces(text, position)
+            if not text.startswith('&', after):
+                return position, ids
+            position, node_id = self.node(text, skip_spaces(text, after + 1))
+            ids.append(node_id)
+
+    def node(self, text, position):
+        match = NODE_ID.match(text, position)
+        if not match:
+            raise MermaidError(f"expected a node id at column {position + 1}")
+        node_id = match.group()
+        position = match.end()
+        label, shape = None, None
+        for opening, closings in OPENINGS.items():
+            if text.startswith(opening, position):
+                position, label, shape = read_label(text, position + len(opening), closings)
+                break
+        self.defined.append((node_id, label, shape))
+        match = CLASS_SUFFIX.match(text, position)
+        return (match.end() if match else position), node_id
+
+    def link(self, text, position):
+        # (label, style, head, tail) of the arrow at position
+        match = TEXT_ARROW.match(text, position)
+        if match:
+            tail, start, label, _, head = match.groups()
+            return match.end(), (decode_label(label), arrow_style(start), bool(head), bool(tail))
+        match = ARROW.match(text, position)
+        if not match:
+            raise MermaidError(f"expected an arrow at column {position + 1}")
+        tail, shaft, head = match.groups()
+        position = match.end()
+        label = None
+        match = EDGE_LABEL.match(text, position)
+        if match:
+            label = decode_label(match.group(1))
+            position = match.end()
+        return position, (label, arrow_style(shaft), bool(head), bool(tail))
+
+
+def skip_spaces(text, position):
+    while position < len(text) and text[position] in ' \t':
+        position += 1
+    return position
+
+
+def arrow_style(shaft):
+    if shaft.startswith('='):
+        return 'thick'
+    return 'dotted' if '.' in shaft else 'solid'
+
+
+def read_label(text, position, closings):
+    # Label text up to the shape's closing, which may be quoted or contain
+    # balanced brackets of its own
+    start = skip_spaces(text, position)
+    if text.startswith('"', start):
+        end = text.find('"', start + 1)
+        if end < 0:
+            raise MermaidError("unterminated quoted label")
+        label = text[start + 1:end]
+        after = skip_spaces(text, end + 1)
+        for closing, shape in closings:
+            if text.startswith(closing, after):
+                return after + len(closing), decode_label(label), shape
+        raise MermaidError(f"expected {closings[0][0]} after label")
+    depth = 0
+    for index in range(position, len(text)):
+        if depth == 0:
+            for closing, shape in closings:
+                if text.startswith(closing, index):
+                    return index + len(closing), decode_label(text[position:index]), shape
+        char = text[index]
+        if char in '([{':
+            depth += 1
+        elif char in ')]}':
+            depth -= 1
+            if depth < 0:
+                break
+    raise MermaidError(f"expected {closings[0][0]} to close the label")
+
+
+def parse_flowchart(source):
+    # Lenient parse of `graph`/`flowchart` source into a FlowchartGraph;
+    # raises MermaidError only for input that is not a flowchart at all
+    if not source or not source.strip():
+        raise MermaidError("Flowchart is empty")
+    if len(source) > MAX_SOURCE_CHARS:
+        raise MermaidError(f"Flowchart source is over {MAX_SOURCE_CHARS} characters")
+    statements = []
+    for line in source.replace('\\n', '\n').split('\n'):
+        # ';' ends a statement unless it is inside a quoted label or closes an
+        # entity code such as #lt;
+        parts = []
+        for part in re.split(r';(?=(?:[^"]*"[^"]*")*[^"]*$)', line):
+            if parts and ENTITY_START.search(parts[-1]):
+                parts[-1] += ';' + part
+            else:
+                parts.append(part)
+        statements.extend(part.strip() for part in parts)
+    statements = [statement for statement in statements if statement]
+    if statements and statements[0].startswith('%%{'):
+        statements.pop(0)
+
+    graph = FlowchartGraph()
+    header = HEADER.match(statements[0]) if statements else None
+    if header:
+        direction = header.group(2).upper()
+        if direction in DIRECTIONS:
+            graph.direction = direction
+        elif direction:
+            graph.repairs.append(f"replaced direction {direction} with TD")
+        statements.pop(0)
+        # `graph TD A-->B` on one line
+        rest = header.string[header.end():].strip()
+        if rest:
+            statements.insert(0, rest)
+    elif statements and re.match(r'^\w+Diagram\b|^(sequence|class|state|er|gantt|pie|journey)', statements[0]):
+        raise MermaidError(f"Not a flowchart: {statements[0][:40]}")
+    else:
+        graph.repairs.append("added a missing 'graph TD' header")
+
+    parser = FlowchartParser(graph)
+    for statement in statements:
+        parser.line(statement)
+    if parser.stack:
+        graph.repairs.append(f"closed {len(parser.stack)} unterminated subgraph(s)")
+
+    # Ids used only as edge ends that name a subgraph refer to the subgraph
+    for node_id in list(graph.nodes):
+        if node_id in graph.subgraphs and graph.nodes[node_id].label is None:
+            del graph.nodes[node_id]
+    for node in graph.nodes.values():
+        if node.label is None:
+            node.label = node.id
+    return graph
+
+
+def canonical_flowchart(source, max_nodes=MAX_NODES, max_edges=MAX_EDGES):
+    # Parsed, validated and repaired graph for Mermaid source
+    return parse_flowchart(source).validate(max_nodes, max_edges)
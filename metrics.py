@@ -0,0 +1,180 @@
+import json
+import time
+import bisect
+import logging
+import threading
+import functools
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Seconds; wide enough for both a JSON parse and a slow LLM call
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+
+def _label_key(labels):
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ''
+    escaped = []
+    for k, v in pairs:
+        v = str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        escaped.append(f'{k}="{v}"')
+    return '{' + ','.join(escaped) + '}'
+
+
+class Metrics:
+    """In-process counters and latency histograms for the /metrics endpoint.
+
+    `timed(stage)` records a stage's duration in stage_duration_seconds and
+    counts stage_errors_total when it raises. When a trace is active on the
+    current thread each timed stage is also appended to it; finished traces
+    are written as JSON lines to trace_log.
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS, trace_log=None):
+        self.buckets = tuple(buckets)
+        self.trace_log = trace_log
+        self._counters = {}
+        self._histograms = {}
+        self._help = {}
+        self._lock = threading.Lock()
+        self._trace_lock = threading.Lock()
+        self._local = threading.local()
+
+    def describe(self, name, kind, text):
+        self._help[name] = (kind, text)
+
+    def inc(self, name, amount=1, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def observe(self, name, value, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = {'buckets': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            index = bisect.bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                histogram['buckets'][index] += 1
+            histogram['sum'] += value
+            histogram['count'] += 1
+
+    @contextmanager
+    def timed(self, stage, **labels):
+        start = time.perf_counter()
+        failed = False
+        try:
+            yield
+        except Exception:
+            failed = True
+            self.inc('stage_errors_total', stage=stage)
+            raise
+        finally:
+            duration = time.perf_counter() - start
+            self.observe('stage_duration_seconds', duration, stage=stage, **labels)
+            self.trace_event(stage, duration, error=failed, **labels)
+
+    # ---- traces --------------------------------------------------------
+
+    def start_trace(self, name):
+        if not self.trace_log:
+            return None
+        trace = {'name': name, 'start': time.time(), 'stages': []}
+        self._local.trace = trace
+        return trace
+
+    def current_trace(self):
+        return getattr(self._local, 'trace', None)
+
+    def trace_event(self, stage, duration, **attrs):
+        trace = self.current_trace()
+        if trace is not None:
+            event = {'stage': stage, 'duration': round(duration, 6)}
+            event.update({k: v for k, v in attrs.items() if v not in (None, False)})
+            # Worker threads may share one trace; list.append is atomic
+            trace['stages'].append(event)
+
+    def finish_trace(self, **attrs):
+        trace = self.current_trace()
+        self._local.trace = None
+        if trace is None:
+            return
+        trace['duration'] = round(time.time() - trace['start'], 6)
+        trace.update(attrs)
+        try:
+            with self._trace_lock, open(self.trace_log, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(trace) + '\n')
+        except OSError as e:
+            logger.error("Could not write trace log %s: %s", self.trace_log, e)
+
+    def bind(self, fn):
+        # Run fn in a worker thread under the caller's trace
+        trace = self.current_trace()
+        if trace is None:
+            return fn
+
+        @functools.wraps(fn)
+        def run(*args, **kwargs):
+            previous = self.current_trace()
+            self._local.trace = trace
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self._local.trace = previous
+        return run
+
+    # ---- exposition ----------------------------------------------------
+
+    def snapshot(self, name):
+        # [(labels, count, sum)] for one histogram, e.g. to diff two points in time
+        with self._lock:
+            return [(dict(key), h['count'], h['sum'])
+                    for (metric, key), h in self._histograms.items() if metric == name]
+
+    def render(self, gauges=None):
+        # Prometheus text format. gauges maps name -> value or
+        # name -> {label_key: value} for values read from other components.
+        lines = []
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = {key: dict(h, buckets=list(h['buckets'])) for key, h in self._histograms.items()}
+
+        def header(name, kind):
+            help_kind, text = self._help.get(name, (kind, name.replace('_', ' ')))
+            lines.append(f"# HELP {name} {text}")
+            lines.append(f"# TYPE {name} {help_kind}")
+
+        for name in sorted({name for name, _ in counters}):
+            header(name, 'counter')
+            for (metric, key), value in sorted(counters.items()):
+                if metric == name:
+                    lines.append(f"{name}{_format_labels(key)} {value}")
+
+        for name in sorted({name for name, _ in histograms}):
+            header(name, 'histogram')
+            for (metric, key), histogram in sorted(histograms.items()):
+                if metric != name:
+                    continue
+                cumulative = 0
+                for bound, count in zip(self.buckets, histogram['buckets']):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{_format_labels(key, [('le', bound)])} {cumulative}")
+                lines.append(f"{name}_bucket{_format_labels(key, [('le', '+Inf')])} {histogram['count']}")
+                lines.append(f"{name}_sum{_format_labels(key)} {histogram['sum']:.6f}")
+                lines.append(f"{name}_count{_format_labels(key)} {histogram['count']}")
+
+        for name, value in sorted((gauges or {}).items()):
+            header(name, 'gauge')
+            if isinstance(value, dict):
+                for labels, labelled in sorted(value.items()):
+                    lines.append(f"{name}{_format_labels(_label_key(dict(labels)))} {labelled}")
+            else:
+                lines.append(f"{name} {value}")
+        return '\n'.join(lines) + '\n'
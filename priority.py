@@ -0,0 +1,90 @@
+import os
+import re
+
+# File names that usually start a program; matched case-insensitively
+ENTRY_POINTS = {
+    'main.py', '__main__.py', 'app.py', 'manage.py', 'wsgi.py', 'asgi.py', 'server.py', 'cli.py',
+    'index.js', 'main.js', 'app.js', 'server.js', 'index.jsx', 'app.jsx',
+    'index.ts', 'main.ts', 'app.ts', 'server.ts', 'index.tsx', 'app.tsx', 'main.tsx',
+    'main.go', 'main.java', 'application.java', 'program.cs', 'startup.cs',
+    'main.c', 'main.cpp', 'index.php', 'main.rb', 'app.rb'
+}
+
+# Module references, reduced to their last path component by reference_module
+IMPORT_PATTERNS = [
+    re.compile(r'^\s*from\s+([\w.]+)\s+import', re.M),                       # Python
+    re.compile(r'^\s*import\s+([\w.]+(?:\s*,\s*[\w.]+)*)', re.M),            # Python, Java
+    re.compile(r'''(?:from|require\(|import\()\s*['"]([^'"]+)['"]'''),       # JS/TS
+    re.compile(r'^\s*#include\s+"([^"]+)"', re.M),                           # C/C++
+    re.compile(r'''^\s*(?:require_relative|require|include|require_once|include_once)\s*\(?\s*['"]([^'"]+)['"]''', re.M),  # Ruby/PHP
+    re.compile(r'^\s*using\s+([\w.]+)\s*;', re.M),                            # C#
+    re.compile(r'^\s*"([\w./-]+)"\s*$', re.M),                               # Go import blocks
+]
+
+TEST_NAME = re.compile(r'(^test_|_test\.|\.test\.|\.spec\.|Tests?\.(?:java|cs)$)', re.I)
+
+# Imports are at the top; no need to read whole files to find them
+IMPORT_SCAN_BYTES = 64 * 1024
+
+
+SOURCE_EXTENSIONS = {
+    '.py', '.js', '.mjs', '.cjs', '.jsx', '.ts', '.tsx', '.java', '.c', '.cpp', '.h', '.hpp',
+    '.cs', '.go', '.rb', '.php', '.css'
+}
+
+
+def file_module(path):
+    # 'src/utils/helpers.py' -> 'helpers'
+    return os.path.splitext(path.replace('\\', '/').rsplit('/', 1)[-1])[0].lower()
+
+
+def reference_module(reference):
+    # 'utils.helpers', './utils/helpers' and 'utils/helpers.h' -> 'helpers'
+    last = reference.replace('\\', '/').rstrip('/').rsplit('/', 1)[-1]
+    stem, extension = os.path.splitext(last)
+    if extension.lower() in SOURCE_EXTENSIONS:
+        return stem.lower()
+    return last.rsplit('.', 1)[-1].lower()
+
+
+def references(text):
+    found = set()
+    for pattern in IMPORT_PATTERNS:
+        for match in pattern.finditer(text):
+            for reference in match.group(1).split(','):
+                name = reference_module(reference.strip())
+                if name:
+                    found.add(name)
+    return found
+
+
+def is_test(path):
+    parts = path.replace('\\', '/').lower().split('/')
+    return any(part in ('test', 'tests', '__tests__', 'spec') for part in parts[:-1]) or \
+        bool(TEST_NAME.search(path.rsplit('/', 1)[-1]))
+
+
+def prioritize(workspace, filenames):
+    # Entry points first, then files imported by the most other files, then
+    # the largest; tests go last. Ties keep their upload order.
+    sizes = {}
+    imported_by = {}
+    for filename in filenames:
+        path = os.path.join(workspace, filename)
+        try:
+            sizes[filename] = os.path.getsize(path)
+            with open(path, 'r', encoding='utf-8', errors='ignore') as f:
+                text = f.read(IMPORT_SCAN_BYTES)
+        except OSError:
+            sizes[filename] = 0
+            continue
+        own = file_module(filename)
+        for name in references(text) - {own}:
+            imported_by[name] = imported_by.get(name, 0) + 1
+
+    def key(item):
+        index, filename = item
+        entry = os.path.basename(filename).lower() in ENTRY_POINTS
+        return (not entry, is_test(filename), -imported_by.get(file_module(filename), 0), -sizes.get(filename, 0), index)
+
+    return [filename for _, filename in sorted(enumerate(filenames), key=key)]
@@ -0,0 +1,240 @@
+import ast
+
+from mermaid_graph import SHAPES, LABEL_CHARS, clean_label
+
+# Past this many nodes the remaining functions appear only as "def" steps in
+# the module flow rather than as their own subgraphs
+MAX_NODES = 80
+
+SIMPLE_STATEMENTS = (
+    ast.Assign, ast.AnnAssign, ast.AugAssign, ast.Expr, ast.Import, ast.ImportFrom,
+    ast.Pass, ast.Global, ast.Nonlocal, ast.Delete, ast.Assert
+)
+
+FUNCTIONS = (ast.FunctionDef, ast.AsyncFunctionDef)
+
+
+class FlowchartTooLarge(Exception):
+    pass
+
+
+class FlowchartBuilder:
+    """Turns Python statements into a Mermaid `graph TD`.
+
+    Node ids are generated here and every label goes through clean_label, so
+    the output is valid Mermaid whatever the source contains. Control flow
+    is threaded as lists of (node id, edge label) exits that the next
+    statement connects from.
+    """
+
+    def __init__(self, code, max_nodes=MAX_NODES):
+        self.code = code
+        self.max_nodes = max_nodes
+        self.lines = ['graph TD']
+        self.count = 0
+
+    def source(self, node):
+        segment = ast.get_source_segment(self.code, node)
+        if segment is None and hasattr(ast, 'unparse'):
+            segment = ast.unparse(node)
+        return segment or type(node).__name__
+
+    def node(self, label, shape='process'):
+        if self.max_nodes and self.count >= self.max_nodes:
+            raise FlowchartTooLarge()
+        self.count += 1
+        node_id = f"N{self.count}"
+        opening, closing = SHAPES[shape]
+        self.lines.append(f'{node_id}{opening}"{clean_label(label)}"{closing}')
+        return node_id
+
+    def connect(self, exits, target):
+        for source, label in exits:
+            arrow = f'-->|"{clean_label(label)}"|' if label else '-->'
+            self.lines.append(f"{source}{arrow}{target}")
+
+    def step(self, exits, label, shape='process'):
+        target = self.node(label, shape)
+        self.connect(exits, target)
+        return target
+
+    # ---- statements ------------------------------------------------------
+
+    def block(self, statements, exits, context):
+        pending = []
+        for statement in statements:
+            if not exits:
+                # Nothing falls through to here (after return, raise, break...)
+                break
+            if isinstance(statement, ast.Expr) and isinstance(statement.value, ast.Constant):
+                # Docstrings and other bare literals do nothing
+                continue
+            if self.groups(statement):
+                # Runs of plain statements, and runs of definitions, share a node
+                if pending and self.groups(pending[0]) != self.groups(statement):
+                    exits = self.simple(pending, exits)
+                    pending = []
+                pending.append(statement)
+                continue
+            exits = self.simple(pending, exits)
+            pending = []
+            exits = self.statement(statement, exits, context)
+        return self.simple(pending, exits)
+
+    def groups(self, statement):
+        if isinstance(statement, FUNCTIONS + (ast.ClassDef,)):
+            return 'definition'
+        if isinstance(statement, SIMPLE_STATEMENTS) and not self.is_call(statement):
+            return 'plain'
+        return None
+
+    def is_call(self, statement):
+        value = statement.value if isinstance(statement, ast.Expr) else None
+        if isinstance(value, (ast.Await, ast.YieldFrom)):
+            value = value.value
+        return isinstance(value, ast.Call)
+
+    def simple(self, statements, exits):
+        # One node for the run, named after its first statement
+        if not statements or not exits:
+            return exits
+        first = statements[0]
+        if isinstance(first, FUNCTIONS):
+            label = f"def {first.name}"
+        elif isinstance(first, ast.ClassDef):
+            label = f"class {first.name}"
+        else:
+            label = self.source(first).splitlines()[0]
+        if len(statements) > 1:
+            label = f"{label[:LABEL_CHARS - 12]} +{len(statements) - 1} more"
+        return [(self.step(exits, label), None)]
+
+    def statement(self, statement, exits, context):
+        if isinstance(statement, ast.Expr):
+            return [(self.step(exits, f"call {self.source(statement.value)}"), None)]
+        if isinstance(statement, ast.If):
+            decision = self.step(exits, f"if {self.source(statement.test)}", 'decision')
+            branches = self.block(statement.body, [(decision, 'Yes')], context)
+            if statement.orelse:
+                return branches + self.block(statement.orelse, [(decision, 'No')], context)
+            return branches + [(decision, 'No')]
+        if isinstance(statement, (ast.For, ast.AsyncFor)):
+            label = f"for {self.source(statement.target)} in {self.source(statement.iter)}"
+            return self.loop(statement, label, exits, context, exhausts=True)
+        if isinstance(statement, ast.While):
+            forever = isinstance(statement.test, ast.Constant) and statement.test.value is True
+            return self.loop(statement, f"while {self.source(statement.test)}", exits, context, exhausts=not forever)
+        if isinstance(statement, ast.Try) or type(statement).__name__ == 'TryStar':
+            return self.try_block(statement, exits, context)
+        if isinstance(statement, (ast.With, ast.AsyncWith)):
+            items = ', '.join(self.source(item.context_expr) for item in statement.items)
+            return self.block(statement.body, [(self.step(exits, f"with {items}"), None)], context)
+        if type(statement).__name__ == 'Match':
+            return self.match(statement, exits, context)
+        if isinstance(statement, ast.Return):
+            label = f"return {self.source(statement.value)}" if statement.value else 'return'
+            self.connect([(self.step(exits, label), None)], context['end'])
+            return []
+        if isinstance(statement, ast.Raise):
+            label = f"raise {self.source(statement.exc)}" if statement.exc else 'raise'
+            self.step(exits, label)
+            return []
+        if isinstance(statement, ast.Break):
+            if context['loops']:
+                context['loops'][-1]['breaks'].extend(exits)
+            return []
+        if isinstance(statement, ast.Continue):
+            if context['loops']:
+                self.connect(exits, context['loops'][-1]['node'])
+            return []
+        return self.simple([statement], exits)
+
+    def loop(self, statement, label, exits, context, exhausts):
+        head = self.step(exits, label, 'decision')
+        frame = {'node': head, 'breaks': []}
+        context['loops'].append(frame)
+        try:
+            body = self.block(statement.body, [(head, 'next')], context)
+        finally:
+            context['loops'].pop()
+        self.connect(body, head)
+        after = [(head, 'done')] if exhausts else []
+        if statement.orelse and after:
+            after = self.block(statement.orelse, after, context)
+        return after + frame['breaks']
+
+    def try_block(self, statement, exits, context):
+        start = self.step(exits, 'try')
+        results = self.block(statement.body, [(start, None)], context)
+        if statement.orelse:
+            results = self.block(statement.orelse, results, context)
+        for handler in statement.handlers:
+            label = f"except {self.source(handler.type)}" if handler.type else 'except'
+            results += self.block(handler.body, [(start, label)], context)
+        if statement.finalbody and results:
+            results = self.block(statement.finalbody, results, context)
+        return results
+
+    def match(self, statement, exits, context):
+        decision = self.step(exits, f"match {self.source(statement.subject)}", 'decision')
+        results = []
+        exhaustive = False
+        for case in statement.cases:
+            pattern = self.source(case.pattern)
+            results += self.block(case.body, [(decision, f"case {pattern}")], context)
+            exhaustive = exhaustive or (pattern == '_' and case.guard is None)
+        return results if exhaustive else results + [(decision, 'no match')]
+
+    # ---- top level -------------------------------------------------------
+
+    def flow(self, statements, start_label, end_label):
+        start = self.node(start_label, 'terminal')
+        end = self.node(end_label, 'terminal')
+        exits = self.block(statements, [(start, None)], {'end': end, 'loops': []})
+        self.connect(exits, end)
+
+    def function(self, statement, title):
+        self.count += 1
+        self.lines.append(f'subgraph F{self.count}["{clean_label(title)}"]')
+        self.flow(statement.body, f"{statement.name}()", 'return')
+        self.lines.append('end')
+
+    def module(self, tree, functions=True):
+        self.flow(tree.body, 'Start', 'End')
+        if not functions:
+            return
+        functions = []
+        for statement in tree.body:
+            if isinstance(statement, FUNCTIONS):
+                functions.append((statement, f"def {statement.name}"))
+            elif isinstance(statement, ast.ClassDef):
+                functions += [(method, f"{statement.name}.{method.name}")
+                              for method in statement.body if isinstance(method, FUNCTIONS)]
+        for statement, title in functions:
+            # Keep whole subgraphs only; drop the one that ran over budget
+            lines, count = len(self.lines), self.count
+            try:
+                self.function(statement, title)
+            except FlowchartTooLarge:
+                del self.lines[lines:]
+                self.count = count
+                break
+
+    def render(self):
+        return '\n'.join(self.lines)
+
+
+def python_flowchart(code, max_nodes=MAX_NODES):
+    # Mermaid source for a module's control flow, or None if it doesn't parse
+    try:
+        tree = ast.parse(code)
+    except (SyntaxError, ValueError):
+        return None
+    builder = FlowchartBuilder(code, max_nodes)
+    try:
+        builder.module(tree)
+    except FlowchartTooLarge:
+        # The module flow alone is over budget; draw just that, unlimited
+        builder = FlowchartBuilder(code, max_nodes=None)
+        builder.module(tree, functions=False)
+    return builder.render()
@@ -0,0 +1,160 @@
+import re
+import logging
+import time
+import random
+import threading
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+# HTTP statuses worth retrying; anything else is raised to the caller
+RETRYABLE_CODES = {429, 500, 503, 504}
+
+
+def error_code(e):
+    # google.api_core exceptions carry the HTTP status as .code, anthropic's
+    # as .status_code; otherwise look for one at the start of the message
+    # ("429 Resource exhausted")
+    for attr in ('code', 'status_code'):
+        code = getattr(e, attr, None)
+        if isinstance(code, int):
+            return code
+    match = re.match(r'\s*(\d{3})\b', str(e))
+    return int(match.group(1)) if match else None
+
+
+def retry_after_seconds(e):
+    # The server's requested delay, from the exception or its RetryInfo details
+    candidates = [getattr(e, 'retry_delay', None)]
+    candidates += [getattr(detail, 'retry_delay', None) for detail in getattr(e, 'details', None) or []]
+    for delay in candidates:
+        if delay is None:
+            continue
+        if hasattr(delay, 'total_seconds'):
+            return delay.total_seconds()
+        if hasattr(delay, 'seconds'):
+            return delay.seconds + getattr(delay, 'nanos', 0) / 1e9
+    headers = getattr(getattr(e, 'response', None), 'headers', None)
+    if headers is not None and headers.get('retry-after'):
+        try:
+            return float(headers['retry-after'])
+        except ValueError:
+            pass
+    match = re.search(r'retry_delay\s*\{\s*seconds:\s*(\d+)', str(e)) or re.search(r'retry in ([\d.]+)s', str(e))
+    return float(match.group(1)) if match else None
+
+
+def estimate_tokens(text, expected_output=1000):
+    # ~4 characters per token is close enough for budgeting
+    return len(text) // 4 + expected_output
+
+
+class RateLimiter:
+    """Client-side requests/min and tokens/min buckets shared by all calls to one provider.
+
+    Callers queue in FIFO order on a condition variable until both buckets
+    have room, so throughput settles at the configured quota. A 429 closes
+    the gate for everyone until the server's retry delay (or a jittered
+    exponential backoff) has passed. Calls return an LLMResponse, whose
+    token counts settle the estimate charged up front.
+    """
+
+    def __init__(self, requests_per_minute=60, tokens_per_minute=1000000, max_retries=5, base_delay=1.0, max_delay=60.0, name='LLM'):
+        self.name = name
+        self.rpm = requests_per_minute
+        self.tpm = tokens_per_minute
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._requests = float(requests_per_minute)
+        self._tokens = float(tokens_per_minute)
+        self._refilled = time.monotonic()
+        self._blocked_until = 0.0
+        self._queue = deque()
+        self._cond = threading.Condition()
+        self.throttled = 0
+        self.retries = 0
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self._refilled
+        self._refilled = now
+        self._requests = min(self.rpm, self._requests + elapsed * self.rpm / 60.0)
+        self._tokens = min(self.tpm, self._tokens + elapsed * self.tpm / 60.0)
+
+    def acquire(self, tokens):
+        # A single request larger than the whole bucket must still be able to run
+        tokens = min(tokens, self.tpm)
+        ticket = object()
+        with self._cond:
+            self._queue.append(ticket)
+            try:
+                while True:
+                    self._refill()
+                    now = time.monotonic()
+                    if self._queue[0] is not ticket:
+                        wait = None
+                    elif now < self._blocked_until:
+                        wait = self._blocked_until - now
+                    elif self._requests < 1:
+                        wait = (1 - self._requests) * 60.0 / self.rpm
+                    elif self._tokens < tokens:
+                        wait = (tokens - self._tokens) * 60.0 / self.tpm
+                    else:
+                        self._requests -= 1
+                        self._tokens -= tokens
+                        return tokens
+                    self._cond.wait(wait)
+            finally:
+                self._queue.remove(ticket)
+                self._cond.notify_all()
+
+    def reconcile(self, estimated, actual):
+        # Charge the bucket for what the call really used
+        if actual is None:
+            return
+        with self._cond:
+            self._tokens -= actual - estimated
+            self._cond.notify_all()
+
+    def backoff(self, attempt, server_delay=None):
+        delay = min(self.max_delay, self.base_delay * (2 ** attempt))
+        delay = random.uniform(delay / 2, delay)
+        if server_delay:
+            delay = max(delay, server_delay)
+        with self._cond:
+            self._blocked_until = max(self._blocked_until, time.monotonic() + delay)
+            self.throttled += 1
+            self._cond.notify_all()
+        return delay
+
+    def call(self, fn, estimated_tokens):
+        attempt = 0
+        while True:
+            charged = self.acquire(estimated_tokens)
+            try:
+                response = fn()
+            except Exception as e:
+                code = error_code(e)
+                if code not in RETRYABLE_CODES or attempt >= self.max_retries:
+                    raise
+                delay = self.backoff(attempt, retry_after_seconds(e) if code == 429 else None)
+                logger.warning("%s call failed with %s; retrying in %.1fs (attempt %d/%d)", self.name, code, delay, attempt + 1, self.max_retries)
+                attempt += 1
+                with self._cond:
+                    self.retries += 1
+                continue
+            if response.prompt_tokens is not None and response.completion_tokens is not None:
+                self.reconcile(charged, response.prompt_tokens + response.completion_tokens)
+            return response
+
+    def stats(self):
+        with self._cond:
+            self._refill()
+            return {
+                'queued': len(self._queue),
+                'requests_available': round(self._requests, 2),
+                'tokens_available': round(self._tokens),
+                'throttled': self.throttled,
+                'retries': self.retries
+            }
@@ -0,0 +1,206 @@
+import os
+import logging
+import time
+import atexit
+import asyncio
+import threading
+import importlib.util
+
+logger = logging.getLogger(__name__)
+
+
+class RendererUnavailable(Exception):
+    pass
+
+
+class MermaidRenderError(Exception):
+    pass
+
+
+PAGE_HTML = """<!DOCTYPE html>
+<html><head><style>body { margin: 0; background: white; }</style></head>
+<body><div id="container"></div></body></html>"""
+
+RENDER_JS = """async ([id, source, pngWidth]) => {
+    const container = document.getElementById('container');
+    container.innerHTML = '';
+    try {
+        const { svg } = await window.mermaid.render(id, source);
+        container.innerHTML = svg;
+        // Draw the vector at the requested raster width before the screenshot
+        const element = container.querySelector('svg');
+        const box = element.viewBox.baseVal;
+        if (pngWidth && box && box.width && box.width < pngWidth) {
+            element.style.maxWidth = 'none';
+            element.setAttribute('width', pngWidth);
+            element.setAttribute('height', pngWidth * box.height / box.width);
+        }
+        return { svg };
+    } catch (e) {
+        // mermaid leaves its error graphic behind on failure
+        const leftover = document.getElementById('d' + id);
+        if (leftover) leftover.remove();
+        return { error: String(e && e.message || e) };
+    }
+}"""
+
+
+class MermaidRenderer:
+    """Pool of warm Chromium pages with Mermaid preloaded.
+
+    Playwright objects are tied to the event loop that created them, so the
+    pool owns an asyncio loop on a dedicated thread and callers from any
+    thread submit renders to it. Pages are recycled after max_renders uses
+    or when they crash; the whole browser is relaunched if it dies.
+    """
+
+    def __init__(self, mermaid_js, config=None, size=2, max_renders=50, timeout=30, retry_after=60):
+        self.mermaid_js = mermaid_js
+        self.config = dict(config or {'theme': 'default'}, startOnLoad=False)
+        self.size = size
+        self.max_renders = max_renders
+        self.timeout = timeout
+        self.retry_after = retry_after
+        self._loop = None
+        self._thread = None
+        self._playwright = None
+        self._browser = None
+        self._pages = None
+        self._render_counts = {}
+        self._next_id = 0
+        self._failed_at = None
+        self._lock = threading.Lock()
+
+    # ---- lifecycle -----------------------------------------------------
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._browser is not None:
+                return
+            if importlib.util.find_spec('playwright') is None:
+                raise RendererUnavailable("playwright is not installed")
+            if not os.path.exists(self.mermaid_js):
+                raise RendererUnavailable(f"Mermaid bundle not found at {self.mermaid_js}")
+            if self._failed_at and time.time() - self._failed_at < self.retry_after:
+                raise RendererUnavailable("Browser pool failed to start recently")
+
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(target=self._loop.run_forever,
+                                                name='mermaid-renderer', daemon=True)
+                self._thread.start()
+                atexit.register(self.close)
+            try:
+                self._call(self._start(), self.timeout * 2)
+                self._failed_at = None
+            except Exception as e:
+                self._failed_at = time.time()
+                logger.warning("Could not start Mermaid browser pool: %s", e)
+                self._call(self._stop(), self.timeout)
+                raise RendererUnavailable(str(e))
+
+    def _call(self, coro, timeout):
+        return asyncio.run_coroutine_threadsafe(coro, self._loop).result(timeout)
+
+    async def _start(self):
+        # Imported here so processes that never render don't load playwright
+        from playwright.async_api import async_playwright
+        self._playwright = await async_playwright().start()
+        self._browser = await self._playwright.chromium.launch()
+        self._pages = asyncio.Queue()
+        for _ in range(self.size):
+            await self._pages.put(await self._new_page())
+
+    async def _stop(self):
+        try:
+            if self._browser is not None:
+                await self._browser.close()
+        except Exception:
+            pass
+        try:
+            if self._playwright is not None:
+                await self._playwright.stop()
+        except Exception:
+            pass
+        self._browser = None
+        self._playwright = None
+        self._pages = None
+        self._render_counts = {}
+
+    async def _stop_if_dead(self):
+        # A dead browser is torn down so the next render relaunches it
+        if self._browser is None or not self._browser.is_connected():
+            await self._stop()
+
+    async def _new_page(self):
+        page = await self._browser.new_page(viewport={'width': 1200, 'height': 800})
+        await page.set_content(PAGE_HTML)
+        await page.add_script_tag(path=self.mermaid_js)
+        await page.evaluate("config => window.mermaid.initialize(config)", self.config)
+        self._render_counts[id(page)] = 0
+        return page
+
+    async def _recycle(self, page):
+        self._render_counts.pop(id(page), None)
+        try:
+            await page.close()
+        except Exception:
+            pass
+        if not self._browser.is_connected():
+            raise RendererUnavailable("Browser disconnected")
+        return await self._new_page()
+
+    def close(self):
+        if self._loop is None:
+            return
+        try:
+            self._call(self._stop(), self.timeout)
+        except Exception:
+            pass
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._loop = None
+
+    # ---- rendering -----------------------------------------------------
+
+    async def _render(self, source, png_width):
+        pages = self._pages
+        page = await pages.get()
+        try:
+            self._next_id += 1
+            result = await page.evaluate(RENDER_JS, [f"graph{self._next_id}", source, png_width])
+            if 'error' in result:
+                raise MermaidRenderError(result['error'])
+            output = {'svg': result['svg'].encode('utf-8'), 'png': None}
+            if png_width:
+                output['png'] = await page.locator('#container svg').screenshot(type='png')
+            self._render_counts[id(page)] = self._render_counts.get(id(page), 0) + 1
+            if self._render_counts[id(page)] >= self.max_renders:
+                page = await self._recycle(page)
+            return output
+        except MermaidRenderError:
+            raise
+        except Exception:
+            # Crashed or wedged page; replace it before handing it back
+            page = await self._recycle(page)
+            raise
+        finally:
+            await pages.put(page)
+
+    def render(self, source, png_width=None):
+        # Returns {'svg': bytes, 'png': bytes or None}; the PNG is drawn from
+        # the same render, at least png_width pixels wide. RendererUnavailable
+        # means the caller should fall back to another renderer;
+        # MermaidRenderError means the diagram itself is invalid.
+        self._ensure_started()
+        try:
+            return self._call(self._render(source, png_width), self.timeout)
+        except MermaidRenderError:
+            raise
+        except Exception as e:
+            logger.exception("Mermaid browser render failed: %s", e)
+            with self._lock:
+                try:
+                    self._call(self._stop_if_dead(), self.timeout)
+                except Exception:
+                    pass
+            raise RendererUnavailable(str(e))
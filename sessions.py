@@ -0,0 +1,287 @@
+import os
+import json
+import time
+import secrets
+import sqlite3
+import threading
+from collections.abc import Mapping
+
+from flask.sessions import SessionInterface, SecureCookieSession
+from itsdangerous import Signer, BadSignature
+
+
+class SessionStore:
+    """Interface for server-side session backends.
+
+    A session is a small JSON dict plus any number of named record sets
+    ("analysis" → {filename: result}) that are stored row by row so pages
+    can load only the records they use.
+    """
+
+    def load(self, sid):
+        raise NotImplementedError
+
+    def save(self, sid, data, expires):
+        raise NotImplementedError
+
+    def delete(self, sid):
+        raise NotImplementedError
+
+    def record_names(self, sid, kind):
+        raise NotImplementedError
+
+    def get_record(self, sid, kind, name):
+        raise NotImplementedError
+
+    def get_records(self, sid, kind):
+        raise NotImplementedError
+
+    def update_records(self, sid, kind, records, removed=(), order=None):
+        raise NotImplementedError
+
+    def delete_records(self, sid, kind):
+        raise NotImplementedError
+
+    def cleanup(self):
+        pass
+
+
+class SQLiteSessionStore(SessionStore):
+    """Sessions in a local SQLite database, one connection per thread."""
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS sessions (
+        id TEXT PRIMARY KEY,
+        data TEXT NOT NULL,
+        expires REAL NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS records (
+        session_id TEXT NOT NULL,
+        kind TEXT NOT NULL,
+        name TEXT NOT NULL,
+        position INTEGER NOT NULL,
+        data TEXT NOT NULL,
+        PRIMARY KEY (session_id, kind, name)
+    );
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self._connect() as db:
+            db.executescript(self.SCHEMA)
+
+    def _connect(self):
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=30)
+            # WAL lets page loads read while a job's results are being written
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            self._local.db = db
+        return db
+
+    def load(self, sid):
+        row = self._connect().execute(
+            'SELECT data FROM sessions WHERE id = ? AND expires > ?', (sid, time.time())
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def save(self, sid, data, expires):
+        with self._connect() as db:
+            db.execute(
+                'INSERT INTO sessions (id, data, expires) VALUES (?, ?, ?) '
+                'ON CONFLICT(id) DO UPDATE SET data = excluded.data, expires = excluded.expires',
+                (sid, json.dumps(data), expires)
+            )
+
+    def delete(self, sid):
+        with self._connect() as db:
+            db.execute('DELETE FROM records WHERE session_id = ?', (sid,))
+            db.execute('DELETE FROM sessions WHERE id = ?', (sid,))
+
+    def record_names(self, sid, kind):
+        rows = self._connect().execute(
+            'SELECT name FROM records WHERE session_id = ? AND kind = ? ORDER BY position', (sid, kind)
+        ).fetchall()
+        return [row[0] for row in rows]
+
+    def get_record(self, sid, kind, name):
+        row = self._connect().execute(
+            'SELECT data FROM records WHERE session_id = ? AND kind = ? AND name = ?', (sid, kind, name)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def get_records(self, sid, kind):
+        rows = self._connect().execute(
+            'SELECT name, data FROM records WHERE session_id = ? AND kind = ? ORDER BY position', (sid, kind)
+        ).fetchall()
+        return {name: json.loads(data) for name, data in rows}
+
+    def update_records(self, sid, kind, records, removed=(), order=None):
+        # Writes only the given records and deletes the removed ones; order
+        # renumbers positions, otherwise new records go after the rest
+        with self._connect() as db:
+            db.executemany(
+                'DELETE FROM records WHERE session_id = ? AND kind = ? AND name = ?',
+                [(sid, kind, name) for name in removed]
+            )
+            end = db.execute(
+                'SELECT COALESCE(MAX(position) + 1, 0) FROM records WHERE session_id = ? AND kind = ?', (sid, kind)
+            ).fetchone()[0]
+            db.executemany(
+                'INSERT INTO records (session_id, kind, name, position, data) VALUES (?, ?, ?, ?, ?) '
+                'ON CONFLICT(session_id, kind, name) DO UPDATE SET data = excluded.data',
+                [(sid, kind, name, end + position, json.dumps(data))
+                 for position, (name, data) in enumerate(records.items())]
+            )
+            if order is not None:
+                db.executemany(
+                    'UPDATE records SET position = ? WHERE session_id = ? AND kind = ? AND name = ?',
+                    [(position, sid, kind, name) for position, name in enumerate(order)]
+                )
+
+    def delete_records(self, sid, kind):
+        with self._connect() as db:
+            db.execute('DELETE FROM records WHERE session_id = ? AND kind = ?', (sid, kind))
+
+    def cleanup(self):
+        now = time.time()
+        with self._connect() as db:
+            db.execute('DELETE FROM records WHERE session_id IN (SELECT id FROM sessions WHERE expires <= ?)', (now,))
+            db.execute('DELETE FROM sessions WHERE expires <= ?', (now,))
+
+
+class LazyRecords(Mapping):
+    """Read-only view of one record set; each record is loaded on first use."""
+
+    def __init__(self, store, sid, kind):
+        self._store = store
+        self._sid = sid
+        self._kind = kind
+        self._names = None
+        self._loaded = {}
+
+    def _all_names(self):
+        if self._names is None:
+            self._names = self._store.record_names(self._sid, self._kind)
+        return self._names
+
+    def __getitem__(self, name):
+        if name not in self._loaded:
+            record = self._store.get_record(self._sid, self._kind, name)
+            if record is None:
+                raise KeyError(name)
+            self._loaded[name] = record
+        return self._loaded[name]
+
+    def __iter__(self):
+        return iter(self._all_names())
+
+    def __len__(self):
+        return len(self._all_names())
+
+    def __contains__(self, name):
+        return name in self._all_names()
+
+    def items(self):
+        # Walking every record is one query rather than one per file
+        if len(self._loaded) < len(self):
+            self._loaded = self._store.get_records(self._sid, self._kind)
+            self._names = list(self._loaded)
+        return [(name, self._loaded[name]) for name in self._names]
+
+    def values(self):
+        return [record for _, record in self.items()]
+
+
+class ServerSideSession(SecureCookieSession):
+    def __init__(self, initial=None, sid=None, store=None, new=False):
+        super().__init__(initial)
+        self.sid = sid
+        self.store = store
+        self.new = new
+
+    def records(self, kind):
+        return LazyRecords(self.store, self.sid, kind)
+
+    def update_records(self, kind, records, removed=(), order=None):
+        self.store.update_records(self.sid, kind, records, removed, order)
+        # Records belong to the session row, so make sure it gets saved
+        self.modified = True
+
+    def clear_records(self, kind):
+        self.store.delete_records(self.sid, kind)
+
+
+class ServerSideSessionInterface(SessionInterface):
+    """Keeps session data in a SessionStore; the cookie holds only a signed id."""
+
+    def __init__(self, store, cleanup_interval=600):
+        self.store = store
+        self.cleanup_interval = cleanup_interval
+        self._last_cleanup = 0.0
+
+    def _signer(self, app):
+        return Signer(app.secret_key, salt='session-id')
+
+    def _lifetime(self, app):
+        return app.permanent_session_lifetime.total_seconds()
+
+    def open_session(self, app, request):
+        if not app.secret_key:
+            return None
+        now = time.time()
+        if now - self._last_cleanup > self.cleanup_interval:
+            self._last_cleanup = now
+            self.store.cleanup()
+
+        cookie = request.cookies.get(self.get_cookie_name(app))
+        if cookie:
+            try:
+                sid = self._signer(app).unsign(cookie).decode('utf-8')
+            except BadSignature:
+                sid = None
+            data = self.store.load(sid) if sid else None
+            if data is not None:
+                return ServerSideSession(data, sid=sid, store=self.store)
+        return ServerSideSession(sid=secrets.token_hex(32), store=self.store, new=True)
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        secure = self.get_cookie_secure(app)
+        samesite = self.get_cookie_samesite(app)
+        httponly = self.get_cookie_httponly(app)
+
+        if session.accessed:
+            response.vary.add('Cookie')
+
+        # Same rules as Flask's cookie sessions: a session emptied during the
+        # request is deleted, an empty new one is never stored
+        if not session:
+            if session.modified:
+                self.store.delete(session.sid)
+                if not session.new:
+                    response.delete_cookie(name, domain=domain, path=path, secure=secure,
+                                           samesite=samesite, httponly=httponly)
+                    response.vary.add('Cookie')
+            return
+
+        if session.modified or session.new or self.should_set_cookie(app, session):
+            self.store.save(session.sid, dict(session), time.time() + self._lifetime(app))
+        if session.new or self.should_set_cookie(app, session):
+            response.set_cookie(
+                name,
+                self._signer(app).sign(session.sid).decode('utf-8'),
+                expires=self.get_expiration_time(app, session),
+                httponly=httponly,
+                domain=domain,
+                path=path,
+                secure=secure,
+                samesite=samesite
+            )
+            response.vary.add('Cookie')
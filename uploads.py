@@ -0,0 +1,108 @@
+import os
+import logging
+import uuid
+import hashlib
+from flask import Request, current_app
+from werkzeug.exceptions import RequestEntityTooLarge
+from archives import is_archive
+
+logger = logging.getLogger(__name__)
+
+
+class UploadBudget:
+    # Running totals for one request, checked as each chunk arrives. Archives
+    # have their own byte limit; what they expand to is checked on extraction.
+    def __init__(self, max_bytes, max_files, max_archive_bytes=0):
+        self.max_bytes = max_bytes
+        self.max_files = max_files
+        self.max_archive_bytes = max_archive_bytes
+        self.bytes = 0
+        self.files = 0
+        self.archive_bytes = 0
+
+    def add_file(self):
+        self.files += 1
+        if self.files > self.max_files:
+            raise RequestEntityTooLarge(f"Maximum {self.max_files} files allowed per upload")
+
+    def consume(self, size, archive=False):
+        if archive:
+            self.archive_bytes += size
+            if self.archive_bytes > self.max_archive_bytes:
+                raise RequestEntityTooLarge(
+                    f"Archives may total at most {self.max_archive_bytes // (1024 * 1024)}MB"
+                )
+            return
+        self.bytes += size
+        if self.bytes > self.max_bytes:
+            raise RequestEntityTooLarge(f"Total file size exceeds {self.max_bytes // (1024 * 1024)}MB limit")
+
+
+class StagedUpload:
+    """Writable target for one multipart file part.
+
+    Chunks go straight to a staging file next to their final destination and
+    are hashed on the way through, so the upload is never held in memory or
+    read back just to measure or fingerprint it.
+    """
+
+    def __init__(self, path, budget, archive=False):
+        self.path = path
+        self.archive = archive
+        self.size = 0
+        self._budget = budget
+        self._hash = hashlib.sha256()
+        self._file = open(path, 'w+b')
+
+    def write(self, data):
+        self._budget.consume(len(data), self.archive)
+        self.size += len(data)
+        self._hash.update(data)
+        return self._file.write(data)
+
+    def hexdigest(self):
+        return self._hash.hexdigest()
+
+    def claim(self, destination):
+        # Move the staged bytes into place without copying them
+        self._file.close()
+        os.replace(self.path, destination)
+        self.path = None
+        return destination
+
+    def discard(self):
+        self._file.close()
+        if self.path and os.path.exists(self.path):
+            os.remove(self.path)
+        self.path = None
+
+    def __getattr__(self, name):
+        return getattr(self._file, name)
+
+
+class StreamingUploadRequest(Request):
+    # Files are staged in UPLOAD_STAGING_FOLDER as they are parsed; anything
+    # not claimed by the view is removed in discard_staged_uploads()
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        config = current_app.config
+        if not hasattr(self, 'staged_uploads'):
+            self.staged_uploads = []
+            self.upload_budget = UploadBudget(
+                config['UPLOAD_MAX_BYTES'], config['UPLOAD_MAX_FILES'], config['UPLOAD_ARCHIVE_MAX_BYTES']
+            )
+        self.upload_budget.add_file()
+        staging = config['UPLOAD_STAGING_FOLDER']
+        os.makedirs(staging, exist_ok=True)
+        staged = StagedUpload(
+            os.path.join(staging, f"{uuid.uuid4().hex}.part"), self.upload_budget, is_archive(filename or '')
+        )
+        self.staged_uploads.append(staged)
+        return staged
+
+    def discard_staged_uploads(self):
+        for staged in getattr(self, 'staged_uploads', []):
+            try:
+                staged.discard()
+            except OSError as e:
+                logger.error("Error removing staged upload %s: %s", staged.path, e)
@@ -0,0 +1,123 @@
+import os
+import logging
+import time
+import shutil
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class WorkspaceManager:
+    """One upload directory per session under a shared root.
+
+    Every access touches a marker file so a background sweeper can delete
+    workspaces that have not been used within `ttl` seconds, and evict the
+    least recently used ones while the root is over `max_bytes`.
+    """
+
+    MARKER = '.last_access'
+
+    # One sweeper thread per root, however many managers (one per app) share it
+    _sweepers = {}
+    _sweepers_lock = threading.Lock()
+
+    def __init__(self, root, ttl=2 * 3600, max_bytes=500 * 1024 * 1024, sweep_interval=300):
+        self.root = os.path.abspath(root)
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.sweep_interval = sweep_interval
+        self._sweeper = None
+        self._lock = threading.Lock()
+        os.makedirs(self.root, exist_ok=True)
+
+    def _dir(self, owner):
+        # Owners are uuid hex strings from the session; never trust them as paths
+        if not owner or not all(c in '0123456789abcdef' for c in owner):
+            raise ValueError(f"Invalid workspace owner: {owner!r}")
+        return os.path.join(self.root, owner)
+
+    def path_for(self, owner):
+        workspace = self._dir(owner)
+        os.makedirs(workspace, exist_ok=True)
+        with open(os.path.join(workspace, self.MARKER), 'a'):
+            pass
+        os.utime(os.path.join(workspace, self.MARKER), None)
+        return workspace
+
+    def reset(self, owner):
+        # Empty the workspace but keep the directory for the new upload
+        self.remove(owner)
+        return self.path_for(owner)
+
+    def remove(self, owner):
+        shutil.rmtree(self._dir(owner), ignore_errors=True)
+
+    def _last_access(self, workspace):
+        try:
+            return os.path.getmtime(os.path.join(workspace, self.MARKER))
+        except OSError:
+            return os.path.getmtime(workspace)
+
+    @staticmethod
+    def _size(workspace):
+        total = 0
+        for dirpath, _, filenames in os.walk(workspace):
+            for name in filenames:
+                try:
+                    total += os.path.getsize(os.path.join(dirpath, name))
+                except OSError:
+                    pass
+        return total
+
+    def sweep(self):
+        now = time.time()
+        removed = 0
+        with self._lock:
+            workspaces = []
+            total = 0
+            for name in os.listdir(self.root):
+                workspace = os.path.join(self.root, name)
+                if not os.path.isdir(workspace):
+                    continue
+                try:
+                    last_access = self._last_access(workspace)
+                except OSError:
+                    continue
+                if now - last_access > self.ttl:
+                    shutil.rmtree(workspace, ignore_errors=True)
+                    removed += 1
+                    continue
+                size = self._size(workspace)
+                workspaces.append((last_access, size, workspace))
+                total += size
+
+            workspaces.sort()
+            while total > self.max_bytes and workspaces:
+                _, size, workspace = workspaces.pop(0)
+                shutil.rmtree(workspace, ignore_errors=True)
+                removed += 1
+                total -= size
+        if removed:
+            logger.info("Workspace sweeper removed %d workspace(s)", removed)
+        return removed
+
+    def start_sweeper(self):
+        with self._sweepers_lock:
+            if self._sweeper is not None:
+                return
+            running = self._sweepers.get(self.root)
+            if running is not None and running.is_alive():
+                self._sweeper = running
+                return
+
+            def run():
+                while True:
+                    time.sleep(self.sweep_interval)
+                    try:
+                        self.sweep()
+                    except Exception as e:
+                        logger.error("Workspace sweep failed: %s", e)
+
+            self._sweeper = threading.Thread(target=run, name='workspace-sweeper', daemon=True)
+            self._sweeper.start()
+            self._sweepers[self.root] = self._sweeper
@@ -0,0 +1,16 @@
+"""WSGI entry point.
+
+    WEB_CONCURRENCY=2 gunicorn -k gthread --threads 8 wsgi:app
+
+gunicorn takes its worker count from WEB_CONCURRENCY, and create_app reads
+the same variable to give each worker its share of the LLM quotas, so set
+it there rather than with -w.
+
+Each worker imports this module and builds its own app, so don't use
+--preload: the job, render and sweeper threads create_app starts would not
+survive the fork. Jobs, sessions and workspaces live on disk, so any worker
+can serve any request.
+"""
+from app import create_app
+
+app = create_app()